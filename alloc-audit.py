@@ -0,0 +1,372 @@
+# this needs python3.4 or later (for tracemalloc)
+
+# Memory allocation per call of every primitive and protocol step, so that
+# allocation churn on the hot paths (per-byte strings in xor(), hex strings
+# in long_to_padded_bytes, ..) can be measured and kept from creeping back:
+#
+#   python3 alloc-audit.py [NAME..]      audit them and print the results
+#   python3 alloc-audit.py --sites 5     also the lines allocating the most
+#   python3 alloc-audit.py --save        record the baseline for this python
+#   python3 alloc-audit.py --compare     exit 1 on a regression
+#
+# The targets are the benchmarks from benchmarks.py, long_to_padded_bytes,
+# and each stage of the vector generator. pbkdf2.py is python2-only, so
+# its pbkdf2_bin is audited as its own source run with the python2
+# builtins it expects (see pbkdf2Port). For each call it reports:
+#
+#   allocs    allocations (as seen by tracemalloc, see below)
+#   bytes     bytes allocated, whether or not freed again before returning
+#   peak      the most memory the call had allocated at any one time
+#   retained  what is still allocated after the result is gone and the
+#             garbage collector has run (caches, or leaks)
+#
+# tracemalloc only knows how much memory is allocated right now, not how
+# many allocations were made, so allocs and bytes are sampled: a profile
+# hook reads the traced total at every function call and return (python
+# and builtin), and each increase counts as one allocation. Objects made
+# and freed between two of those events are missed, so these are lower
+# bounds, but they are deterministic: the same code on the same inputs
+# gives the same numbers, which is what comparing commits needs. The
+# frames python creates for the profile hook are calibrated away. Memory
+# that C libraries (OpenSSL, scrypt) allocate themselves is not traced.
+#
+# Baselines are per python version (alloc-baselines/pyX.Y.json), since
+# allocation patterns change between versions but not between machines.
+# They record --calls too: the median of 1 call (which can still be
+# filling caches) is not the median of 3, so only runs with the same
+# --calls are compared.
+# Inputs come from a seeded entropy.DRBG, like the benchmarks'.
+
+import gc, hashlib, hmac, itertools, json, operator, os, platform, struct
+import sys, time, tracemalloc
+import entropy
+import mysrp
+import stretch
+import vectors
+import benchmarks
+from benchmarks import rng, revision
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METRICS = ["allocs", "bytes", "peak", "retained"]
+# --compare ignores increases smaller than these, whatever the tolerance
+MIN_DELTA = {"allocs": 2, "bytes": 256, "peak": 256, "retained": 256}
+
+# name -> setup(); as in benchmarks.py, setup returns the function to
+# audit. It is called again before every audited call.
+AUDITS = list(benchmarks.BENCHMARKS)
+
+def audit(name):
+    def _register(setup):
+        AUDITS.append((name, setup))
+        return setup
+    return _register
+
+@audit("srp long_to_padded_bytes")
+def _padded():
+    l = mysrp.bytes_to_long(rng.random_bytes(256))
+    return lambda: mysrp.long_to_padded_bytes(l)
+
+try:
+    import pbkdf2
+    havePBKDF2 = True
+except SyntaxError: # it is python2-only
+    havePBKDF2 = False
+
+def pbkdf2Port():
+    """pbkdf2.py's pbkdf2_bin, compiled from its source for python3: the
+    py2 builtins it uses are provided by their py3 equivalents, so it
+    makes the same objects (map() gives a list, chr() a cached 1-byte
+    string, iterating a digest no new objects)."""
+    with open(os.path.join(HERE, "pbkdf2.py")) as f:
+        source = f.read()
+    start = source.index("def pbkdf2_bin(")
+    source = source[start:source.index("\n\n\ndef ", start)]
+    chars = [bytes((i,)) for i in range(256)]
+    namespace = {"hmac": hmac, "hashlib": hashlib,
+                 "_pack_int": struct.Struct(">I").pack,
+                 "izip": zip, "starmap": itertools.starmap,
+                 "xor": operator.xor, "xrange": range,
+                 "map": lambda f, *seqs: list(map(f, *seqs)),
+                 "ord": lambda c: c, # bytes already iterate as ints
+                 "chr": chars.__getitem__}
+    exec(compile(source.replace("''", "b''"), "pbkdf2.py", "exec"),
+         namespace)
+    f = namespace["pbkdf2_bin"]
+    assert (f(b"password", b"salt", 2, keylen=40, hashfunc=hashlib.sha256)
+            == hashlib.pbkdf2_hmac("sha256", b"password", b"salt", 2, 40))
+    return f
+
+def _pbkdf2(rounds):
+    pbkdf2_bin = pbkdf2Port()
+    password, salt = rng.random_bytes(16), rng.random_bytes(32)
+    return lambda: pbkdf2_bin(password, salt, rounds, keylen=32,
+                              hashfunc=hashlib.sha256)
+if not havePBKDF2:
+    # instead of the benchmarks' setups, which need pbkdf2.py
+    for (i, (name, setup)) in enumerate(AUDITS):
+        if name.startswith("pbkdf2 rounds="):
+            rounds = int(name.split("=")[1])
+            AUDITS[i] = (name, lambda rounds=rounds: _pbkdf2(rounds))
+
+class HashlibStretch:
+    """The stretch from hashlib's PBKDF2, for the vector stages that come
+    after it when pbkdf2.py cannot be imported."""
+    def stretch(self, emailUTF8, passwordUTF8, rounds, N, r, p):
+        import hashlib
+        k1 = hashlib.pbkdf2_hmac("sha256", passwordUTF8,
+                                 stretch.KWE("first-PBKDF", emailUTF8),
+                                 rounds, 32)
+        k2 = stretch.scrypt_hash(k1, stretch.KW("scrypt"), N=N, r=r, p=p,
+                                 buflen=32)
+        stretchedPW = hashlib.pbkdf2_hmac("sha256", k2+passwordUTF8,
+                                          stretch.KWE("second-PBKDF",
+                                                      emailUTF8),
+                                          rounds, 32)
+        return k1, k2, stretchedPW
+
+_computed = None
+def _stage(name):
+    # the earlier stages are computed once, and copied into a fresh
+    # Vectors for every call, so that only this stage is audited
+    global _computed
+    if name == "stretch" and not havePBKDF2:
+        raise ImportError("pbkdf2.py needs python2")
+    if _computed is None:
+        _computed = vectors.Vectors(kdf=None if havePBKDF2
+                                    else HashlibStretch())
+    v = vectors.Vectors(kdf=_computed.kdf)
+    for d in vectors.closure([name]):
+        if d != name:
+            v.sections[d] = _computed.compute(d)
+    v.results.update(_computed.results)
+    return lambda: v.compute(name)
+for name in vectors.ORDER:
+    audit("vectors " + name)(lambda name=name: _stage(name))
+
+
+def _nop():
+    pass
+
+def _churn(f, sites):
+    """Call f() with the profile hook on, and return (result, allocations,
+    bytes, python calls). Allocations are added to sites[(file, line,
+    function)] = [allocations, bytes]."""
+    state = [None, 0, 0, 0] # traced bytes, allocations, bytes, calls
+    def hook(frame, event, arg):
+        current = tracemalloc.get_traced_memory()[0]
+        if state[0] is None:
+            # the first event, which comes before any of f() has run:
+            # whatever is traced so far is setting up the hook
+            state[0] = current
+            return
+        if event == "call":
+            state[3] += 1
+            # what allocated happened in the caller, getting ready
+            frame = frame.f_back
+        if current > state[0]:
+            state[1] += 1
+            state[2] += current - state[0]
+            if frame is not None:
+                code = frame.f_code
+                site = sites.setdefault((code.co_filename, frame.f_lineno,
+                                         code.co_name), [0, 0])
+                site[0] += 1
+                site[1] += current - state[0]
+        state[0] = current
+    tracemalloc.start()
+    sys.setprofile(hook)
+    try:
+        result = f()
+    finally:
+        sys.setprofile(None)
+        hook(None, None, None) # anything allocated after the last event
+        tracemalloc.stop()
+    return result, state[1], state[2], state[3]
+
+def _footprint(f):
+    """Call f() and return (peak, retained) bytes."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = f()
+        peak = tracemalloc.get_traced_memory()[1]
+        del result
+        gc.collect()
+        # leaving out what this file (peak, for one) and the snapshot
+        # itself allocated
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, __file__),
+             tracemalloc.Filter(False, tracemalloc.__file__)])
+    finally:
+        tracemalloc.stop()
+    return peak, sum(s.size for s in snapshot.statistics("filename"))
+
+_overhead = None
+def overhead():
+    """What the profile hook itself costs per python call (the frame
+    object it makes python create), as (allocations, bytes)."""
+    global _overhead
+    if _overhead is None:
+        calls = 1000
+        def nops():
+            for i in range(calls):
+                _nop()
+        _churn(nops, {}) # warm up
+        result, allocs, nbytes, pycalls = _churn(nops, {})
+        _overhead = (float(allocs) / (pycalls-1), float(nbytes) / (pycalls-1))
+    return _overhead
+
+def measure(setup, calls, sites):
+    """Audit 'calls' calls, each of a fresh setup(), and return the median
+    of each metric."""
+    perCallAllocs, perCallBytes = overhead()
+    setup()() # the first call may fill caches or import things
+    samples = dict((m, []) for m in METRICS)
+    for i in range(calls):
+        f = setup()
+        gc.collect()
+        result, allocs, nbytes, pycalls = _churn(f, sites)
+        del result
+        samples["allocs"].append(max(0, allocs - perCallAllocs*pycalls))
+        samples["bytes"].append(max(0, nbytes - perCallBytes*pycalls))
+        f = setup()
+        peak, retained = _footprint(f)
+        samples["peak"].append(peak)
+        samples["retained"].append(retained)
+    return dict((m, int(round(sorted(s)[len(s)//2])))
+                for (m, s) in samples.items())
+
+def machine():
+    return "py%d.%d" % sys.version_info[:2]
+
+def formatSite(site):
+    (filename, line, function) = site
+    if filename.startswith(HERE + os.sep):
+        filename = filename[len(HERE)+1:]
+    return "%s:%d (%s)" % (filename, line, function)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="measure memory "
+                                     "allocation by the crypto primitives "
+                                     "and protocol steps")
+    parser.add_argument("--list", action="store_true",
+                        help="list the targets")
+    parser.add_argument("--calls", type=int,
+                        help="calls audited per target, of which the "
+                        "median counts (default: 3, or as many as the "
+                        "baseline when comparing)")
+    parser.add_argument("--sites", type=int, default=0, metavar="N",
+                        help="show the N lines that allocated the most "
+                        "bytes in each target")
+    parser.add_argument("--json", metavar="FILE", help="save the results")
+    parser.add_argument("--baseline-dir",
+                        default=os.path.join(HERE, "alloc-baselines"),
+                        help="where the per-python baselines are kept")
+    parser.add_argument("--save", action="store_true",
+                        help="save the results as the baseline for this "
+                        "python (%s.json)" % machine())
+    parser.add_argument("--compare", action="store_true",
+                        help="compare with the baseline, and exit 1 if "
+                        "anything allocates more than --tolerance allows")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with this file instead")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed increase against the baseline "
+                        "(default: 0.10, i.e. 10%%)")
+    parser.add_argument("targets", nargs="*", metavar="NAME",
+                        help="targets to audit, or prefixes like 'vectors' "
+                        "(default: all)")
+    opts = parser.parse_args()
+    if opts.list:
+        for (name, setup) in AUDITS:
+            print(name)
+        return
+
+    baselinePath = os.path.join(opts.baseline_dir, machine() + ".json")
+    baseline = None
+    if opts.compare or opts.baseline:
+        path = opts.baseline or baselinePath
+        if not os.path.exists(path):
+            sys.exit("no baseline %s: run with --save first" % path)
+        with open(path) as f:
+            baseline = json.load(f)
+        if opts.calls is None:
+            opts.calls = baseline.get("calls", 3)
+        if baseline.get("calls") != opts.calls:
+            sys.exit("%s was measured with --calls %s, not %d: the medians "
+                     "would not compare" % (path, baseline.get("calls"),
+                                            opts.calls))
+    if opts.calls is None:
+        opts.calls = 3
+
+    entropy.set_source(entropy.DRBG("picl-alloc-audit:ephemerals"))
+    results = {}
+    print("%-28s %8s %10s %10s %10s" % ("per call", "allocs", "bytes",
+                                        "peak", "retained"))
+    for (name, setup) in AUDITS:
+        if opts.targets and not [t for t in opts.targets
+                                 if name == t or name.startswith(t+" ")]:
+            continue
+        sites = {}
+        try:
+            r = measure(setup, opts.calls, sites)
+        except ImportError as e:
+            print("%-28s skipped: %s" % (name, e))
+            continue
+        results[name] = r
+        print("%-28s %8d %10d %10d %10d" % (name, r["allocs"], r["bytes"],
+                                            r["peak"], r["retained"]))
+        if opts.sites:
+            top = sorted(sites.items(), key=lambda s: -s[1][1])
+            for (site, (allocs, nbytes)) in top[:opts.sites]:
+                print("    %10d allocs %12d bytes  %s"
+                      % (allocs // opts.calls, nbytes // opts.calls,
+                         formatSite(site)))
+
+    saved = {"machine": machine(), "python": sys.version.split()[0],
+             "platform": platform.platform(), "revision": revision(),
+             "time": int(time.time()), "calls": opts.calls,
+             "per_call": results}
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+    if opts.save:
+        if not os.path.isdir(opts.baseline_dir):
+            os.makedirs(opts.baseline_dir)
+        if os.path.exists(baselinePath):
+            # keep the targets this run skipped, if measured the same way
+            with open(baselinePath) as f:
+                old = json.load(f)
+            if old.get("calls") == opts.calls:
+                saved["per_call"] = dict(old["per_call"], **results)
+        with open(baselinePath, "w") as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+        print("saved %s" % baselinePath)
+    if baseline is not None:
+        print()
+        print("against %s (revision %s)" % (path, baseline.get("revision")))
+        regressed = []
+        for (name, setup) in AUDITS:
+            old = baseline["per_call"].get(name)
+            new = results.get(name)
+            if old is None or new is None:
+                continue
+            changes = []
+            for m in METRICS:
+                if new[m] == old[m]:
+                    continue
+                flag = ""
+                if (new[m] > old[m] * (1 + opts.tolerance)
+                    and new[m] - old[m] >= MIN_DELTA[m]):
+                    flag = " REGRESSION"
+                    regressed.append(name)
+                changes.append("%s %d -> %d%s" % (m, old[m], new[m], flag))
+            print("%-28s %s" % (name, ", ".join(changes) or "same"))
+        if regressed:
+            print("%d regression(s) beyond %.0f%%"
+                  % (len(set(regressed)), 100*opts.tolerance))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# this should work with both python2.7 and python3.3
+
+# Timings of every primitive and protocol step, with per-machine baselines
+# to catch regressions:
+#
+#   python benchmarks.py [NAME..]     run them and print the timings
+#   python benchmarks.py --save       also record this machine's baseline
+#   python benchmarks.py --compare    exit 1 on a regression
+#
+# Baselines live in bench-baselines/HOST-pyX.Y.json (see --baseline-dir),
+# so numbers from different machines or interpreters are never compared.
+# --compare flags every benchmark more than --tolerance slower than its
+# baseline. Inputs come from a seeded entropy.DRBG, so each run times the
+# same work.
+#
+# "make bench" compares against the baseline, "make bench-baseline"
+# records a new one.
+
+import gc, json, os, platform, sys, time
+import six
+from six import print_
+import entropy
+from hkdf import HKDF
+from bytexor import xor
+import bundle
+import mysrp
+import stretch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def KW(name):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name)
+
+rng = entropy.DRBG("picl-benchmarks")
+
+# name -> setup(); setup returns the function to time, which takes no
+# arguments. Registered in the order they are reported.
+BENCHMARKS = []
+
+def benchmark(name):
+    def _register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return _register
+
+def _hkdf(dkLen):
+    SKM = rng.random_bytes(32)
+    return lambda: HKDF(SKM=SKM, XTS=None, CTXinfo=KW("bench"), dkLen=dkLen)
+for dkLen in (32, 64, 160, 288, 1024):
+    benchmark("hkdf dkLen=%d" % dkLen)(lambda dkLen=dkLen: _hkdf(dkLen))
+
+def _pbkdf2(rounds):
+    try:
+        import pbkdf2
+    except SyntaxError:
+        raise ImportError("pbkdf2.py needs python2")
+    password, salt = rng.random_bytes(16), rng.random_bytes(32)
+    return lambda: stretch.pbkdf2_bin(password, salt, rounds, keylen=32,
+                                      hashfunc=stretch.sha256)
+for rounds in (1000, 5000, 20000):
+    benchmark("pbkdf2 rounds=%d" % rounds)(lambda r=rounds: _pbkdf2(r))
+
+def _scrypt(N):
+    import scrypt # stretch only imports it when called
+    k1 = rng.random_bytes(32)
+    return lambda: stretch.scrypt_hash(k1, KW("scrypt"), N=N,
+                                       r=stretch.SCRYPT_R, p=stretch.SCRYPT_P,
+                                       buflen=32)
+for N in (1024, 16*1024, 64*1024):
+    benchmark("scrypt N=%d" % N)(lambda N=N: _scrypt(N))
+
+@benchmark("srp create_verifier")
+def _verifier():
+    emailUTF8, srpPW, salt = b"bench@example.org", rng.random_bytes(32), \
+                             rng.random_bytes(32)
+    return lambda: mysrp.create_verifier(emailUTF8, srpPW, salt)
+
+def _srpAccount():
+    emailUTF8, srpPW = b"bench@example.org", rng.random_bytes(32)
+    salt = rng.random_bytes(32)
+    v = mysrp.create_verifier(emailUTF8, srpPW, salt)[0]
+    return emailUTF8, srpPW, salt, v
+
+@benchmark("srp handshake")
+def _handshake():
+    emailUTF8, srpPW, salt, v = _srpAccount()
+    def handshake():
+        c, s = mysrp.Client(), mysrp.Server(v)
+        A = c.one()
+        B = s.one()
+        M1 = c.two(B, salt, emailUTF8, srpPW)
+        c.three(s.two(A, M1))
+    return handshake
+
+@benchmark("srp server side")
+def _serverSide():
+    # what the auth server spends per login: Server.one and Server.two.
+    # With b fixed, the client's A and M1 can be computed once up front.
+    emailUTF8, srpPW, salt, v = _srpAccount()
+    b = mysrp.bytes_to_long(rng.random_bytes(32))
+    c = mysrp.Client()
+    A = c.one(mysrp.bytes_to_long(rng.random_bytes(32)))
+    M1 = c.two(mysrp.Server(v).one(b), salt, emailUTF8, srpPW)
+    def serverSide():
+        s = mysrp.Server(v)
+        s.one(b)
+        s.two(A, M1)
+    return serverSide
+
+def _xor(size):
+    a, b = rng.random_bytes(size), rng.random_bytes(size)
+    return lambda: xor(a, b)
+for size in (32, 64, 288, 1024, 8192):
+    benchmark("xor %d bytes" % size)(lambda size=size: _xor(size))
+
+def _seal(size):
+    token, plaintext = rng.random_bytes(32), rng.random_bytes(size)
+    return lambda: bundle.seal(token, "account/keys", plaintext)
+def _open(size):
+    token, plaintext = rng.random_bytes(32), rng.random_bytes(size)
+    b = bundle.seal(token, "account/keys", plaintext)
+    return lambda: bundle.open(token, "account/keys", b)
+for size in (64, 1024):
+    benchmark("bundle seal %d bytes" % size)(lambda size=size: _seal(size))
+    benchmark("bundle open %d bytes" % size)(lambda size=size: _open(size))
+
+
+def measure(f, seconds, repeats=5):
+    """Return the best of 'repeats' measurements of the seconds per call
+    of f(), each calling it for about 'seconds'. The best rather than the
+    mean, since noise only ever makes a run slower."""
+    start = time.time()
+    f()
+    once = time.time() - start
+    number = max(1, int(seconds / max(once, 1e-7)))
+    best = None
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for r in range(repeats):
+            start = time.time()
+            for i in range(number):
+                f()
+            perCall = (time.time() - start) / number
+            if best is None or perCall < best:
+                best = perCall
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    return best
+
+def machine():
+    host = platform.node().split(".")[0] or "unknown"
+    return "%s-py%d.%d" % (host, sys.version_info[0], sys.version_info[1])
+
+def revision():
+    import subprocess
+    try:
+        with open(os.devnull, "w") as devnull:
+            out = subprocess.check_output(["git", "rev-parse", "--short",
+                                           "HEAD"], cwd=HERE, stderr=devnull)
+        return out.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def formatTime(seconds):
+    if seconds >= 0.1:
+        return "%8.3f s " % seconds
+    if seconds >= 1e-4:
+        return "%8.3f ms" % (1e3*seconds)
+    return "%8.3f us" % (1e6*seconds)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="time the crypto "
+                                     "primitives and protocol steps")
+    parser.add_argument("--list", action="store_true",
+                        help="list the benchmarks")
+    parser.add_argument("--seconds", type=float, default=0.2,
+                        help="time to spend on each measurement "
+                        "(default: 0.2)")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="measurements per benchmark, of which the "
+                        "fastest counts (default: 5)")
+    parser.add_argument("--json", metavar="FILE", help="save the results")
+    parser.add_argument("--baseline-dir",
+                        default=os.path.join(HERE, "bench-baselines"),
+                        help="where per-machine baselines are kept")
+    parser.add_argument("--save", action="store_true",
+                        help="save the results as this machine's baseline "
+                        "(%s.json)" % machine())
+    parser.add_argument("--compare", action="store_true",
+                        help="compare with this machine's baseline, and exit "
+                        "1 if anything got slower than --tolerance allows")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with this file instead")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed slowdown against the baseline "
+                        "(default: 0.15, i.e. 15%%)")
+    parser.add_argument("benchmarks", nargs="*", metavar="NAME",
+                        help="benchmarks to run, or prefixes like 'hkdf' "
+                        "(default: all)")
+    opts = parser.parse_args()
+    if opts.list:
+        for (name, setup) in BENCHMARKS:
+            print_(name)
+        return
+
+    # Client.one and Server.one draw ephemerals; make those repeatable too
+    entropy.set_source(entropy.DRBG("picl-benchmarks:ephemerals"))
+    results = {}
+    for (name, setup) in BENCHMARKS:
+        if opts.benchmarks and not [b for b in opts.benchmarks
+                                    if name == b or name.startswith(b+" ")]:
+            continue
+        try:
+            f = setup()
+        except ImportError as e: # no scrypt module, or no python2
+            print_("%-28s skipped: %s" % (name, e))
+            continue
+        perCall = measure(f, opts.seconds, opts.repeats)
+        results[name] = perCall
+        print_("%-28s %s %12.1f /s" % (name, formatTime(perCall),
+                                      1.0/perCall))
+
+    saved = {"machine": machine(), "python": sys.version.split()[0],
+             "platform": platform.platform(), "revision": revision(),
+             "time": int(time.time()), "seconds_per_call": results}
+    baselinePath = os.path.join(opts.baseline_dir, machine() + ".json")
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+    if opts.save:
+        if not os.path.isdir(opts.baseline_dir):
+            os.makedirs(opts.baseline_dir)
+        if os.path.exists(baselinePath):
+            # keep the benchmarks this run skipped
+            with open(baselinePath) as f:
+                old = json.load(f)["seconds_per_call"]
+            saved["seconds_per_call"] = dict(old, **results)
+        with open(baselinePath, "w") as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+        print_("saved %s" % baselinePath)
+    if opts.compare or opts.baseline:
+        path = opts.baseline or baselinePath
+        if not os.path.exists(path):
+            sys.exit("no baseline %s: run with --save first" % path)
+        with open(path) as f:
+            baseline = json.load(f)
+        print_()
+        print_("against %s (revision %s)" % (path, baseline.get("revision")))
+        regressed = []
+        for (name, setup) in BENCHMARKS:
+            old = baseline["seconds_per_call"].get(name)
+            new = results.get(name)
+            if old is None or new is None:
+                continue
+            flag = ""
+            if new > old * (1 + opts.tolerance):
+                flag = "  REGRESSION"
+                regressed.append(name)
+            print_("%-28s %s -> %s (%+.0f%%)%s"
+                   % (name, formatTime(old), formatTime(new),
+                      100.0*(new-old)/old, flag))
+        if regressed:
+            print_("%d regression(s) beyond %.0f%%"
+                   % (len(regressed), 100*opts.tolerance))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
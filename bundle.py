@@ -0,0 +1,283 @@
+# this should work with both python2.7 and python3.3
+
+# The encrypted-bundle construction used by /auth, /session, /account/keys,
+# /password/change and /account/reset:
+#
+#   keys = HKDF(SKM=token, CTXinfo=KW(context),
+#               dkLen=prefix + 32 + len(plaintext))
+#   [prefix bytes: tokenID, reqHMACkey, ...] [hmacKey: 32] [xorKey]
+#   ciphertext = plaintext XOR xorKey
+#   bundle = ciphertext + HMAC-SHA256(hmacKey, ciphertext)
+#
+# All keys come out of a single HKDF call, written into a KeyBuffer and
+# sliced with memoryviews; wipe() zeroes them once the bundle is done.
+# open() checks the MAC before doing any XOR work, and can decrypt into a
+# caller-supplied buffer.
+
+import hmac, struct
+from hashlib import sha256
+import six
+from hkdf import HKDF
+from bytexor import xor, xor_into
+from keybuf import KeyBuffer
+import instrument
+
+MAC_LENGTH = 32
+
+# How many bytes of key material come before the response keys, for the
+# contexts where the same HKDF call also yields the request keys (tokenID
+# and reqHMACkey). Everything else has no prefix.
+PREFIX = {
+    "account/keys": 2*32,
+    "account/reset": 32,
+    }
+
+class BundleError(ValueError):
+    pass
+
+def KW(name):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name)
+
+class BundleKeys:
+    """Key material for one (token, context, plaintext length), in a
+    KeyBuffer. prefix is a memoryview of the bytes before hmacKey (use
+    split() to get tokenID etc. out of it), xorKey a memoryview of the
+    keystream, hmacKey a KeyBuffer of its own (hmac wants a bytearray,
+    not a view). Use as a context manager, or call wipe(), to zero it all
+    when done."""
+    def __init__(self, token, context, length, prefix=None):
+        if prefix is None:
+            prefix = PREFIX.get(context, 0)
+        self.length = length
+        self.material = KeyBuffer(prefix+MAC_LENGTH+length)
+        HKDF(SKM=token, CTXinfo=KW(context), XTS=None,
+             dkLen=len(self.material), out=self.material)
+        self.prefix = self.material[:prefix]
+        self.hmacKey = KeyBuffer(self.material[prefix:prefix+MAC_LENGTH])
+        self.xorKey = self.material[prefix+MAC_LENGTH:]
+
+    def split(self):
+        """Return the prefix as a list of 32-byte strings."""
+        p = self.prefix
+        return [p[i:i+32].tobytes() for i in range(0, len(p), 32)]
+
+    def wipe(self):
+        self.material.wipe()
+        self.hmacKey.wipe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.wipe()
+
+    def mac(self, ciphertext):
+        return hmac.new(self.hmacKey, ciphertext, sha256).digest()
+
+    def seal(self, plaintext):
+        assert len(plaintext) == self.length, (len(plaintext), self.length)
+        ciphertext = xor(plaintext, self.xorKey)
+        return ciphertext + self.mac(ciphertext)
+
+    @instrument.timed("bundle.open")
+    def open(self, bundle, out=None):
+        """Verify and decrypt bundle. With out= (a writable buffer of at
+        least self.length bytes), the plaintext is written into out and a
+        memoryview of it is returned; otherwise returns bytes. Raises
+        BundleError if the MAC does not match."""
+        bundle = memoryview(bundle)
+        if len(bundle) != self.length + MAC_LENGTH:
+            raise BundleError("bundle has the wrong length")
+        ciphertext = bundle[:-MAC_LENGTH]
+        if not hmac.compare_digest(self.mac(ciphertext),
+                                   bundle[-MAC_LENGTH:].tobytes()):
+            raise BundleError("bundle MAC does not match")
+        if out is None:
+            return xor(ciphertext, self.xorKey)
+        out = memoryview(out)[:self.length]
+        out[:] = ciphertext
+        return xor_into(out, self.xorKey)
+
+def seal(token, context, plaintext, prefix=None):
+    """Encrypt and MAC plaintext with keys derived from token. Returns the
+    bundle (ciphertext+MAC) as bytes."""
+    with BundleKeys(token, context, len(plaintext), prefix) as keys:
+        return keys.seal(plaintext)
+
+def open(token, context, bundle, prefix=None, out=None):
+    """Verify and decrypt a bundle made by seal(). See BundleKeys.open."""
+    length = len(bundle) - MAC_LENGTH
+    if length < 0:
+        raise BundleError("bundle is too short")
+    with BundleKeys(token, context, length, prefix) as keys:
+        return keys.open(bundle, out)
+
+def open_many(items, prefix=None):
+    """Verify and decrypt many bundles, given as (token, context, bundle)
+    tuples. All plaintexts are decrypted into one preallocated buffer.
+    Returns a list with a memoryview of each plaintext, or None for each
+    bundle that failed to verify."""
+    items = list(items)
+    lengths = [max(len(bundle) - MAC_LENGTH, 0) for (_, _, bundle) in items]
+    buf = memoryview(bytearray(sum(lengths)))
+    results = []
+    offset = 0
+    for (token, context, bundle), length in zip(items, lengths):
+        out = buf[offset:offset+length]
+        offset += length
+        try:
+            results.append(open(token, context, bundle, prefix, out))
+        except BundleError:
+            results.append(None)
+    return results
+
+
+# Streaming bundles, for payloads too large for one keystream (HKDF can
+# only produce 255*32 = 8160 bytes) or too large to hold in memory. This
+# is an extension of the spec's construction, not part of it:
+#
+#   (macKey, streamKey) = HKDF(SKM=token, CTXinfo=KW(context+"/stream"),
+#                              dkLen=2*32)
+#   for chunk number i (counting from 0):
+#     keystream_i = HKDF(SKM=streamKey,
+#                        CTXinfo=KW(context+"/stream/chunk") + uint64(i),
+#                        dkLen=len(chunk_i))
+#     ciphertext_i = chunk_i XOR keystream_i
+#     record_i = ciphertext_i + HMAC-SHA256(macKey, uint64(i) + last +
+#                                           ciphertext_i)
+#
+# where 'last' is one byte, 1 for the final chunk and 0 otherwise. Every
+# chunk but the last is exactly chunk_size bytes long; the last one may be
+# shorter (or even empty). Each record is verified before it is decrypted,
+# and the index and 'last' flag in the MAC stop records from being
+# reordered, dropped, or the stream from being truncated.
+
+DEFAULT_CHUNK_SIZE = 4096
+MAX_CHUNK_SIZE = 255*32
+_chunk_header = struct.Struct(">QB")
+
+class _Stream:
+    def __init__(self, token, context, chunk_size):
+        assert 0 < chunk_size <= MAX_CHUNK_SIZE, chunk_size
+        self.chunk_size = chunk_size
+        self.context = KW(context+"/stream/chunk")
+        self.keys = KeyBuffer(2*32)
+        HKDF(SKM=token, CTXinfo=KW(context+"/stream"), XTS=None,
+             dkLen=2*32, out=self.keys)
+        self.macKey = KeyBuffer(self.keys[:32])
+        self.streamKey = self.keys[32:]
+        self.keystream = KeyBuffer(chunk_size) # reused for every chunk
+        self.index = 0
+        self.buf = bytearray()
+        self.finished = False
+
+    def _keystream(self, length):
+        return HKDF(SKM=self.streamKey, XTS=None, dkLen=length,
+                    CTXinfo=self.context + struct.pack(">Q", self.index),
+                    out=self.keystream)
+
+    def wipe(self):
+        self.keys.wipe()
+        self.macKey.wipe()
+        self.keystream.wipe()
+
+    def _mac(self, ciphertext, last):
+        h = hmac.new(self.macKey, _chunk_header.pack(self.index, last),
+                     sha256)
+        h.update(ciphertext)
+        return h.digest()
+
+class StreamSealer(_Stream):
+    """Encrypt a payload of any size, piece by piece: feed it to update()
+    and write out whatever update() and then finish() return."""
+    def __init__(self, token, context, chunk_size=DEFAULT_CHUNK_SIZE):
+        _Stream.__init__(self, token, context, chunk_size)
+
+    def _seal(self, chunk, last):
+        out = bytearray(chunk)
+        xor_into(out, self._keystream(len(out)))
+        out += self._mac(out, last)
+        self.index += 1
+        return bytes(out)
+
+    def update(self, data):
+        assert not self.finished
+        self.buf += data
+        out = []
+        # hold back a full chunk until we know whether it is the last one
+        while len(self.buf) > self.chunk_size:
+            out.append(self._seal(memoryview(self.buf)[:self.chunk_size], 0))
+            del self.buf[:self.chunk_size]
+        return b"".join(out)
+
+    def finish(self):
+        assert not self.finished
+        self.finished = True
+        out = self._seal(self.buf, 1)
+        self.buf = bytearray()
+        self.wipe()
+        return out
+
+class StreamOpener(_Stream):
+    """Verify and decrypt what a StreamSealer produced. update() returns
+    the plaintext of every complete record so far; finish() returns the
+    rest and raises BundleError if the stream was cut short. Any record
+    that fails to verify raises BundleError before it is decrypted."""
+    def __init__(self, token, context, chunk_size=DEFAULT_CHUNK_SIZE):
+        _Stream.__init__(self, token, context, chunk_size)
+        self.record_size = chunk_size + MAC_LENGTH
+
+    def _open(self, record, last):
+        ciphertext = record[:-MAC_LENGTH]
+        if not hmac.compare_digest(self._mac(ciphertext, last),
+                                   record[-MAC_LENGTH:].tobytes()):
+            raise BundleError("stream record %d MAC does not match"
+                              % self.index)
+        out = bytearray(ciphertext)
+        xor_into(out, self._keystream(len(out)))
+        self.index += 1
+        return bytes(out)
+
+    def update(self, data):
+        assert not self.finished
+        self.buf += data
+        out = []
+        while len(self.buf) > self.record_size:
+            out.append(self._open(memoryview(self.buf)[:self.record_size], 0))
+            del self.buf[:self.record_size]
+        return b"".join(out)
+
+    def finish(self):
+        assert not self.finished
+        self.finished = True
+        try:
+            if len(self.buf) < MAC_LENGTH:
+                raise BundleError("stream is truncated")
+            out = self._open(memoryview(self.buf), 1)
+        finally:
+            self.wipe()
+        self.buf = bytearray()
+        return out
+
+def _pump(stream, reader, writer, read_size):
+    while True:
+        data = reader.read(read_size)
+        if not data:
+            break
+        writer.write(stream.update(data))
+    writer.write(stream.finish())
+
+def seal_stream(token, context, reader, writer,
+                chunk_size=DEFAULT_CHUNK_SIZE):
+    """Read plaintext from reader until EOF and write the sealed stream to
+    writer, in constant memory."""
+    _pump(StreamSealer(token, context, chunk_size), reader, writer,
+          chunk_size)
+
+def open_stream(token, context, reader, writer,
+                chunk_size=DEFAULT_CHUNK_SIZE):
+    """Read a sealed stream from reader and write the plaintext to writer,
+    in constant memory. Raises BundleError if any record fails to verify;
+    everything written up to that point came from verified records."""
+    _pump(StreamOpener(token, context, chunk_size), reader, writer,
+          chunk_size + MAC_LENGTH)
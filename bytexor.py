@@ -0,0 +1,110 @@
+# this should work with both python2.7 and python3.3
+
+# Whole-buffer XOR for the bundle keystreams. The obvious per-byte loop
+# (b"".join(int2byte(ord(a)^ord(b)) ...)) allocates a couple of objects
+# per byte. Here the buffers are turned into two big integers instead, so
+# the XOR itself is a single operation on machine words. When NumPy is
+# installed, larger buffers are XORed with it instead, which is faster
+# still and can work in place. It is only imported for the first buffer
+# that big, since importing it costs more than small buffers ever save.
+#
+# Run "python bytexor.py" to benchmark the strategies across payload
+# sizes.
+
+import binascii, os, time
+import six
+from six import print_
+
+numpy = None
+_looked = False
+
+def _numpy():
+    """Import numpy on first use; None if it is not installed."""
+    global numpy, _looked
+    if not _looked:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy, _looked = module, True
+    return numpy
+
+# below this many bytes the big-integer path beats NumPy's per-call overhead
+NUMPY_THRESHOLD = 512
+
+if six.PY3:
+    def _to_int(s):
+        return int.from_bytes(s, "big")
+    def _to_bytes(n, length):
+        return n.to_bytes(length, "big")
+else:
+    def _to_int(s):
+        return int(binascii.hexlify(s), 16) if len(s) else 0
+    def _to_bytes(n, length):
+        return binascii.unhexlify("%0*x" % (2*length, n)) if length else b""
+
+def _xor_int(s1, s2):
+    return _to_bytes(_to_int(s1) ^ _to_int(s2), len(s1))
+
+def _xor_numpy(s1, s2):
+    a = numpy.frombuffer(s1, dtype=numpy.uint8)
+    b = numpy.frombuffer(s2, dtype=numpy.uint8)
+    return numpy.bitwise_xor(a, b).tobytes()
+
+def xor(s1, s2):
+    """Return s1 XOR s2 as bytes. The arguments can be bytes, bytearrays,
+    or memoryviews, and must have the same length."""
+    assert len(s1) == len(s2), (len(s1), len(s2))
+    if len(s1) >= NUMPY_THRESHOLD and _numpy() is not None:
+        return _xor_numpy(s1, s2)
+    return _xor_int(s1, s2)
+
+def xor_into(buf, other):
+    """XOR other into buf, which must be a writable bytearray or
+    memoryview of the same length. Returns buf."""
+    assert len(buf) == len(other), (len(buf), len(other))
+    if len(buf) >= NUMPY_THRESHOLD and _numpy() is not None:
+        a = numpy.frombuffer(buf, dtype=numpy.uint8)
+        numpy.bitwise_xor(a, numpy.frombuffer(other, dtype=numpy.uint8),
+                          out=a)
+    else:
+        buf[:] = _xor_int(buf, other)
+    return buf
+
+
+def _xor_bytewise(s1, s2):
+    # the original implementation, for comparison
+    return b"".join([six.int2byte(ord(s1[i:i+1])^ord(s2[i:i+1]))
+                     for i in range(len(s1))])
+
+def bench(sizes=(32, 64, 128, 288, 512, 1024, 4096, 8192), seconds=0.2):
+    """Print microseconds per call of each strategy at each size."""
+    strategies = [("bytewise", _xor_bytewise), ("int", _xor_int)]
+    if _numpy() is not None:
+        strategies.append(("numpy", _xor_numpy))
+    strategies.append(("xor()", xor))
+    print_("%8s" % "bytes" + "".join("%12s" % n for (n, _) in strategies)
+           + "%14s" % "xor_into()")
+    for size in sizes:
+        s1, s2 = os.urandom(size), os.urandom(size)
+        expected = _xor_bytewise(s1, s2)
+        row = "%8d" % size
+        for (name, f) in strategies:
+            assert f(s1, s2) == expected, name
+            row += "%12.2f" % _time(f, s1, s2, seconds)
+        buf = bytearray(s1)
+        row += "%14.2f" % _time(xor_into, buf, s2, seconds)
+        print_(row)
+
+def _time(f, a, b, seconds):
+    calls = 0
+    start = now = time.time()
+    while now - start < seconds:
+        for i in range(100):
+            f(a, b)
+        calls += 100
+        now = time.time()
+    return 1e6 * (now - start) / calls
+
+if __name__ == '__main__':
+    bench()
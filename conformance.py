@@ -0,0 +1,314 @@
+# this should work with both python2.7 and python3.3
+
+# Replay vector sets (as written by picl-crypto.py --format=jsonl|binary)
+# against an implementation of the spec, one intermediate value at a time.
+#
+# The implementation under test is reached through an adapter: a subclass
+# of Implementation that overrides the primitives with calls into the
+# other implementation (through a subprocess, FFI, an HTTP test endpoint,
+# whatever it takes). Implementation itself is this repository's reference
+# code. Each section is checked using the expected values from the vector
+# file as its inputs, so one divergence does not cascade into the rest of
+# the set and the first mismatch points at the step that is wrong.
+
+import binascii, time
+from hashlib import sha256
+import hmac
+import mysrp
+import stretch
+import vectors
+from vectors import KW, KWE, split
+
+class Implementation:
+    """The reference implementation. Arguments and results are byte
+    strings, except for the SRP private ephemerals a and b, which are
+    integers."""
+
+    def pbkdf2_sha256(self, password, salt, rounds, dkLen):
+        return stretch.pbkdf2_bin(password, salt, rounds, keylen=dkLen,
+                                  hashfunc=sha256)
+
+    def scrypt(self, password, salt, N, r, p, dkLen):
+        return stretch.scrypt_hash(password, salt, N=N, r=r, p=p,
+                                   buflen=dkLen)
+
+    def hkdf(self, SKM, XTS, CTXinfo, dkLen):
+        return vectors.HKDF(SKM=SKM, XTS=XTS, CTXinfo=CTXinfo, dkLen=dkLen)
+
+    def hmac_sha256(self, key, msg):
+        return hmac.new(key, msg, sha256).digest()
+
+    def xor(self, s1, s2):
+        return vectors.xor(s1, s2)
+
+    def srp_verifier(self, emailUTF8, srpPW, srpSalt):
+        """Return (x, verifier), both as padded byte strings."""
+        (v_str, _, x_bytes, _, _) = mysrp.create_verifier(emailUTF8, srpPW,
+                                                          srpSalt)
+        return x_bytes, v_str
+
+    def srp_server_one(self, verifier, b):
+        return mysrp.Server(verifier).one(b)
+
+    def srp_client_one(self, a):
+        return mysrp.Client().one(a)
+
+    def srp_client_two(self, a, B, srpSalt, emailUTF8, srpPW):
+        """Return (u, S, M1, K)."""
+        c = mysrp.Client()
+        c.one(a)
+        M1 = c.two(B, srpSalt, emailUTF8, srpPW)
+        return c._debug_u_bytes, c._debug_S_bytes, M1, c.get_key()
+
+    def srp_server_two(self, verifier, b, A, M1):
+        """Return K, or raise ValueError if M1 is wrong."""
+        s = mysrp.Server(verifier)
+        s.one(b)
+        s.two(A, M1)
+        return s.get_key()
+
+def load_adapter(spec):
+    """Instantiate an adapter named as "module:Class" (or just "module",
+    for a class called Implementation)."""
+    if not spec:
+        return Implementation()
+    modname, _, classname = spec.partition(":")
+    module = __import__(modname, fromlist=[classname or "Implementation"])
+    return getattr(module, classname or "Implementation")()
+
+
+class Timed:
+    """Wrap an adapter, accumulating [calls, seconds] per primitive."""
+    def __init__(self, impl):
+        self._impl = impl
+        self.timings = {}
+    def __getattr__(self, name):
+        f = getattr(self._impl, name)
+        def _timed(*args):
+            start = time.time()
+            try:
+                return f(*args)
+            finally:
+                t = self.timings.setdefault(name, [0, 0.0])
+                t[0] += 1
+                t[1] += time.time() - start
+        return _timed
+
+class Divergence(Exception):
+    def __init__(self, section, label, expected, got):
+        Exception.__init__(self, section, label)
+        self.section = section
+        self.label = label
+        self.expected = expected
+        self.got = got
+    def __str__(self):
+        def fmt(value):
+            if isinstance(value, bytes):
+                return binascii.hexlify(value).decode("ascii")
+            return str(value)
+        return ("%s: %s differs\n  expected: %s\n  got:      %s"
+                % (self.section, self.label, fmt(self.expected),
+                   fmt(self.got)))
+
+CHECKS = {} # section name -> function(impl, section, known)
+def check(name):
+    def _register(f):
+        CHECKS[name] = f
+        return f
+    return _register
+
+def expect(section, label, got):
+    expected = section[label]
+    if got != expected:
+        raise Divergence(section.title, label, expected, got)
+
+def hkdf_split(impl, SKM, context, dkLen):
+    return split(impl.hkdf(SKM, None, KW(context), dkLen))
+
+def check_bundle(impl, s, respHMACkey, respXORkey):
+    ciphertext = impl.xor(s["plaintext"], respXORkey)
+    expect(s, "ciphertext", ciphertext)
+    mac = impl.hmac_sha256(respHMACkey, ciphertext)
+    expect(s, "MAC", mac)
+    expect(s, "response", ciphertext+mac)
+
+@check("stretch")
+def check_stretch(impl, s, known):
+    emailUTF8, passwordUTF8 = s["email"], s["password"]
+    params = dict(vectors.DEFAULT_INPUTS)
+    params.update((n, v) for (n, v) in s.values if n in params)
+    k1 = impl.pbkdf2_sha256(passwordUTF8, KWE("first-PBKDF", emailUTF8),
+                            params["PBKDF2-rounds"], 32)
+    expect(s, "K1 (scrypt input)", k1)
+    k2 = impl.scrypt(s["K1 (scrypt input)"], KW("scrypt"), params["scrypt-N"],
+                     params["scrypt-r"], params["scrypt-p"], 32)
+    expect(s, "K2 (scrypt output)", k2)
+    stretchedPW = impl.pbkdf2_sha256(s["K2 (scrypt output)"]+passwordUTF8,
+                                     KWE("second-PBKDF", emailUTF8),
+                                     params["PBKDF2-rounds"], 32)
+    expect(s, "stretchedPW", stretchedPW)
+
+@check("main-kdf")
+def check_main_kdf(impl, s, known):
+    x = impl.hkdf(known["stretch"]["stretchedPW"],
+                  s["mainSalt (normally random)"], KW("mainKDF"), 2*32)
+    (srpPW, unwrapBKey) = split(x)
+    expect(s, "srpPW", srpPW)
+    expect(s, "unwrapBKey", unwrapBKey)
+
+@check("srp-verifier")
+def check_srp_verifier(impl, s, known):
+    x, verifier = impl.srp_verifier(known["stretch"]["email"],
+                                    known["main-kdf"]["srpPW"],
+                                    s["srpSalt (normally random)"])
+    expect(s, "internal x (hex)", x)
+    expect(s, "srpVerifier", verifier)
+
+@check("srp-b")
+def check_srp_b(impl, s, known):
+    B = impl.srp_server_one(known["srp-verifier"]["srpVerifier"],
+                            s["private b (normally random)"])
+    expect(s, "transmitted srpB", B)
+
+@check("srp-a")
+def check_srp_a(impl, s, known):
+    A = impl.srp_client_one(s["private a (normally random)"])
+    expect(s, "transmitted srpA", A)
+
+@check("srp")
+def check_srp(impl, s, known):
+    a = known["srp-a"]["private a (normally random)"]
+    b = known["srp-b"]["private b (normally random)"]
+    A = known["srp-a"]["transmitted srpA"]
+    B = known["srp-b"]["transmitted srpB"]
+    verifier = known["srp-verifier"]["srpVerifier"]
+    srpSalt = known["srp-verifier"]["srpSalt (normally random)"]
+    u, S, M1, K = impl.srp_client_two(a, B, srpSalt,
+                                      known["stretch"]["email"],
+                                      known["main-kdf"]["srpPW"])
+    expect(s, "u", u)
+    expect(s, "S", S)
+    expect(s, "M1", M1)
+    expect(s, "srpK", K)
+    try:
+        serverK = impl.srp_server_two(verifier, b, A, s["M1"])
+    except ValueError as e:
+        serverK = "server rejected M1: %s" % (e,)
+    expect(s, "srpK", serverK)
+
+@check("auth")
+def check_auth(impl, s, known):
+    respHMACkey, respXORkey = hkdf_split(impl, s["srpK"], "auth/finish", 2*32)
+    expect(s, "respHMACkey", respHMACkey)
+    expect(s, "respXORkey", respXORkey)
+    check_bundle(impl, s, s["respHMACkey"], s["respXORkey"])
+
+@check("authtoken")
+def check_authtoken(impl, s, known):
+    tokenID, reqHMACkey, requestKey = hkdf_split(impl, s["authToken"],
+                                                 "authToken", 3*32)
+    expect(s, "tokenID (authToken)", tokenID)
+    expect(s, "reqHMACkey", reqHMACkey)
+    expect(s, "requestKey", requestKey)
+
+def check_request_bundle(impl, s, context):
+    x = impl.hkdf(s["requestKey"], None, KW(context), 3*32)
+    expect(s, "respHMACkey", x[0:32])
+    expect(s, "respXORkey", x[32:])
+    check_bundle(impl, s, s["respHMACkey"], s["respXORkey"])
+
+@check("session")
+def check_session(impl, s, known):
+    check_request_bundle(impl, s, "session/create")
+
+@check("password-change")
+def check_password_change(impl, s, known):
+    check_request_bundle(impl, s, "password/change")
+
+@check("keys")
+def check_keys(impl, s, known):
+    x = impl.hkdf(s["keyFetchToken"], None, KW("account/keys"), 5*32)
+    expect(s, "tokenID (keyFetchToken)", x[0:32])
+    expect(s, "reqHMACkey", x[32:64])
+    expect(s, "respHMACkey", x[64:96])
+    expect(s, "respXORkey", x[96:])
+    check_bundle(impl, s, s["respHMACkey"], s["respXORkey"])
+    expect(s, "kB", impl.xor(s["wrapkB"], s["unwrapBKey"]))
+
+@check("use-session")
+def check_use_session(impl, s, known):
+    tokenID, reqHMACkey = hkdf_split(impl, s["sessionToken"], "session", 2*32)
+    expect(s, "tokenID (sessionToken)", tokenID)
+    expect(s, "reqHMACkey", reqHMACkey)
+
+@check("reset")
+def check_reset(impl, s, known):
+    plaintext = s["plaintext"]
+    expect(s, "plaintext", s["wrapkB"]+s["newSRPv"])
+    x = impl.hkdf(s["accountResetToken"], None, KW("account/reset"),
+                  2*32+len(plaintext))
+    expect(s, "tokenID (accountResetToken)", x[0:32])
+    expect(s, "reqHMACkey", x[32:64])
+    expect(s, "reqXORkey", x[64:])
+    expect(s, "ciphertext", impl.xor(plaintext, s["reqXORkey"]))
+
+@check("destroy")
+def check_destroy(impl, s, known):
+    tokenID, reqHMACkey = hkdf_split(impl, s["authToken"], "authToken", 3*32)[:2]
+    expect(s, "tokenID (authToken)", tokenID)
+    expect(s, "reqHMACkey", reqHMACkey)
+
+
+def check_set(impl, sections):
+    """Check one vector set (a list of VectorSections with plain bytes
+    values) against impl. Returns (failure, skipped): failure is None if
+    the set conforms, otherwise a string describing the first diverging
+    intermediate. skipped lists the sections that could not be checked
+    because the set lacks a section they take their inputs from."""
+    known = {}
+    skipped = []
+    for s in sections:
+        f = CHECKS.get(s.name)
+        if f is None:
+            return "%s: unknown section" % s.title, skipped
+        if [d for d in vectors.STAGES[s.name][1] if d not in known]:
+            skipped.append(s.name)
+            continue
+        known[s.name] = s
+        try:
+            f(impl, s, known)
+        except Divergence as e:
+            return str(e), skipped
+        except KeyError as e:
+            return "%s: vector set lacks %s" % (s.title, e), skipped
+    return None, skipped
+
+def group_sets(sections):
+    """Turn a stream of VectorSections into a stream of (set, [sections])
+    lists. Byte values are copied out of the underlying buffer, so the
+    sets can be pickled and handed to other processes."""
+    current, batch = None, []
+    for s in sections:
+        s.values = [(n, v.tobytes() if isinstance(v, memoryview) else v)
+                    for (n, v) in s.values]
+        if s.set != current and batch:
+            yield current, batch
+            batch = []
+        current = s.set
+        batch.append(s)
+    if batch:
+        yield current, batch
+
+_worker_impl = None
+def _init_worker(adapter):
+    global _worker_impl
+    _worker_impl = Timed(load_adapter(adapter))
+
+def check_job(job):
+    """multiprocessing entry point: job is (set, sections). Returns (set,
+    failure-or-None, skipped, timings), where timings only covers this
+    job."""
+    set, sections = job
+    _worker_impl.timings = {}
+    failure, skipped = check_set(_worker_impl, sections)
+    return set, failure, skipped, _worker_impl.timings
@@ -1,29 +1,22 @@
 
 import os, sys, json
-import requests
 from hashlib import sha256
-import hmac
 from hkdf import HKDF
+from bytexor import xor
+from bundle import BundleKeys
 import itertools, binascii, time, sys
 import six
-from six import binary_type, print_, int2byte
+from six import binary_type, print_
 import mysrp
-
-# get scrypt-0.6.1 from PyPI, run this with it in your PYTHONPATH
-# https://pypi.python.org/pypi/scrypt/0.6.1
-import scrypt
-
-# PyPI has four candidates for PBKDF2 functionality. We use "simple-pbkdf2"
-# by Armin Ronacher: https://pypi.python.org/pypi/simple-pbkdf2/1.0 . Note
-# that v1.0 has a bug which causes segfaults when num_iterations is greater
-# than about 88k.
-from pbkdf2 import pbkdf2_bin
+import entropy
+import instrument
+from transport import Transport, HTTPError
+from hawkauth import Signer
+from stretch import stretch, mainKDF, Background
+import kdfd
 
 def makeRandom():
-    return os.urandom(32)
-
-def HMAC(key, msg):
-    return hmac.new(key, msg, sha256).digest()
+    return entropy.random_bytes(32)
 
 def printhex(name, value, groups_per_line=1):
     assert isinstance(value, binary_type), type(value)
@@ -52,91 +45,94 @@ def KW(name):
 def KWE(name, emailUTF8):
     return b"identity.mozilla.com/picl/v1/" + six.b(name) + b":" + emailUTF8
 
-def xor(s1, s2):
-    assert isinstance(s1, binary_type), type(s1)
-    assert isinstance(s2, binary_type), type(s2)
-    assert len(s1) == len(s2)
-    return b"".join([int2byte(ord(s1[i:i+1])^ord(s2[i:i+1])) for i in range(len(s1))])
-
 BASEURL = "http://localhost:9000/"
 
+# all requests share one pool of keep-alive connections, made on first use
+# (loadtest and provision set their own)
+transport = None
+
+def http():
+    global transport
+    if transport is None:
+        transport = Transport(BASEURL)
+    return transport
+
 def GET(api):
-    r = requests.get(BASEURL+api)
-    assert r.status_code == 200, (r, r.content)
-    return r.json()
+    return http().get(api)
 
 def POST(api, body={}):
-    r = requests.post(BASEURL+api,
-                      headers={"content-type": "application/json"},
-                      data=json.dumps(body))
-    assert r.status_code == 200, (r, r.content)
-    return r.json()
-
-from hawk import client as hawk_client
-
-def HAWK_GET(api, id, key):
-    creds = {"id": id.encode("hex"),
-             "key": key.encode("hex"), # TODO: this should not be encoded,
-                                       # the server has a bug that needs it
-             "algorithm": "sha256"
-             }
-    header = hawk_client.header(BASEURL+api, "GET", {"credentials": creds,
-                                                     "ext": ""})
-    r = requests.get(BASEURL+api, headers={"authorization": header["field"]})
-    assert r.status_code == 200, (r, r.content)
-    return r.json()
+    return http().post(api, body)
+
+# signer is a hawkauth.Signer: make one per token and reuse it for every
+# request made with that token
+def HAWK_GET(api, signer):
+    return http().get(api, signer=signer)
+
+def HAWK_POST(api, signer, body={}):
+    return http().post(api, body, signer=signer)
+
+def printLatencies():
+    summary = http().summary()
+    for (method, api), (count, total, worst) in sorted(summary.items()):
+        print_("%-4s %-24s %3d calls, mean %7.1f ms, max %7.1f ms"
+               % (method, api, count, 1e3*total/count, 1e3*worst))
 
 def createSession(authToken):
-    x = HKDF(SKM=authToken,
-             dkLen=5*32,
-             XTS=None,
-             CTXinfo=KW("session/create"))
-    tokenID, reqHMACkey, respHMACkey = split(x[:3*32])
-    respXORkey = x[3*32:]
-    r = HAWK_POST("session/create", tokenID, reqHMACkey)
-    bundle = r["bundle"].decode("hex")
-    ct,respMAC = bundle[:-32], bundle[-32:]
-    respMAC2 = HMAC(respHMACkey, ct)
-    assert respMAC2 == respMAC, (respMAC2.encode("hex"),
-                                 respMAC.encode("hex"))
-    keyFetchToken, sessionToken = split(xor(ct, respXORkey))
+    tokenID, reqHMACkey, requestKey = split(HKDF(SKM=authToken,
+                                                 XTS=None,
+                                                 CTXinfo=KW("authToken"),
+                                                 dkLen=3*32))
+    r = HAWK_POST("session/create", Signer(tokenID, reqHMACkey))
+    with BundleKeys(requestKey, "session/create", 2*32) as keys:
+        keyFetchToken, sessionToken = split(keys.open(
+            r["bundle"].decode("hex")))
     return keyFetchToken, sessionToken
 
 def getKeys(keyFetchToken, unwrapBKey):
-    x = HKDF(SKM=keyFetchToken,
-             dkLen=5*32,
-             XTS=None,
-             CTXinfo=KW("account/keys"))
-    tokenID, reqHMACkey, respHMACkey = split(x[:3*32])
-    respXORkey = x[3*32:]
-    r = HAWK_GET("account/keys", tokenID, reqHMACkey)
-    bundle = r["bundle"].decode("hex")
-    ct,respMAC = bundle[:-32], bundle[-32:]
-    respMAC2 = HMAC(respHMACkey, ct)
-    assert respMAC2 == respMAC, (respMAC2.encode("hex"),
-                                 respMAC.encode("hex"))
-    kA, wrapKB = split(xor(ct, respXORkey))
+    with BundleKeys(keyFetchToken, "account/keys", 2*32) as keys:
+        tokenID, reqHMACkey = keys.split()
+        r = HAWK_GET("account/keys", Signer(tokenID, reqHMACkey))
+        kA, wrapKB = split(keys.open(r["bundle"].decode("hex")))
     kB = xor(unwrapBKey, wrapKB)
     return kA, kB
 
-def main():
-    emailUTF8, passwordUTF8, command = sys.argv[1:4]
+def accountCreateBody(emailUTF8, srpVerifier, srpSalt, mainKDFSalt,
+                      rounds=20000):
+    return {#"email": emailUTF8.encode("hex"), # TODO prefer hex
+            "email": emailUTF8.decode("utf-8"),
+            "verifier": srpVerifier.encode("hex"),
+            "salt": srpSalt.encode("hex"),
+            "params": {"srp": {"alg": "sha256", "N_bits": 2048},
+                       "stretch": {"salt": mainKDFSalt.encode("hex"),
+                                   "rounds": rounds}
+                       },
+            }
+
+def accountResetBody(ciphertext, srpSalt, mainKDFSalt, rounds=20000):
+    return {"bundle": ciphertext.encode("hex"),
+            "salt": srpSalt.encode("hex"),
+            "params": {"srp": {"alg": "sha256", "N_bits": 2048},
+                       "stretch": {"salt": mainKDFSalt.encode("hex"),
+                                   "rounds": rounds}
+                       },
+            }
+
+def run(emailUTF8, passwordUTF8, command):
     assert isinstance(emailUTF8, binary_type)
     printhex("email", emailUTF8)
     printhex("password", passwordUTF8)
 
-    k1 = pbkdf2_bin(passwordUTF8, KWE("first-PBKDF", emailUTF8),
-                    20*1000, keylen=1*32, hashfunc=sha256)
-    time_k1 = time.time()
-    printhex("K1", k1)
-    k2 = scrypt.hash(k1, KW("scrypt"), N=64*1024, r=8, p=1, buflen=1*32)
-    time_k2 = time.time()
-    printhex("K2", k2)
-    stretchedPW = pbkdf2_bin(k2+passwordUTF8, KWE("second-PBKDF", emailUTF8),
-                             20*1000, keylen=1*32, hashfunc=sha256)
-    printhex("stretchedPW", stretchedPW)
-
-    GET("__heartbeat__")
+    # The stretch takes seconds but only needs the email and password, so
+    # run it while we talk to the server, and only wait for it once
+    # mainKDFSalt (and B) have arrived. A login then costs max(stretch,
+    # network) instead of the sum.
+    # if a kdfd.py daemon is running (and PICL_KDFD=1 says to use it), let
+    # it do the stretch and verifier
+    kdf = kdfd.auto_connect()
+    time_start = time.time()
+    stretching = Background(instrument.timed("stretch")(kdf.stretch) if kdf
+                            else stretch, emailUTF8, passwordUTF8)
+    heartbeat = Background(GET, "__heartbeat__")
 
     if command == "create":
         mainKDFSalt = makeRandom()
@@ -144,7 +140,7 @@ def main():
     else:
         r = POST("session/auth/start",
                  {"email": #emailUTF8.encode("hex")
-                  emailUTF8.encode("utf-8")
+                  emailUTF8.decode("utf-8")
                   })
         print "auth/start", r
         srpToken = r["srpToken"]
@@ -152,29 +148,32 @@ def main():
         srpSalt = r["srp"]["s"].decode("hex")
         mainKDFSalt = r["stretch"]["salt"].decode("hex")
         # ignore stretch.rounds, srp.N_bits, srp.alg
+    heartbeat.result()
+    time_network = time.time()
+
+    k1, k2, stretchedPW = stretching.result()
+    time_stretched = time.time()
+    print_("network %.3fs, stretch done after %.3fs (waited %.3fs for it)"
+           % (time_network-time_start, time_stretched-time_start,
+              time_stretched-time_network))
+    printhex("K1", k1)
+    printhex("K2", k2)
+    printhex("stretchedPW", stretchedPW)
 
     printhex("mainKDFSalt", mainKDFSalt)
     printhex("srpSalt", srpSalt)
 
-    (srpPW, unwrapBKey) = split(HKDF(SKM=stretchedPW,
-                                     XTS=mainKDFSalt,
-                                     CTXinfo=KW("mainKDF"),
-                                     dkLen=2*32))
+    (srpPW, unwrapBKey) = mainKDF(stretchedPW, mainKDFSalt)
 
     if command == "create":
-        (srpVerifier, _, _, _, _) = mysrp.create_verifier(emailUTF8, srpPW,
-                                                          srpSalt)
-
-        r = POST("account/create",
-                 {#"email": emailUTF8.encode("hex"), # TODO prefer hex
-                     "email": emailUTF8.encode("utf-8"),
-                  "verifier": srpVerifier.encode("hex"),
-                  "salt": srpSalt.encode("hex"),
-                  "params": {"srp": {"alg": "sha256", "N_bits": 2048},
-                             "stretch": {"salt": mainKDFSalt.encode("hex"),
-                                         "rounds": 20000}
-                             },
-                  })
+        if kdf:
+            srpVerifier = kdf.create_verifier(emailUTF8, srpPW, srpSalt)
+        else:
+            (srpVerifier, _, _, _, _) = mysrp.create_verifier(emailUTF8,
+                                                              srpPW, srpSalt)
+
+        r = POST("account/create", accountCreateBody(emailUTF8, srpVerifier,
+                                                     srpSalt, mainKDFSalt))
         print r
     else:
         srpClient = mysrp.Client()
@@ -191,34 +190,16 @@ def main():
         # note: the server is not yet using the new protocol. The old one
         # returns keyFetchToken+sessionToken
         if 1: # old protocol
-            x = HKDF(SKM=srpClient.get_key(),
-                     dkLen=3*32,
-                     XTS=None,
-                     CTXinfo=KW("session/auth"))
-            respHMACkey = x[0:32]
-            respXORkey = x[32:]
-            ct,respMAC = bundle[:-32], bundle[-32:]
-            respMAC2 = HMAC(respHMACkey, ct)
-            printhex("respHMACkey", respHMACkey)
-            printhex("respXORkey", respXORkey)
-            printhex("ct", ct)
-            assert respMAC2 == respMAC, (respMAC2.encode("hex"),
-                                         respMAC.encode("hex"))
-            keyFetchToken, sessionToken = split(xor(respXORkey,ct))
+            keys = BundleKeys(srpClient.get_key(), "session/auth", 2*32)
+            printhex("respHMACkey", keys.hmacKey.tobytes())
+            printhex("respXORkey", keys.xorKey.tobytes())
+            printhex("ct", bundle[:-32])
+            keyFetchToken, sessionToken = split(keys.open(bundle))
 
         if 0: # new protocol
             authToken = getAuthToken(srpClient.get_key())
-            x = HKDF(SKM=srpClient.get_key(),
-                     dkLen=2*32,
-                     XTS=None,
-                     CTXinfo=KW("auth/finish"))
-            respHMACkey = x[0:32]
-            respXORkey = x[32:]
-            ct,respMAC = bundle[:-32], bundle[-32:]
-            respMAC2 = HMAC(respHMACkey, ct)
-            assert respMAC2 == respMAC, (respMAC2.encode("hex"),
-                                         respMAC.encode("hex"))
-            authToken = xor(ct, respXORkey)
+            keys = BundleKeys(srpClient.get_key(), "auth/finish", 32)
+            authToken = keys.open(bundle)
             printhex("authToken", authToken)
             keyFetchToken, sessionToken = createSession(authToken)
 
@@ -229,6 +210,401 @@ def main():
         printhex("kA", kA)
         printhex("kB", kB)
 
+    printLatencies()
+
+# "demo-client.py EMAIL PASSWORD change-password NEWPASSWORD" logs in with
+# the old password, gets kB and an accountResetToken from /password/change,
+# and resets the account to a verifier and wrapKB made from the new one.
+# That takes two stretches. Each runs in a process of its own, both
+# starting before the first request, so neither waits for the other, and
+# whatever the network takes comes off their time.
+
+def changePassword(emailUTF8, oldPasswordUTF8, newPasswordUTF8):
+    import multiprocessing
+    printhex("email", emailUTF8)
+    printhex("old password", oldPasswordUTF8)
+    printhex("new password", newPasswordUTF8)
+    time_start = time.time()
+    cpu = multiprocessing.Pool(2)
+    stretchingOld = cpu.apply_async(stretch, (emailUTF8, oldPasswordUTF8))
+    stretchingNew = cpu.apply_async(stretch, (emailUTF8, newPasswordUTF8))
+    cpu.close()
+
+    r = POST("auth/start", {"email": emailUTF8.decode("utf-8")})
+    srpToken = r["srpToken"]
+    B = r["srp"]["B"].decode("hex")
+    srpSalt = r["srp"]["s"].decode("hex")
+    mainKDFSalt = r["stretch"]["salt"].decode("hex")
+    time_network = time.time()
+    with instrument.span("stretch (old password)"):
+        stretchedPW = stretchingOld.get()[2]
+    time_old = time.time()
+    (srpPW, unwrapBKey) = mainKDF(stretchedPW, mainKDFSalt)
+    srpClient = mysrp.Client()
+    A = srpClient.one()
+    M1 = srpClient.two(B, srpSalt, emailUTF8, srpPW)
+    r = POST("auth/finish", {"srpToken": srpToken, "A": A.encode("hex"),
+                             "M": M1.encode("hex")})
+    with BundleKeys(srpClient.get_key(), "auth/finish", 32) as keys:
+        authToken = keys.open(r["bundle"].decode("hex"))
+    printhex("authToken", authToken)
+
+    tokenID, reqHMACkey, requestKey = split(HKDF(SKM=authToken, XTS=None,
+                                                 CTXinfo=KW("authToken"),
+                                                 dkLen=3*32))
+    r = HAWK_POST("password/change", Signer(tokenID, reqHMACkey))
+    with BundleKeys(requestKey, "password/change", 2*32) as keys:
+        keyFetchToken, accountResetToken = split(keys.open(
+            r["bundle"].decode("hex")))
+    printhex("keyFetchToken", keyFetchToken)
+    printhex("accountResetToken", accountResetToken)
+    kA, kB = getKeys(keyFetchToken, unwrapBKey)
+    printhex("kA", kA)
+    printhex("kB", kB)
+
+    time_wait = time.time()
+    with instrument.span("stretch (new password)"):
+        newStretchedPW = stretchingNew.get()[2]
+    time_new = time.time()
+    print_("network %.3fs, old stretch done after %.3fs (waited %.3fs for "
+           "it), new stretch after %.3fs (waited %.3fs)"
+           % (time_network-time_start, time_old-time_start,
+              time_old-time_network, time_new-time_start,
+              time_new-time_wait))
+    newMainKDFSalt, newSRPSalt = makeRandom(), makeRandom()
+    (newSRPPW, newUnwrapBKey) = mainKDF(newStretchedPW, newMainKDFSalt)
+    (newSRPv, _, _, _, _) = mysrp.create_verifier(emailUTF8, newSRPPW,
+                                                  newSRPSalt)
+    newWrapKB = xor(kB, newUnwrapBKey)
+    printhex("new wrapKB", newWrapKB)
+    printhex("new srpVerifier", newSRPv, groups_per_line=2)
+
+    # tokenID, reqHMACkey and the keystream for the request all come from
+    # the one HKDF call in BundleKeys
+    plaintext = newWrapKB + newSRPv
+    with BundleKeys(accountResetToken, "account/reset",
+                    len(plaintext)) as keys:
+        (tokenID,) = keys.split()
+        signer = Signer(tokenID, keys.hmacKey)
+        ciphertext = xor(plaintext, keys.xorKey)
+    HAWK_POST("account/reset", signer,
+              accountResetBody(ciphertext, newSRPSalt, newMainKDFSalt))
+    print_("password changed")
+    printLatencies()
+
+# "demo-client.py EMAIL PASSWORD create|login --trace FILE" also appends a
+# JSON timeline of the run to FILE: one line with a span for each stretch
+# stage, HTTP request, SRP step, HKDF and bundle opened, from every
+# thread. "demo-client.py trace-report FILE.." sums up many such runs.
+
+def main():
+    args = sys.argv[1:]
+    traceFile = None
+    if "--trace" in args:
+        i = args.index("--trace")
+        traceFile = args[i+1]
+        del args[i:i+2]
+        instrument.start_trace()
+    emailUTF8, passwordUTF8, command = args[:3]
+    try:
+        if command == "change-password":
+            changePassword(emailUTF8, passwordUTF8, args[3])
+        else:
+            run(emailUTF8, passwordUTF8, command)
+    finally:
+        trace = instrument.stop_trace()
+        if traceFile:
+            with open(traceFile, "a") as f:
+                f.write(json.dumps(dict(trace.to_dict(), command=command),
+                                   sort_keys=True) + "\n")
+
+def traceReport(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog="demo-client.py trace-report")
+    parser.add_argument("traces", nargs="+", metavar="FILE",
+                        help="files written by --trace")
+    parser.add_argument("--command", help="only runs of this command "
+                        "(create, login or change-password)")
+    opts = parser.parse_args(args)
+    traces = []
+    for path in opts.traces:
+        with open(path) as f:
+            traces.extend(json.loads(line) for line in f if line.strip())
+    if opts.command:
+        traces = [t for t in traces if t.get("command") == opts.command]
+    if not traces:
+        sys.exit("no traces")
+    durations = instrument.aggregate(traces)
+    print_("%d runs" % len(traces))
+    print_()
+    print_("%-34s %7s %9s %9s %9s %9s %9s"
+           % ("span", "per run", "p50 ms", "p90 ms", "p99 ms", "max ms",
+              "total ms"))
+    # the whole run first, then where its time went, most first
+    names = sorted(durations, key=lambda n: (n != "(run)",
+                                             -sum(durations[n])))
+    for name in names:
+        values = durations[name]
+        ps = percentiles(values)
+        print_("%-34s %7.1f %9.1f %9.1f %9.1f %9.1f %9.1f"
+               % ((name, float(len(values))/len(traces))
+                  + tuple(1e3*p for p in ps)
+                  + (1e3*sum(values)/len(traces),)))
+
+# Load generator: "demo-client.py loadtest --clients 1000 --concurrency 100"
+# runs that many simulated clients against the server, each of which
+# creates an account, logs in, and fetches account/keys. HTTP goes through
+# one pooled transport driven by a pool of threads; the stretch and the
+# SRP math, which would otherwise serialize everything on the GIL, go to a
+# pool of worker processes. The report has throughput, per-endpoint
+# latency percentiles and error rates.
+
+def cpuStretch(emailUTF8, passwordUTF8, params):
+    return stretch(emailUTF8, passwordUTF8, *params)[2]
+
+def cpuVerifier(emailUTF8, stretchedPW, mainKDFSalt, srpSalt):
+    (srpPW, unwrapBKey) = mainKDF(stretchedPW, mainKDFSalt)
+    return mysrp.create_verifier(emailUTF8, srpPW, srpSalt)[0]
+
+def cpuLogin(emailUTF8, stretchedPW, mainKDFSalt, srpSalt, B):
+    """Return (A, M1, K, unwrapBKey)."""
+    (srpPW, unwrapBKey) = mainKDF(stretchedPW, mainKDFSalt)
+    srpClient = mysrp.Client()
+    A = srpClient.one()
+    M1 = srpClient.two(B, srpSalt, emailUTF8, srpPW)
+    return A, M1, srpClient.get_key(), unwrapBKey
+
+def timed(phases, name, f, *args):
+    start = time.time()
+    try:
+        return f(*args)
+    finally:
+        phases.append((name, time.time() - start))
+
+def simulateClient(cpu, params, emailUTF8, passwordUTF8):
+    """Create an account, log in and fetch the keys. Returns a list of
+    (phase, seconds) for the CPU work."""
+    phases = []
+    # create
+    stretching = cpu.apply_async(cpuStretch, (emailUTF8, passwordUTF8, params))
+    GET("__heartbeat__")
+    mainKDFSalt, srpSalt = makeRandom(), makeRandom()
+    stretchedPW = timed(phases, "stretch", stretching.get)
+    srpVerifier = timed(phases, "verifier", cpu.apply, cpuVerifier,
+                        (emailUTF8, stretchedPW, mainKDFSalt, srpSalt))
+    POST("account/create", accountCreateBody(emailUTF8, srpVerifier, srpSalt,
+                                             mainKDFSalt, params[0]))
+    # login, stretching again alongside auth/start like a fresh client would
+    stretching = cpu.apply_async(cpuStretch, (emailUTF8, passwordUTF8, params))
+    r = POST("session/auth/start", {"email": emailUTF8.decode("utf-8")})
+    B = r["srp"]["B"].decode("hex")
+    srpSalt = r["srp"]["s"].decode("hex")
+    mainKDFSalt = r["stretch"]["salt"].decode("hex")
+    stretchedPW = timed(phases, "stretch", stretching.get)
+    A, M1, K, unwrapBKey = timed(phases, "srp", cpu.apply, cpuLogin,
+                                 (emailUTF8, stretchedPW, mainKDFSalt,
+                                  srpSalt, B))
+    r = POST("session/auth/finish", {"srpToken": r["srpToken"],
+                                     "A": A.encode("hex"),
+                                     "M": M1.encode("hex")})
+    keys = BundleKeys(K, "session/auth", 2*32)
+    keyFetchToken, sessionToken = split(keys.open(r["bundle"].decode("hex")))
+    getKeys(keyFetchToken, unwrapBKey)
+    return phases
+
+def percentiles(values, ps=(50, 90, 99)):
+    values = sorted(values)
+    return [values[min(len(values)-1, int(len(values)*p/100.0))]
+            for p in ps] + [values[-1]]
+
+def loadtest(args):
+    import argparse, multiprocessing, traceback
+    from multiprocessing.pool import ThreadPool
+    global transport
+    parser = argparse.ArgumentParser(prog="demo-client.py loadtest")
+    parser.add_argument("--url", default=BASEURL)
+    parser.add_argument("--clients", type=int, default=100,
+                        help="simulated clients to run (default: 100)")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="clients in flight at once (default: 50)")
+    parser.add_argument("--procs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="processes for stretch/SRP (default: one per CPU)")
+    parser.add_argument("--pbkdf2-rounds", type=int, default=20000)
+    parser.add_argument("--scrypt-N", type=int, default=64*1024)
+    opts = parser.parse_args(args)
+
+    params = (opts.pbkdf2_rounds, opts.scrypt_N)
+    transport = Transport(opts.url, pool_size=opts.concurrency)
+    cpu = multiprocessing.Pool(opts.procs)
+    trial = binascii.hexlify(os.urandom(4))
+    def client(i):
+        emailUTF8 = "load-%s-%d@example.org" % (trial, i)
+        try:
+            return simulateClient(cpu, params, emailUTF8, "password-%d" % i)
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    start = time.time()
+    results = list(ThreadPool(opts.concurrency).imap_unordered(
+        client, range(opts.clients)))
+    elapsed = time.time() - start
+    cpu.close()
+
+    ok = [r for r in results if r is not None]
+    print_("%d clients in %.2fs: %.1f clients/s, %d failed (%.1f%%)"
+           % (len(results), elapsed, len(results)/elapsed,
+              len(results)-len(ok), 100.0*(len(results)-len(ok))/len(results)))
+    print_()
+    print_("%-30s %7s %7s %9s %9s %9s %9s"
+           % ("endpoint", "calls", "errors", "p50 ms", "p90 ms", "p99 ms",
+              "max ms"))
+    byEndpoint = {}
+    for (method, api, status, seconds) in transport.latencies:
+        byEndpoint.setdefault(method+" "+api, []).append((status, seconds))
+    phases = {}
+    for r in ok:
+        for (name, seconds) in r:
+            phases.setdefault("(cpu) "+name, []).append((200, seconds))
+    for name, calls in sorted(byEndpoint.items()) + sorted(phases.items()):
+        errors = len([status for (status, _) in calls if status != 200])
+        ps = percentiles([seconds for (_, seconds) in calls])
+        print_("%-30s %7d %7d %9.1f %9.1f %9.1f %9.1f"
+               % ((name, len(calls), errors) + tuple(1e3*p for p in ps)))
+
+# Bulk provisioning: "demo-client.py provision accounts.csv" creates an
+# account for every email,password row (or {"email": .., "password": ..}
+# line of a .jsonl file). The stretch and verifier for each account are
+# computed in a pool of processes, and the account/create requests go out
+# over pooled connections from a bounded number of threads. At most
+# --max-pending accounts are between starting their stretch and finishing
+# their upload, so a slow server holds back the stretching rather than
+# letting finished accounts pile up in memory. Every created account is
+# appended to a progress file, and accounts listed there are skipped, so
+# an interrupted run can simply be started again.
+
+ERRNO_ACCOUNT_EXISTS = 101
+
+def readAccounts(path):
+    """Yield (emailUTF8, passwordUTF8) from a CSV or JSON Lines file."""
+    import csv
+    with open(path, "rb") as f:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            for line in f:
+                if line.strip():
+                    a = json.loads(line)
+                    yield (a["email"].encode("utf-8"),
+                           a["password"].encode("utf-8"))
+        else:
+            for row in csv.reader(f):
+                if not row or row[:2] == ["email", "password"]:
+                    continue
+                yield row[0], row[1]
+
+def readProgress(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb") as f:
+        return set(line.rstrip(b"\n") for line in f)
+
+def cpuCreate(job):
+    emailUTF8, passwordUTF8, params = job
+    stretchedPW = cpuStretch(emailUTF8, passwordUTF8, params)
+    mainKDFSalt, srpSalt = makeRandom(), makeRandom()
+    srpVerifier = cpuVerifier(emailUTF8, stretchedPW, mainKDFSalt, srpSalt)
+    return emailUTF8, accountCreateBody(emailUTF8, srpVerifier, srpSalt,
+                                        mainKDFSalt, params[0])
+
+def createAccount(job):
+    """Returns (emailUTF8, error or None)."""
+    emailUTF8, body = job
+    try:
+        POST("account/create", body)
+    except HTTPError as e:
+        try:
+            errno = e.response.json().get("errno")
+        except ValueError:
+            errno = None
+        if errno != ERRNO_ACCOUNT_EXISTS: # done by an earlier run
+            return emailUTF8, str(e)
+    except Exception as e:
+        return emailUTF8, repr(e)
+    return emailUTF8, None
+
+def provision(args):
+    import argparse, multiprocessing, threading
+    from multiprocessing.pool import ThreadPool
+    global transport
+    parser = argparse.ArgumentParser(prog="demo-client.py provision")
+    parser.add_argument("accounts",
+                        help="CSV (email,password) or .jsonl file")
+    parser.add_argument("--url", default=BASEURL)
+    parser.add_argument("--progress",
+                        help="file listing the accounts already created "
+                        "(default: ACCOUNTS.progress)")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="account/create requests in flight at once "
+                        "(default: 20)")
+    parser.add_argument("--procs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="processes for stretch/SRP (default: one per CPU)")
+    parser.add_argument("--max-pending", type=int,
+                        help="accounts stretched or stretching but not yet "
+                        "uploaded (default: procs + 2*concurrency)")
+    parser.add_argument("--pbkdf2-rounds", type=int, default=20000)
+    parser.add_argument("--scrypt-N", type=int, default=64*1024)
+    opts = parser.parse_args(args)
+
+    params = (opts.pbkdf2_rounds, opts.scrypt_N)
+    maxPending = opts.max_pending or opts.procs + 2*opts.concurrency
+    progressPath = opts.progress or opts.accounts + ".progress"
+    done = readProgress(progressPath)
+    pending = threading.BoundedSemaphore(maxPending)
+    def todo():
+        # runs in the process pool's feeder thread, which waits here while
+        # maxPending accounts are in flight; each finished upload releases
+        # one below
+        for (emailUTF8, passwordUTF8) in readAccounts(opts.accounts):
+            if emailUTF8 not in done:
+                pending.acquire()
+                yield emailUTF8, passwordUTF8, params
+    transport = Transport(opts.url, pool_size=opts.concurrency)
+    cpu = multiprocessing.Pool(opts.procs)
+    httpPool = ThreadPool(opts.concurrency)
+
+    created = failed = 0
+    start = last = time.time()
+    with open(progressPath, "ab") as progress:
+        for emailUTF8, error in httpPool.imap_unordered(
+                createAccount, cpu.imap_unordered(cpuCreate, todo())):
+            pending.release()
+            if error is None:
+                progress.write(emailUTF8 + b"\n")
+                progress.flush()
+                created += 1
+            else:
+                print_("%s: %s" % (emailUTF8, error), file=sys.stderr)
+                failed += 1
+            if time.time() - last > 5:
+                last = time.time()
+                print_("%d created, %d failed, %.1f accounts/s"
+                       % (created, failed, created/(last-start)),
+                       file=sys.stderr)
+    cpu.close()
+    httpPool.close()
+    print_("%d created, %d failed, %d skipped (already done) in %.1fs"
+           % (created, failed, len(done), time.time()-start))
+    if failed:
+        sys.exit(1)
+
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ["loadtest"]:
+        loadtest(sys.argv[2:])
+    elif sys.argv[1:2] == ["provision"]:
+        provision(sys.argv[2:])
+    elif sys.argv[1:2] == ["trace-report"]:
+        traceReport(sys.argv[2:])
+    else:
+        main()
 
@@ -0,0 +1,131 @@
+# this should work with both python2.7 and python3.3
+
+# Where random salts, tokens and SRP ephemerals come from. random_bytes()
+# draws from the current source, which is normally a Pool: os.urandom()
+# read a few KB at a time instead of once per 32-byte value. A process
+# that forks gets a fresh pool in the child, so parent and child never
+# hand out the same bytes.
+#
+# Benchmarks, tests and vector generation can set_source() a DRBG instead,
+# a deterministic generator keyed by a seed, so that their runs can be
+# reproduced exactly. Never do that anywhere the values have to be secret.
+
+import hmac, os, struct, threading, time
+from hashlib import sha256
+import binascii
+import six
+
+class Source:
+    """Helpers shared by every source. Subclasses provide
+    random_bytes(n), which returns n bytes (a bytes object) and is safe
+    to call from several threads at once."""
+    def randbelow(self, n):
+        """A uniformly distributed integer in [0, n)."""
+        assert n > 0, n
+        bits = (n-1).bit_length()
+        nbytes = (bits + 7) // 8
+        mask = (1 << bits) - 1
+        while True:
+            r = int(binascii.hexlify(self.random_bytes(nbytes)) or b"0", 16)
+            r &= mask
+            if r < n:
+                return r
+
+    def randint(self, lo, hi):
+        """A uniformly distributed integer in [lo, hi]."""
+        return lo + self.randbelow(hi - lo + 1)
+
+    def choice(self, seq):
+        return seq[self.randbelow(len(seq))]
+
+class Pool(Source):
+    """os.urandom() output, read 'size' bytes at a time. The buffer is
+    refilled when it runs out or gets older than max_age seconds, and
+    thrown away in a forked child. Bytes are zeroed in the buffer as they
+    are handed out, so it never holds a value someone already has."""
+    def __init__(self, size=4096, max_age=60):
+        self.size = size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._buf = bytearray()
+        self._pos = 0
+        self._pid = None
+        self._filled = 0
+
+    def _wipe(self):
+        self._buf[:] = bytearray(len(self._buf))
+
+    def _refill(self):
+        self._wipe() # what was left unused
+        self._buf = bytearray(os.urandom(self.size))
+        self._pos = 0
+        self._pid = os.getpid()
+        self._filled = time.time()
+
+    def random_bytes(self, n):
+        if n > self.size // 4:
+            return os.urandom(n)
+        with self._lock:
+            if (self._pos + n > len(self._buf) or self._pid != os.getpid()
+                or time.time() - self._filled > self.max_age):
+                self._refill()
+            start, self._pos = self._pos, self._pos + n
+            out = bytes(self._buf[start:self._pos])
+            self._buf[start:self._pos] = bytearray(n)
+        return out
+
+    def _after_fork(self):
+        # the lock may have been held by a thread that does not exist in
+        # the child
+        self._lock = threading.Lock()
+        self._wipe()
+        self._buf = bytearray()
+
+class DRBG(Source):
+    """Deterministic bytes from a seed (bytes or text): the blocks
+    HMAC-SHA256(K, counter) for counter = 0, 1, 2.., where
+    K = SHA256("picl-drbg:" + seed). The same seed always gives the same
+    sequence, on every platform and python version."""
+    def __init__(self, seed):
+        if not isinstance(seed, six.binary_type):
+            seed = seed.encode("utf-8")
+        key = sha256(b"picl-drbg:" + seed).digest()
+        self._hmac = hmac.new(key, digestmod=sha256)
+        self._counter = 0
+        self._buf = b""
+        self._lock = threading.Lock()
+
+    def random_bytes(self, n):
+        with self._lock:
+            blocks = [self._buf]
+            have = len(self._buf)
+            while have < n:
+                h = self._hmac.copy()
+                h.update(struct.pack(">Q", self._counter))
+                self._counter += 1
+                blocks.append(h.digest())
+                have += 32
+            data = b"".join(blocks)
+            self._buf = data[n:]
+        return data[:n]
+
+_source = Pool()
+
+def _after_fork():
+    if isinstance(_source, Pool):
+        _source._after_fork()
+if hasattr(os, "register_at_fork"): # python3.7 and later
+    os.register_at_fork(after_in_child=_after_fork)
+
+def random_bytes(n):
+    return _source.random_bytes(n)
+
+def get_source():
+    return _source
+
+def set_source(source):
+    """Make source (a Pool or DRBG) the one random_bytes() draws from.
+    Returns the previous source."""
+    global _source
+    old, _source = _source, source
+    return old
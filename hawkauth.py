@@ -0,0 +1,209 @@
+# this should work with both python2.7 and python3.3
+
+# Hawk request authentication (https://github.com/hueniverse/hawk), just
+# the "header" scheme with sha256, as the PiCL client uses it:
+#
+#   Authorization: Hawk id="..", ts="..", nonce="..", [hash="..",]
+#                  [ext="..",] mac=".."
+#   normalized = "hawk.1.header\n" + ts + "\n" + nonce + "\n" + METHOD +
+#                "\n" + resource + "\n" + host + "\n" + port + "\n" +
+#                hash + "\n" + ext + "\n"
+#   mac = base64(HMAC-SHA256(key, normalized))
+#
+# The client hex-encodes reqHMACkey before using it as the Hawk key, so
+# that is what a server has to do too (see hawk_key()).
+#
+# Signer does the client side. Make one per token and keep it: the HKDF
+# for the token's ID and key, their encodings, and the keyed HMAC state
+# are all done once, so signing a request is one HMAC over the normalized
+# string.
+
+import base64, binascii, collections, hmac, re, threading, time
+from hashlib import sha256
+import six
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+from hkdf import HKDF
+from entropy import random_bytes
+
+def KW(name):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name)
+
+class HawkError(ValueError):
+    pass
+
+def hawk_key(reqHMACkey):
+    return binascii.hexlify(reqHMACkey)
+
+# How the tokenID and reqHMACkey of each kind of token are derived: the
+# first two 32-byte pieces of HKDF(SKM=token, CTXinfo=KW(context), dkLen).
+TOKEN_KEYS = {
+    "authToken": ("authToken", 3*32),
+    "sessionToken": ("session", 2*32),
+    "keyFetchToken": ("account/keys", 5*32),
+    "accountResetToken": ("account/reset", 2*32),
+    }
+
+def tokenKeys(kind, token):
+    """Return (tokenID, reqHMACkey)."""
+    context, dkLen = TOKEN_KEYS[kind]
+    x = HKDF(SKM=token, XTS=None, CTXinfo=KW(context), dkLen=dkLen)
+    return x[:32], x[32:64]
+
+def _b(s):
+    return s if isinstance(s, six.binary_type) else s.encode("utf-8")
+
+def normalize(ts, nonce, method, resource, host, port, hash="", ext=""):
+    ext = ext.replace("\\", "\\\\").replace("\n", "\\n")
+    return "\n".join(["hawk.1.header", str(ts), nonce, method.upper(),
+                      resource, host.lower(), str(port), hash, ext, ""])
+
+def calculate_mac(key, normalized):
+    return base64.b64encode(hmac.new(_b(key), _b(normalized),
+                                     sha256).digest()).decode("ascii")
+
+def payload_hash(payload, content_type):
+    content_type = content_type.split(";")[0].strip().lower()
+    h = sha256(b"hawk.1.payload\n" + _b(content_type) + b"\n")
+    h.update(_b(payload))
+    h.update(b"\n")
+    return base64.b64encode(h.digest()).decode("ascii")
+
+_attribute = re.compile(r'\s*(\w+)="([^"\\]*)"\s*(?:,|$)')
+
+def parse_header(value):
+    """Return the attributes of a Hawk Authorization header as a dict."""
+    scheme, _, rest = value.strip().partition(" ")
+    if scheme.lower() != "hawk":
+        raise HawkError("not a Hawk header")
+    attributes = {}
+    pos = 0
+    rest = rest.strip()
+    while pos < len(rest):
+        m = _attribute.match(rest, pos)
+        if not m or m.group(1) in attributes:
+            raise HawkError("malformed Hawk header")
+        attributes[m.group(1)] = m.group(2)
+        pos = m.end()
+    for name in ("id", "ts", "nonce", "mac"):
+        if name not in attributes:
+            raise HawkError("Hawk header lacks %s" % name)
+    return attributes
+
+def verify(header, method, resource, host, port, lookup, payload=None,
+           content_type="", skew=60, now=None, seen_nonce=None,
+           require_hash=True):
+    """Check a request's Authorization header. lookup(id) must return the
+    Hawk key for that id, or None if the id is unknown. If payload is given,
+    the header must carry a hash of it (unless require_hash is false, in
+    which case a hash is only checked if present). seen_nonce(id, nonce,
+    ts), if given, must return true for a nonce it has been asked about
+    before, e.g. NonceCache.seen; such replays are refused. Returns the id;
+    raises HawkError if anything does not match."""
+    a = parse_header(header)
+    if now is None:
+        now = time.time()
+    try:
+        ts = int(a["ts"])
+    except ValueError:
+        raise HawkError("bad Hawk timestamp")
+    if abs(now - ts) > skew:
+        raise HawkError("stale Hawk timestamp")
+    if payload is not None and require_hash and "hash" not in a:
+        raise HawkError("Hawk header lacks the payload hash")
+    key = lookup(a["id"])
+    if key is None:
+        raise HawkError("unknown Hawk id")
+    normalized = normalize(a["ts"], a["nonce"], method, resource, host, port,
+                           a.get("hash", ""), a.get("ext", ""))
+    if not hmac.compare_digest(_b(calculate_mac(key, normalized)),
+                               _b(a["mac"])):
+        raise HawkError("bad Hawk mac")
+    if "hash" in a and payload is not None:
+        if not hmac.compare_digest(_b(payload_hash(payload, content_type)),
+                                   _b(a["hash"])):
+            raise HawkError("bad Hawk payload hash")
+    # only after the mac, so that nobody without the key can use up nonces
+    if seen_nonce is not None and seen_nonce(a["id"], a["nonce"], ts):
+        raise HawkError("replayed Hawk nonce")
+    return a["id"]
+
+class NonceCache:
+    """The (id, nonce) pairs of recently verified requests, each kept for
+    as long as verify() with the same skew could still accept a request
+    carrying it. Pass its seen method to verify(). Thread-safe."""
+    def __init__(self, skew=60):
+        self.skew = skew
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._expiry = collections.deque() # (time, (id, nonce)), in order
+
+    def seen(self, id, nonce, ts, now=None):
+        if now is None:
+            now = time.time()
+        key = (id, nonce)
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < now:
+                self._seen.discard(self._expiry.popleft()[1])
+            if key in self._seen:
+                return True
+            self._seen.add(key)
+            # ts is at most now+skew, and is accepted until ts+skew
+            self._expiry.append((now + 2*self.skew, key))
+            return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seen)
+
+
+class Signer:
+    """Signs requests for one token. Safe to share between threads: the
+    keyed HMAC state is only ever copied, never updated in place."""
+    def __init__(self, tokenID, reqHMACkey, localtimeOffset=0):
+        self.id = binascii.hexlify(tokenID).decode("ascii")
+        self._hmac = hmac.new(hawk_key(reqHMACkey), digestmod=sha256)
+        self.localtimeOffset = localtimeOffset
+        self._hosts = {}
+
+    @classmethod
+    def for_token(cls, kind, token):
+        return cls(*tokenKeys(kind, token))
+
+    def _origin(self, netloc, scheme):
+        # (host, port) for each server we talk to, parsed once. Racing
+        # threads can only both store the same value.
+        origin = self._hosts.get((netloc, scheme))
+        if origin is None:
+            u = urlsplit(scheme+"://"+netloc)
+            port = u.port or (443 if scheme == "https" else 80)
+            origin = (u.hostname.lower(), str(port))
+            self._hosts[(netloc, scheme)] = origin
+        return origin
+
+    def header(self, method, url, payload=None, content_type="", ext=""):
+        """Return the Authorization header value for a request. If payload
+        (the exact request body) is given, its hash is signed too."""
+        u = urlsplit(url)
+        host, port = self._origin(u.netloc, u.scheme)
+        resource = u.path + ("?"+u.query if u.query else "")
+        ts = str(int(time.time()) + self.localtimeOffset)
+        nonce = base64.urlsafe_b64encode(random_bytes(6)).decode("ascii")
+        hash = ""
+        if payload is not None:
+            hash = payload_hash(payload, content_type)
+        h = self._hmac.copy()
+        h.update(_b(normalize(ts, nonce, method, resource, host, port,
+                              hash, ext)))
+        mac = base64.b64encode(h.digest()).decode("ascii")
+        parts = ['Hawk id="%s"' % self.id, 'ts="%s"' % ts,
+                 'nonce="%s"' % nonce]
+        if hash:
+            parts.append('hash="%s"' % hash)
+        if ext:
+            parts.append('ext="%s"' % ext.replace("\\", "\\\\")
+                                          .replace("\n", "\\n"))
+        parts.append('mac="%s"' % mac)
+        return ", ".join(parts)
@@ -1,11 +1,20 @@
 from hashlib import sha256, sha1
 import hmac
 import six
+import instrument
+from keybuf import is_buffer
 
+# SKM can be any buffer (bytes, bytearray, keybuf.KeyBuffer, memoryview).
+# With out= (a writable buffer of at least dkLen bytes), the output is
+# written into out and a memoryview of it is returned, so that the caller
+# can wipe it; otherwise HKDF returns bytes.
+@instrument.timed("hkdf")
 def HKDF(SKM, dkLen, XTS=None, CTXinfo=b"", digest=sha256,
-         _test_expected_PRK=None):
-    assert isinstance(SKM, six.binary_type)
-    assert isinstance(XTS, (six.binary_type,type(None)))
+         _test_expected_PRK=None, out=None):
+    if not _self_tested:
+        _self_test()
+    assert is_buffer(SKM), type(SKM)
+    assert isinstance(XTS, (six.binary_type,bytearray,type(None)))
     assert isinstance(CTXinfo, six.binary_type)
     hlen = len(digest(b"").digest())
     assert dkLen <= hlen*255
@@ -15,14 +24,31 @@ def HKDF(SKM, dkLen, XTS=None, CTXinfo=b"", digest=sha256,
     PRK = hmac.new(XTS, SKM, digest).digest()
     if _test_expected_PRK and _test_expected_PRK != PRK:
         raise ValueError("test failed")
-    # expand
-    blocks = []
+    # expand: T(i) = HMAC(PRK, T(i-1) + CTXinfo + i), on a copy of the
+    # keyed state, without concatenating the key material T(i-1)
+    keyed = hmac.new(PRK, None, digest)
+    if out is None:
+        blocks = []
+    else:
+        out = memoryview(out)[:dkLen]
+        assert len(out) == dkLen and not out.readonly
+    pos = 0
     counter = 1
     t = b""
-    while hlen*len(blocks) < dkLen:
-        t = hmac.new(PRK, t+CTXinfo+six.int2byte(counter), digest).digest()
-        blocks.append(t)
+    while pos < dkLen:
+        h = keyed.copy()
+        h.update(t)
+        h.update(CTXinfo + six.int2byte(counter))
+        t = h.digest()
+        if out is None:
+            blocks.append(t)
+        else:
+            n = min(hlen, dkLen-pos)
+            out[pos:pos+n] = t[:n]
+        pos += hlen
         counter += 1
+    if out is not None:
+        return out
     return b"".join(blocks)[:dkLen]
 
 def power_on_self_test():
@@ -158,4 +184,16 @@ def power_on_self_test():
                "9d201395faa4b61a96c8"))
     #print "all test passed"
 
-power_on_self_test()
+# The self-test runs on the first HKDF() call rather than at import time,
+# so that importing this module (and everything that imports it) stays
+# cheap for callers that never derive a key.
+_self_tested = False
+
+def _self_test():
+    global _self_tested
+    _self_tested = True # the test itself calls HKDF()
+    try:
+        power_on_self_test()
+    except:
+        _self_tested = False
+        raise
@@ -0,0 +1,200 @@
+# this should work with both python2.7 and python3.3
+
+# Call counts, cumulative time and latency histograms for the expensive
+# primitives (HKDF, PBKDF2, scrypt, the SRP steps), so that a running
+# process can tell where its CPU goes. The functions are wrapped with
+# @timed(name) when their modules load; recording is off until enable()
+# (or PICL_INSTRUMENT=1 in the environment), and while it is off a wrapped
+# call costs one extra function call and a flag test.
+#
+#   import instrument
+#   instrument.enable()
+#   ...
+#   print(instrument.to_json())
+#   instrument.Reporter(60, lambda snap: log(snap), reset=True)
+#
+# snapshot() returns {name: {"count", "total", "max", "histogram"}}, times
+# in seconds; the histogram is a list of [upper bound, count] pairs, the
+# last bound being None (no limit).
+#
+# A trace is a timeline of one run instead: between start_trace() and
+# stop_trace(), every timed call and span (from any thread) is also kept
+# as an event with its start offset, duration and thread, whether or not
+# the counters are enabled. aggregate() turns many traces into lists of
+# durations per span name.
+
+import bisect, functools, json, os, threading, time
+
+clock = getattr(time, "perf_counter", time.time)
+
+# histogram bucket upper bounds, in seconds: 10us, 30us, 100us, .. 10s
+BOUNDS = [1e-5, 3e-5, 1e-4, 3e-4, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3,
+          1, 3, 10]
+
+_enabled = os.environ.get("PICL_INSTRUMENT", "") not in ("", "0")
+_lock = threading.Lock()
+_stats = {} # name -> [count, total, max, bucket counts]
+_trace = None # the Trace being recorded, if any
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def record(name, seconds):
+    """Count one call of 'name' that took 'seconds'."""
+    i = bisect.bisect_left(BOUNDS, seconds)
+    with _lock:
+        s = _stats.get(name)
+        if s is None:
+            s = _stats[name] = [0, 0.0, 0.0, [0] * (len(BOUNDS)+1)]
+        s[0] += 1
+        s[1] += seconds
+        if seconds > s[2]:
+            s[2] = seconds
+        s[3][i] += 1
+
+def _finish(name, start, attrs=None):
+    end = clock()
+    if _enabled:
+        record(name, end - start)
+    trace = _trace
+    if trace is not None:
+        trace.add(name, start, end, attrs)
+
+def timed(name):
+    """Decorator: record every call of the function under 'name' while
+    instrumentation is enabled or a trace is running. Calls that raise
+    are recorded too."""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled and _trace is None:
+                return f(*args, **kwargs)
+            start = clock()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _finish(name, start)
+        return wrapper
+    return decorate
+
+class span:
+    """Context manager recording the time spent in its block:
+    'with instrument.span("name") as s: ...'. Anything put in s.attrs
+    goes into the trace event."""
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+    def __enter__(self):
+        self.start = None
+        if _enabled or _trace is not None:
+            self.start = clock()
+        return self
+    def __exit__(self, *exc):
+        if self.start is not None:
+            if exc[0] is not None:
+                self.attrs["error"] = exc[0].__name__
+            _finish(self.name, self.start, self.attrs)
+
+class Trace:
+    def __init__(self):
+        self.started = time.time()
+        self.start = clock()
+        self.end = None
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, attrs=None):
+        event = {"name": name, "start": start - self.start,
+                 "duration": end - start,
+                 "thread": threading.current_thread().name}
+        if attrs:
+            event.update(attrs)
+        with self._lock:
+            self.events.append(event)
+
+    def to_dict(self):
+        end = self.end if self.end is not None else clock()
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e["start"])
+        return {"started": self.started, "duration": end - self.start,
+                "events": events}
+
+def start_trace():
+    """Start recording a new trace of this process, and return it."""
+    global _trace
+    _trace = Trace()
+    return _trace
+
+def stop_trace():
+    """Stop recording, and return the trace (or None if there was none)."""
+    global _trace
+    trace, _trace = _trace, None
+    if trace is not None:
+        trace.end = clock()
+    return trace
+
+def aggregate(traces):
+    """Given trace dicts (Trace.to_dict() output), return {span name:
+    [duration, ..]} over all of them, with the whole runs as "(run)"."""
+    out = {}
+    for t in traces:
+        out.setdefault("(run)", []).append(t["duration"])
+        for e in t["events"]:
+            out.setdefault(e["name"], []).append(e["duration"])
+    return out
+
+def snapshot(reset=False):
+    """Return the statistics gathered so far, and if reset is true, start
+    over from zero (atomically, so a periodic reader sees every call
+    exactly once)."""
+    with _lock:
+        stats = dict((name, (s[0], s[1], s[2], list(s[3])))
+                     for (name, s) in _stats.items())
+        if reset:
+            _stats.clear()
+    return dict((name, {"count": count, "total": total, "max": max_,
+                        "histogram": [list(p) for p in
+                                      zip(BOUNDS + [None], buckets)]})
+                for (name, (count, total, max_, buckets)) in stats.items())
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+def to_json(reset=False):
+    return json.dumps(snapshot(reset), sort_keys=True)
+
+def percentile(stat, q):
+    """Estimate the q-th percentile (0..100) of one snapshot() entry from
+    its histogram: the upper bound of the bucket it falls in (or the
+    maximum, for the last bucket)."""
+    wanted = stat["count"] * q / 100.0
+    seen = 0
+    for (bound, n) in stat["histogram"]:
+        seen += n
+        if n and seen >= wanted:
+            return stat["max"] if bound is None else min(bound, stat["max"])
+    return stat["max"]
+
+class Reporter(threading.Thread):
+    """Call callback(snapshot(reset)) every 'interval' seconds, from a
+    daemon thread, until stop()."""
+    def __init__(self, interval, callback, reset=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval, self.callback, self.reset = interval, callback, reset
+        self._stopped = threading.Event()
+        self.start()
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.callback(snapshot(self.reset))
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,334 @@
+# this should work with both python2.7 and python3.3
+
+# A key-derivation daemon for short-lived callers. Start it once:
+#
+#   python kdfd.py [--socket PATH] [--procs N]
+#
+# and, with PICL_KDFD=1 in their environment, demo-client.py and
+# picl-crypto.py will hand their stretch (and SRP verifier) to it instead
+# of computing them in-process, saving each invocation the scrypt import
+# and the cold first call. The stretch and
+# verifier run in a pool of worker processes, each warmed up with one
+# full-size scrypt call before the socket starts accepting requests; the
+# cheap operations (HKDF, mainKDF, bundles) run in the connection's
+# thread.
+#
+# The socket is a Unix stream socket, by default $PICL_KDFD_SOCKET, or
+# picl-kdfd.sock in $XDG_RUNTIME_DIR, or in a directory $TMPDIR/picl-kdfd-
+# $UID that the daemon creates mode 0700. Clients send it passwords and
+# trust the keys that come back, so before sending anything a client
+# checks that the socket file and the process listening on it
+# (SO_PEERCRED, where there is one) belong to the same user as itself, and
+# that the directory holding the default socket is private to that user.
+# The socket itself is created mode 0600. Each message, in both
+# directions, is a 4-byte big-endian length followed by that many bytes of
+# JSON. A request is {"op": NAME, "args": [..]}, and the answer is
+# {"result": ..} or {"error": MESSAGE, "type": NAME}. Byte strings are
+# sent as {"hex": ".."}.
+#
+# This module only needs the standard library on the client side; the
+# crypto modules are imported by the daemon itself.
+
+import binascii, json, os, signal, socket, stat, struct, sys, threading
+import time
+import six
+from six import binary_type, print_
+
+def default_socket():
+    path = os.environ.get("PICL_KDFD_SOCKET")
+    if path:
+        return path
+    return os.path.join(_default_dir(), "picl-kdfd.sock")
+
+def _default_dir():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return runtime
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), "picl-kdfd-%d" % os.getuid())
+
+class KDFDError(Exception):
+    pass
+
+def _check_private_dir(path):
+    """Raise KDFDError unless path is a directory (not a symlink) owned by
+    this user that nobody else can write to or look into."""
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise KDFDError("%s is not a directory owned by you" % path)
+    if st.st_mode & 0o077:
+        raise KDFDError("%s is accessible to other users" % path)
+
+def _check_socket(path):
+    """Raise KDFDError unless path is a socket owned by this user, in a
+    private directory if it is the default one."""
+    if path == default_socket() and not os.environ.get("PICL_KDFD_SOCKET"):
+        _check_private_dir(os.path.dirname(path))
+    st = os.lstat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise KDFDError("%s is not a socket owned by you" % path)
+
+# SO_PEERCRED is Linux's; python2's socket module lacks the constant
+SO_PEERCRED = getattr(socket, "SO_PEERCRED",
+                      17 if sys.platform.startswith("linux") else None)
+_ucred = struct.Struct("3i") # pid, uid, gid
+
+def _check_peer(sock):
+    """Raise KDFDError unless the process at the other end of the
+    connected Unix socket runs as this user (where the OS can tell)."""
+    if SO_PEERCRED is None:
+        return
+    pid, uid, gid = _ucred.unpack(sock.getsockopt(socket.SOL_SOCKET,
+                                                  SO_PEERCRED, _ucred.size))
+    if uid != os.getuid():
+        raise KDFDError("kdfd socket is served by uid %d, not you" % uid)
+
+_length = struct.Struct(">I")
+
+def _encode(value):
+    if isinstance(value, binary_type):
+        return {"hex": binascii.hexlify(value).decode("ascii")}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+def _decode(value):
+    if isinstance(value, dict):
+        return binascii.unhexlify(value["hex"])
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+def _send(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(_length.pack(len(data)) + data)
+
+def _recv_exactly(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        data = sock.recv(n - len(buf))
+        if not data:
+            return None
+        buf += data
+    return bytes(buf)
+
+def _recv(sock):
+    header = _recv_exactly(sock, _length.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, _length.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+class Client:
+    """Calls into a running daemon. Each thread gets its own connection,
+    so one Client can be shared between threads."""
+    def __init__(self, path=None):
+        self.path = path or default_socket()
+        self._local = threading.local()
+        self._connect() # fail now if there is no daemon
+
+    def _connect(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            _check_socket(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                _check_peer(sock)
+            except Exception:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def call(self, op, *args):
+        sock = self._connect()
+        _send(sock, {"op": op, "args": _encode(args)})
+        response = _recv(sock)
+        if response is None:
+            self._local.sock = None
+            raise KDFDError("kdfd closed the connection")
+        if "error" in response:
+            if response.get("type") == "BundleError":
+                from bundle import BundleError
+                raise BundleError(response["error"])
+            raise KDFDError(response["error"])
+        return _decode(response["result"])
+
+    def stretch(self, emailUTF8, passwordUTF8, *params):
+        """Same arguments and result as stretch.stretch."""
+        return tuple(self.call("stretch", emailUTF8, passwordUTF8, *params))
+
+    def mainKDF(self, stretchedPW, mainKDFSalt):
+        return tuple(self.call("mainKDF", stretchedPW, mainKDFSalt))
+
+    def hkdf(self, SKM, XTS, CTXinfo, dkLen):
+        return self.call("hkdf", SKM, XTS, CTXinfo, dkLen)
+
+    def create_verifier(self, emailUTF8, srpPW, srpSalt):
+        """Return just the verifier bytes (mysrp.create_verifier's v_str)."""
+        return self.call("verifier", emailUTF8, srpPW, srpSalt)
+
+    def seal(self, token, context, plaintext, prefix=None):
+        return self.call("seal", token, context, plaintext, prefix)
+
+    def open(self, token, context, bundle, prefix=None):
+        return self.call("open", token, context, bundle, prefix)
+
+def connect(path=None):
+    """Return a Client for the daemon, or None if none is running (or the
+    socket fails the ownership checks, which is reported on stderr)."""
+    try:
+        return Client(path)
+    except (socket.error, OSError):
+        return None
+    except KDFDError as e:
+        print_("kdfd: not using %s: %s" % (path or default_socket(), e),
+               file=sys.stderr)
+        return None
+
+def auto_connect():
+    """connect() if the user has opted in with PICL_KDFD=1, else None."""
+    if os.environ.get("PICL_KDFD", "") in ("", "0"):
+        return None
+    return connect()
+
+
+# the daemon
+
+def _native(s):
+    # contexts are native strings: a python2 client sends them as byte
+    # strings, and JSON gives a python2 daemon unicode
+    if six.PY3 and isinstance(s, binary_type):
+        return s.decode("ascii")
+    if not six.PY3 and isinstance(s, six.text_type):
+        return s.encode("ascii")
+    return s
+
+def _bytes(s):
+    # HKDF's CTXinfo is bytes, which a python3 client may pass as text
+    return s.encode("utf-8") if isinstance(s, six.text_type) else s
+
+def _stretch(emailUTF8, passwordUTF8, *params):
+    import stretch
+    return stretch.stretch(emailUTF8, passwordUTF8, *params)
+
+def _verifier(emailUTF8, srpPW, srpSalt):
+    import mysrp
+    return mysrp.create_verifier(emailUTF8, srpPW, srpSalt)[0]
+
+def _warm(N, r, p):
+    import stretch, mysrp # load both before the first request
+    stretch.scrypt_hash(b"", b"", N=N, r=r, p=p, buflen=32)
+
+def _pid(i):
+    time.sleep(0.05)
+    return os.getpid()
+
+def _inline_ops():
+    import stretch, bundle
+    from hkdf import HKDF
+    return {
+        "mainKDF": stretch.mainKDF,
+        "hkdf": lambda SKM, XTS, CTXinfo, dkLen: HKDF(SKM=SKM, XTS=XTS,
+                                                     CTXinfo=_bytes(CTXinfo),
+                                                     dkLen=dkLen),
+        "seal": lambda token, context, plaintext, prefix:
+            bundle.seal(token, _native(context), plaintext, prefix),
+        "open": lambda token, context, b, prefix:
+            bundle.open(token, _native(context), b, prefix),
+        }
+
+POOL_OPS = {"stretch": _stretch, "verifier": _verifier}
+
+def serve(path=None, procs=None, N=None, r=None, p=None):
+    import multiprocessing
+    from six.moves import socketserver
+    import stretch
+    path = path or default_socket()
+    procs = procs or multiprocessing.cpu_count()
+    warm = (N or stretch.SCRYPT_N, r or stretch.SCRYPT_R,
+            p or stretch.SCRYPT_P)
+    pool = multiprocessing.Pool(procs, _warm, warm)
+    # wait until every worker has finished warming up
+    pids = set()
+    for attempt in range(10):
+        pids.update(pool.map(_pid, range(procs), chunksize=1))
+        if len(pids) == procs:
+            break
+    inline = _inline_ops()
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                request = _recv(self.request)
+                if request is None:
+                    return
+                _send(self.request, self.answer(request))
+
+        def answer(self, request):
+            op, args = request.get("op"), _decode(request.get("args", []))
+            try:
+                if op in POOL_OPS:
+                    result = pool.apply(POOL_OPS[op], args)
+                elif op in inline:
+                    result = inline[op](*args)
+                else:
+                    return {"error": "unknown op %r" % (op,),
+                            "type": "KeyError"}
+            except Exception as e:
+                # str() of a bare AssertionError is empty
+                return {"error": str(e) or repr(e),
+                        "type": type(e).__name__}
+            return {"result": _encode(result)}
+
+    class Server(socketserver.ThreadingMixIn,
+                 socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if path == default_socket() and not os.environ.get("PICL_KDFD_SOCKET"):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.mkdir(directory, 0o700)
+        try:
+            _check_private_dir(directory)
+        except KDFDError as e:
+            raise SystemExit("kdfd: %s" % e)
+    if os.path.exists(path):
+        if connect(path) is not None:
+            raise SystemExit("kdfd is already running on %s" % path)
+        os.unlink(path) # left over from a daemon that died
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(old_umask)
+    print_("kdfd: %d warm workers, listening on %s" % (procs, path),
+           file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.unlink(path)
+        pool.terminate()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve stretch, HKDF, SRP "
+                                     "verifier and bundle operations on a "
+                                     "Unix socket.")
+    parser.add_argument("--socket", help="socket path (default: %s)"
+                        % default_socket())
+    parser.add_argument("--procs", type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--scrypt-N", type=int,
+                        help="scrypt N to warm the workers up with")
+    args = parser.parse_args()
+    serve(args.socket, args.procs, args.scrypt_N)
+
+if __name__ == '__main__':
+    main()
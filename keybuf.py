@@ -0,0 +1,68 @@
+# this should work with both python2.7 and python3.3
+
+# Key material in a buffer we own. A bytes object cannot be changed, so
+# every key held in one (and every slice or concatenation of it) stays in
+# the heap until the allocator happens to reuse the memory. A KeyBuffer is
+# a bytearray instead: HKDF(out=) and bundle.BundleKeys write straight
+# into it, slicing it gives memoryviews rather than copies, and wipe()
+# zeroes it as soon as the key is no longer needed.
+#
+#   with KeyBuffer(3*32) as k:
+#       HKDF(SKM=authToken, CTXinfo=KW("authToken"), dkLen=len(k), out=k)
+#       tokenID, reqHMACkey, requestKey = k.split()
+#       ...
+#   # k (and tokenID etc., which are views of it) are all zeros here
+#
+# Anything passed to hmac or hashlib can be a KeyBuffer or a view of one.
+# What those modules (and bytes-only APIs) copy internally is out of our
+# hands, so this narrows where keys linger rather than guaranteeing it.
+
+import six
+
+class KeyBuffer(bytearray):
+    def __init__(self, size_or_data):
+        """KeyBuffer(n) is n zero bytes; KeyBuffer(data) a copy of data."""
+        bytearray.__init__(self, size_or_data)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return memoryview(self)[i]
+        return bytearray.__getitem__(self, i)
+
+    def split(self, size=32):
+        """Return memoryviews of consecutive size-byte pieces."""
+        assert len(self) % size == 0, (len(self), size)
+        view = memoryview(self)
+        return [view[i:i+size] for i in range(0, len(self), size)]
+
+    def tobytes(self):
+        """A bytes copy, for APIs that insist on bytes. wipe() cannot
+        reach it."""
+        return bytes(self)
+
+    def wipe(self):
+        """Overwrite the contents with zeros, in place."""
+        # same-size slice assignment writes into the existing buffer
+        # (resizing is refused anyway while memoryviews of it exist)
+        bytearray.__setitem__(self, slice(0, len(self)),
+                              bytearray(len(self)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.wipe()
+
+    def __repr__(self):
+        return "<KeyBuffer of %d bytes>" % len(self) # never the contents
+
+def wipe(*buffers):
+    """Zero each writable buffer (KeyBuffer, bytearray or memoryview)."""
+    for b in buffers:
+        if isinstance(b, KeyBuffer):
+            b.wipe()
+        else:
+            memoryview(b)[:] = b"\x00" * len(b)
+
+def is_buffer(value):
+    return isinstance(value, (six.binary_type, bytearray, memoryview))
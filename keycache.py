@@ -0,0 +1,60 @@
+# this should work with both python2.7 and python3.3
+
+# A small thread-safe cache for key material derived from tokens, so that
+# a server verifying many requests made with the same token does the HKDF
+# once instead of on every request. Entries expire after 'ttl' seconds,
+# the least recently used one is dropped when there are more than
+# 'maxsize', and revoking a token must invalidate() its entry.
+
+import threading, time
+from collections import OrderedDict
+
+class KeyCache:
+    def __init__(self, maxsize=10000, ttl=300, clock=time.time):
+        assert maxsize > 0, maxsize
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict() # key -> (expires, value), LRU first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, compute):
+        """Return the cached value for key, or compute() it and cache the
+        result. compute() runs without the lock held, so two threads
+        missing on the same key may both compute it."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries[key] = entry # most recently used
+                    self.hits += 1
+                    return entry[1]
+                self.expirations += 1
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations}
@@ -26,6 +26,8 @@ from hashlib import sha256
 import os
 import binascii
 import six
+from entropy import random_bytes
+from instrument import timed
 
 bytes = type(os.urandom(1))
 # 2048
@@ -53,16 +55,25 @@ def long_to_padded_bytes(l):
 k_bytes = sha256(long_to_padded_bytes(N)+long_to_padded_bytes(g)).digest()
 k = bytes_to_long(k_bytes)
 
+# H(a, b, ..) is SHA256(a+b+..), fed to the hash piece by piece so that
+# no concatenated copy of the (secret) pieces is made
+def H(*pieces):
+    h = sha256()
+    for piece in pieces:
+        h.update(piece)
+    return h.digest()
+
 def gen_x_bytes(salt, usernameUTF8, passwordUTF8):
-    inner = sha256(usernameUTF8+b":"+passwordUTF8).digest()
-    outer = sha256(salt+inner).digest()
+    inner = H(usernameUTF8, b":", passwordUTF8)
+    outer = H(salt, inner)
     return outer
 
+@timed("srp.create_verifier")
 def create_verifier(usernameUTF8, passwordUTF8, salt=None):
     assert isinstance(usernameUTF8, bytes)
     assert isinstance(passwordUTF8, bytes)
     if not salt:
-        salt = os.urandom(4)
+        salt = random_bytes(4)
     assert isinstance(salt, bytes)
     x_bytes = gen_x_bytes(salt, usernameUTF8, passwordUTF8)
     x = bytes_to_long(x_bytes)
@@ -76,9 +87,10 @@ exercise_validation_bug = False
 class Client:
     def __init__(self):
         pass
+    @timed("srp.client.one")
     def one(self, a=None):
         if not a:
-            a = bytes_to_long(os.urandom(32)) # TODO: why 32?
+            a = bytes_to_long(random_bytes(32)) # TODO: why 32?
         assert isinstance(a, six.integer_types)
         self.a = a
         A = pow(g, self.a, N)
@@ -88,13 +100,14 @@ class Client:
         assert isinstance(self.A_bytes, six.binary_type)
         return self.A_bytes
 
+    @timed("srp.client.two")
     def two(self, B_bytes, salt, usernameUTF8, passwordUTF8):
         assert self.A_bytes, "must call Client.one() before Client.two()"
         assert isinstance(B_bytes, six.binary_type)
         B = bytes_to_long(B_bytes)
         if B % N == 0:
             raise ValueError("SRP-6a safety check failed: B is zero-ish")
-        u_bytes = sha256(self.A_bytes+B_bytes).digest()
+        u_bytes = H(self.A_bytes, B_bytes)
         u = bytes_to_long(u_bytes)
         if u == 0:
             raise ValueError("SRP-6a safety check failed: u is zero")
@@ -108,10 +121,11 @@ class Client:
         S_bytes = long_to_padded_bytes(S)
         self._debug_S_bytes = S_bytes
         self.K = sha256(S_bytes).digest()
-        M1_bytes = sha256(self.A_bytes + B_bytes + S_bytes).digest()
-        self.expected_M2 = sha256(self.A_bytes + M1_bytes + S_bytes).digest()
+        M1_bytes = H(self.A_bytes, B_bytes, S_bytes)
+        self.expected_M2 = H(self.A_bytes, M1_bytes, S_bytes)
         return M1_bytes
 
+    @timed("srp.client.three")
     def three(self, M2_bytes):
         if M2_bytes != self.expected_M2:
             raise ValueError("SRP error: received M2 does not match, server does not know our Verifier")
@@ -124,9 +138,10 @@ class Server:
         assert isinstance(verifier, six.binary_type)
         self.v = bytes_to_long(verifier)
 
+    @timed("srp.server.one")
     def one(self, b=None):
         if not b:
-            b = bytes_to_long(os.urandom(32)) # TODO: why 32?
+            b = bytes_to_long(random_bytes(32)) # TODO: why 32?
         assert isinstance(b, six.integer_types)
         self.b = b
 
@@ -135,22 +150,23 @@ class Server:
         assert isinstance(self.B_bytes, six.binary_type)
         return self.B_bytes
 
+    @timed("srp.server.two")
     def two(self, A_bytes, M1_bytes):
         A = bytes_to_long(A_bytes)
         if A % N == 0:
             raise ValueError("SRP-6a safety check failed: A is zero-ish")
-        u_bytes = sha256(A_bytes+self.B_bytes).digest()
+        u_bytes = H(A_bytes, self.B_bytes)
         u = bytes_to_long(u_bytes)
         if u == 0:
             raise ValueError("SRP-6a safety check failed: u is zero")
         S = pow((A * pow(self.v, u, N)) % N, self.b, N)
         S_bytes = long_to_padded_bytes(S)
-        expected_M1_bytes = sha256(A_bytes + self.B_bytes + S_bytes).digest()
+        expected_M1_bytes = H(A_bytes, self.B_bytes, S_bytes)
         if M1_bytes != expected_M1_bytes:
             raise ValueError("SRP error: received M1 does not match, client does not know password")
         # they know the password! yay!
         self.K = sha256(S_bytes).digest()
-        M2 = sha256(A_bytes + M1_bytes + S_bytes).digest()
+        M2 = H(A_bytes, M1_bytes, S_bytes)
         return M2 # client can optionally check this to test us
 
     def get_key(self):
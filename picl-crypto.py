@@ -1,36 +1,30 @@
 # -*- coding: utf-8 -*-
 # this should work with both python2.7 and python3.3
 
-from hashlib import sha256
-import hmac
-from hkdf import HKDF
-import itertools, binascii, time, sys
-import six
-from six import binary_type, print_, int2byte
-import mysrp
-
-# get scrypt-0.6.1 from PyPI, run this with it in your PYTHONPATH
-# https://pypi.python.org/pypi/scrypt/0.6.1
-import scrypt
-
-# PyPI has four candidates for PBKDF2 functionality. We use "simple-pbkdf2"
-# by Armin Ronacher: https://pypi.python.org/pypi/simple-pbkdf2/1.0 . Note
-# that v1.0 has a bug which causes segfaults when num_iterations is greater
-# than about 88k.
-from pbkdf2 import pbkdf2_bin
-
-# other options:
-# * https://pypi.python.org/pypi/PBKDF/1.0
-#   most mature, but hardwired to use SHA1
+# Print the spec's test vectors. With no arguments every section is
+# printed; otherwise only the named sections are printed, and only they and
+# the stages they depend upon are computed (see vectors.py). For example,
+# "python picl-crypto.py keys session" needs the stretch but no SRP.
 #
-# * https://pypi.python.org/pypi/pbkdf2/1.3
-#   doesn't work without pycrypto, since its hashlib fallback is buggy
+# --format=jsonl or --format=binary writes the same values in one of the
+# machine-readable formats described in vectorio.py instead, streaming each
+# section out as soon as it has been computed. These always include the
+# sections that the named ones depend upon, so that conformance.py has
+# every input it needs.
 #
-# * https://pypi.python.org/pypi/pbkdf2.py/1.1
-#   also looks good, but ships in multiple files
+# --random=N writes N independent randomized vector sets instead of the
+# fixed one (random email, password, tokens, salts and SRP ephemerals, see
+# vectors.random_inputs), computed in parallel by --jobs processes. Runs
+# with the same --seed produce the same sets. --pbkdf2-rounds and
+# --scrypt-N scale the stretch down for fuzzing.
+#
+# If a kdfd.py daemon is running and PICL_KDFD=1 is set, the stretch for
+# the fixed vectors is done by it.
+
+import argparse, binascii, os, sys
+from six import binary_type, print_
+import vectors, vectorio
 
-def HMAC(key, msg):
-    return hmac.new(key, msg, sha256).digest()
 def printheader(name):
     print_("== %s ==" % name)
     print_()
@@ -54,360 +48,102 @@ def printdec(name, n):
         print_(s[i:i+32].replace(" ",""))
     print_()
 
-def thencount(*values):
-    for v in values:
-        yield v
-    for c in itertools.count():
-        yield c
-
-def split(value):
-    assert len(value)%32 == 0
-    return [value[i:i+32] for i in range(0, len(value), 32)]
-def KW(name):
-    return b"identity.mozilla.com/picl/v1/" + six.b(name)
-def KWE(name, emailUTF8):
-    return b"identity.mozilla.com/picl/v1/" + six.b(name) + b":" + emailUTF8
-
-def xor(s1, s2):
-    assert isinstance(s1, binary_type), type(s1)
-    assert isinstance(s2, binary_type), type(s2)
-    assert len(s1) == len(s2)
-    return b"".join([int2byte(ord(s1[i:i+1])^ord(s2[i:i+1])) for i in range(len(s1))])
-
-def fakeKey(start):
-    return b"".join([int2byte(c) for c in range(start, start+32)])
-
-printheader("stretch-KDF")
-emailUTF8 = u"andré@example.org".encode("utf-8")
-passwordUTF8 = u"pässwörd".encode("utf-8")
-printhex("email", emailUTF8)
-printhex("password", passwordUTF8)
-
-# stretching
-time_start = time.time()
-k1 = pbkdf2_bin(passwordUTF8, KWE("first-PBKDF", emailUTF8),
-                20*1000, keylen=1*32, hashfunc=sha256)
-time_k1 = time.time()
-printhex("K1 (scrypt input)", k1)
-k2 = scrypt.hash(k1, KW("scrypt"), N=64*1024, r=8, p=1, buflen=1*32)
-time_k2 = time.time()
-printhex("K2 (scrypt output)", k2)
-stretchedPW = pbkdf2_bin(k2+passwordUTF8, KWE("second-PBKDF", emailUTF8),
-                         20*1000, keylen=1*32, hashfunc=sha256)
-time_k3 = time.time()
-#print "stretching took %0.3f seconds (P=%0.3f + S=%0.3f + P=%0.3f)" % \
-#      (time_k3-time_start,
-#       time_k1-time_start, time_k2-time_k1, time_k3-time_k2)
-
-printhex("stretchedPW", stretchedPW)
-
-def findMainSalt(stretchedPW):
-    print_("looking for mainSalt that yields an srpPW with leading zero")
-    prefix = b"\x00"+b"\xf0"+b"\x00"*14
-    for count in thencount(845):
-        # about 20000 per second
-        if count > 300 and count % 500 == 0:
-            print_(count, "tries", time.time())
-        if count > 1000000:
-            raise ValueError("unable to find suitable salt in reasonable time")
-        mainSalt = prefix + binascii.unhexlify("%032x"%count)
-        (srpPW, unwrapBKey) = split(HKDF(SKM=stretchedPW,
-                                         XTS=mainSalt,
-                                         CTXinfo=KW("mainKDF"),
-                                         dkLen=2*32))
-        if srpPW[0:1] != b"\x00":
-            continue
-        print_("found salt on count", count)
-        return mainSalt
-
-mainSalt = findMainSalt(stretchedPW)
-
-(srpPW, unwrapBKey) = split(HKDF(SKM=stretchedPW,
-                                 XTS=mainSalt,
-                                 CTXinfo=KW("mainKDF"),
-                                 dkLen=2*32))
-
-if 1:
-    printheader("main-KDF")
-    printhex("mainSalt (normally random)", mainSalt)
-    printhex("srpPW", srpPW)
-    printhex("unwrapBKey", unwrapBKey)
-
-kA = fakeKey(1*32)
-wrapkB = fakeKey(2*32)
-authToken = fakeKey(3*32)
-keyFetchToken = fakeKey(4*32)
-sessionToken = fakeKey(5*32)
-accountResetToken = fakeKey(6*32)
-
-# choose a salt that gives us a verifier with a leading zero, to ensure we
-# exercise padding behavior in implementations of this spec. Otherwise
-# padding bugs (dropping a leading zero) would hide in about 255 out of 256
-# test runs.
-def findSalt():
-    print_("looking for srpSalt that yields an srpVerifier with leading zero")
-    makeV = mysrp.create_verifier
-    prefix = b"\x00"+b"\xf1"+b"\x00"*14
-    for count in thencount(377):
-        # about 500 per second
-        if count > 300 and count % 500 == 0:
-            print_(count, "tries")
-        if count > 1000000:
-            raise ValueError("unable to find suitable salt in reasonable time")
-        salt = prefix + binascii.unhexlify("%032x"%count)
-        (srpVerifier, v_num, x_str, x_num, _) = makeV(emailUTF8, srpPW, salt)
-        if srpVerifier[0:1] != b"\x00":
-            continue
-        print_("found salt on count", count)
-        printdec("internal x", x_num)
-        printhex("internal x (hex)", x_str)
-        #print_(" v", binascii.hexlify(srpVerifier))
-        printdec("v (verifier as number)", v_num)
-        return salt, srpVerifier, v_num
-
-srpSalt, srpVerifier, v_num = findSalt()
-
-if 1:
-    printheader("SRP Verifier")
-    printdec("k", mysrp.k)
-    printhex("srpSalt (normally random)", srpSalt)
-    printhex("srpVerifier", srpVerifier, groups_per_line=2)
-
-def findB():
-    print_("looking for 'b' that yields srpA with leading zero")
-    prefix = b"\x00"+b"\xf3"+b"\x00"*(256-2-16)
-    s = mysrp.Server(srpVerifier)
-    for count in thencount(15):
-        if count > 300 and count % 500 == 0:
-            print_(count, "tries")
-        if count > 1000000:
-            raise ValueError("unable to find suitable value in reasonable time")
-        b_str = prefix + binascii.unhexlify("%032x"%count)
-        assert len(b_str) == 2048/8, (len(b_str),2048/8)
-        b = mysrp.bytes_to_long(b_str)
-        B = s.one(b)
-        if B[0:1] != b"\x00":
-            continue
-        print_("found b on count", count)
-        printdec("private b (normally random)", b)
-        printhex("private b (hex)", b_str, groups_per_line=2)
-        return b,B
-
-if 1:
-    printheader("SRP B")
-    b,B = findB()
-    printhex("transmitted srpB", B, groups_per_line=2)
-    assert mysrp.Server(srpVerifier).one(b) == B
-
-def findA():
-    print_("looking for 'a' that yields srpA with leading zero")
-    # 'a' is in [1..N-1], so 2048 bits, or 256 bytes
-    prefix = b"\x00"+b"\xf2"+b"\x00"*(256-2-16)
-    c = mysrp.Client()
-    import time
-    start = time.time()
-    num_near_misses = 0
-    # hm.. this reports an awful lot of consecutive "near-misses". But, this
-    # a->A transformation isn't supposed to be strong against related "keys".
-    for count in thencount(54231):
-        # this processes about 50 per second. 2^16 needs about 20 minutes.
-        if count > 300 and count % 500 == 0:
-            now = time.time()
-            print_(count, "tries", now - start)
-            start = now
-        if count > 1000000:
-            raise ValueError("unable to find suitable value in reasonable time")
-        a_str = prefix + binascii.unhexlify("%032x"%count)
-        assert len(a_str) == 2048/8, (len(a_str),2048/8)
-        a = mysrp.bytes_to_long(a_str)
-        A = c.one(a)
-        if A[0:1] != b"\x00":
-            continue
-        num_near_misses += 1
-        # also require that the computed S has a leading zero
-        c.two(B, srpSalt, emailUTF8, srpPW)
-        if c._debug_S_bytes[0:1] != b"\x00":
-            print_("found good A, but not good S, on count %d (near misses=%d)"
-                   % (count, num_near_misses))
-            continue
-        print_("found a on count", count)
-        printdec("private a (normally random)", a)
-        printhex("private a (hex)", a_str, groups_per_line=2)
-        return a,A
-
-if 1:
-    printheader("SRP A")
-    a,A = findA()
-    printhex("transmitted srpA", A, groups_per_line=2)
-    assert mysrp.Client().one(a) == A
-
-
-if 1:
-    printheader("SRP key-agreement")
-    c = mysrp.Client()
-    s = mysrp.Server(srpVerifier)
-    Ax = c.one(a)
-    assert A==Ax
-    M1 = c.two(B, srpSalt, emailUTF8, srpPW)
-    Bx = s.one(b)
-    assert Bx==B
-    s.two(A,M1)
-    assert c.get_key() == s.get_key()
-    printhex("u", c._debug_u_bytes, groups_per_line=2)
-    printhex("S", c._debug_S_bytes, groups_per_line=2)
-    printhex("M1", M1)
-    srpK = c.get_key()
-    printhex("srpK", srpK)
-
-if 1:
-    printheader("/auth")
-    x = HKDF(SKM=srpK,
-             dkLen=2*32,
-             XTS=None,
-             CTXinfo=KW("auth/finish"))
-    respHMACkey = x[0:32]
-    respXORkey = x[32:]
-    printhex("srpK", srpK)
-    printhex("respHMACkey", respHMACkey)
-    printhex("respXORkey", respXORkey)
-
-    printhex("authToken", authToken)
-    plaintext = authToken
-    printhex("plaintext", plaintext)
-
-    ciphertext = xor(plaintext, respXORkey)
-    printhex("ciphertext", ciphertext)
-    mac = HMAC(respHMACkey, ciphertext)
-    printhex("MAC", mac)
-    printhex("response", ciphertext+mac)
-
-if 1:
-    printheader("authtoken")
-    x = HKDF(SKM=authToken,
-             dkLen=3*32,
-             XTS=None,
-             CTXinfo=KW("authToken"))
-    authTokenID = x[0:32]
-    authreqHMACkey = x[32:64]
-    requestKey = x[64:96]
-    printhex("authToken", authToken)
-    printhex("tokenID (authToken)", authTokenID)
-    printhex("reqHMACkey", authreqHMACkey)
-    printhex("requestKey", requestKey)
-
-
-if 1:
-    printheader("/session")
-    x = HKDF(SKM=requestKey,
-             dkLen=3*32,
-             XTS=None,
-             CTXinfo=KW("session/create"))
-    respHMACkey = x[0:32]
-    respXORkey = x[32:]
-    printhex("requestKey", requestKey)
-    printhex("respHMACkey", respHMACkey)
-    printhex("respXORkey", respXORkey)
-
-    printhex("keyFetchToken", keyFetchToken)
-    printhex("sessionToken", sessionToken)
-    plaintext = keyFetchToken+sessionToken
-    printhex("plaintext", plaintext)
-
-    ciphertext = xor(plaintext, respXORkey)
-    printhex("ciphertext", ciphertext)
-    mac = HMAC(respHMACkey, ciphertext)
-    printhex("MAC", mac)
-    printhex("response", ciphertext+mac)
-
-if 1:
-    printheader("/account/keys")
-    x = HKDF(SKM=keyFetchToken,
-             dkLen=(3+2)*32,
-             XTS=None,
-             CTXinfo=KW("account/keys"))
-    tokenID = x[0:32]
-    reqHMACkey = x[32:64]
-    respHMACkey = x[64:96]
-    respXORkey = x[96:]
-    printhex("keyFetchToken", keyFetchToken)
-    printhex("tokenID (keyFetchToken)", tokenID)
-    printhex("reqHMACkey", reqHMACkey)
-    printhex("respHMACkey", respHMACkey)
-    printhex("respXORkey", respXORkey)
-
-    printhex("kA", kA)
-    printhex("wrapkB", wrapkB)
-    plaintext = kA+wrapkB
-    printhex("plaintext", plaintext)
-
-    ciphertext = xor(plaintext, respXORkey)
-    printhex("ciphertext", ciphertext)
-    mac = HMAC(respHMACkey, ciphertext)
-    printhex("MAC", mac)
-    printhex("response", ciphertext+mac)
-
-    printhex("wrapkB", wrapkB)
-    printhex("unwrapBKey", unwrapBKey)
-    kB = xor(wrapkB, unwrapBKey)
-    printhex("kB", kB)
-
-
-if 1:
-    printheader("use session (certificate/sign, etc)")
-    tokenID,reqHMACkey = split(HKDF(SKM=sessionToken,
-                                    XTS=None,
-                                    dkLen=2*32,
-                                    CTXinfo=KW("session")))
-    printhex("sessionToken", sessionToken)
-    printhex("tokenID (sessionToken)", tokenID)
-    printhex("reqHMACkey", reqHMACkey)
-
-if 1:
-    printheader("/password/change")
-    x = HKDF(SKM=requestKey,
-             dkLen=3*32,
-             XTS=None,
-             CTXinfo=KW("password/change"))
-    respHMACkey = x[0:32]
-    respXORkey = x[32:]
-    printhex("requestKey", requestKey)
-    printhex("respHMACkey", respHMACkey)
-    printhex("respXORkey", respXORkey)
-
-    printhex("keyFetchToken", keyFetchToken)
-    printhex("accountResetToken", accountResetToken)
-    plaintext = keyFetchToken+accountResetToken
-    printhex("plaintext", plaintext)
-
-    ciphertext = xor(plaintext, respXORkey)
-    printhex("ciphertext", ciphertext)
-    mac = HMAC(respHMACkey, ciphertext)
-    printhex("MAC", mac)
-    printhex("response", ciphertext+mac)
-
-if 1:
-    printheader("/account/reset")
-    newSRPv = "\x11"*(2048/8)
-    plaintext = wrapkB+newSRPv
-    keys = HKDF(SKM=accountResetToken,
-                XTS=None,
-                dkLen=2*32+len(plaintext),
-                CTXinfo=KW("account/reset"))
-    tokenID = keys[0:32]
-    reqHMACkey = keys[32:64]
-    reqXORkey = keys[64:]
-    printhex("accountResetToken", accountResetToken)
-    printhex("tokenID (accountResetToken)", tokenID)
-    printhex("reqHMACkey", reqHMACkey)
-    printhex("reqXORkey", reqXORkey, groups_per_line=2)
-    printhex("wrapkB", wrapkB)
-    printhex("newSRPv", newSRPv)
-    printhex("plaintext", plaintext, groups_per_line=2)
-    ciphertext = xor(plaintext, reqXORkey)
-    printhex("ciphertext", ciphertext, groups_per_line=2)
-
-if 1:
-    printheader("/account/destroy")
-    printhex("authToken", authToken)
-    printhex("tokenID (authToken)", authTokenID)
-    printhex("reqHMACkey", authreqHMACkey)
+def printsection(section):
+    printheader(section.title)
+    for (kind, label, value, groups_per_line) in section.entries:
+        if kind == "hex":
+            printhex(label, value, groups_per_line)
+        elif kind == "dec":
+            printdec(label, value)
+        else:
+            print_(value)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="print PiCL test vectors")
+    parser.add_argument("sections", nargs="*", metavar="SECTION",
+                        help="sections to print (default: all of them)")
+    parser.add_argument("--list", action="store_true",
+                        help="list the sections and their dependencies")
+    parser.add_argument("--format", default="text",
+                        choices=["text"] + sorted(vectorio.WRITERS),
+                        help="output format (default: text)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write to FILE instead of stdout")
+    parser.add_argument("--random", type=int, metavar="N",
+                        help="write N randomized vector sets (needs "
+                        "--format=jsonl or --format=binary)")
+    parser.add_argument("--seed", help="seed for --random (default: random)")
+    parser.add_argument("--jobs", type=int,
+                        help="processes for --random (default: one per CPU)")
+    parser.add_argument("--pbkdf2-rounds", type=int, metavar="ROUNDS",
+                        help="PBKDF2 rounds for each stretch (default: %d)"
+                        % vectors.DEFAULT_INPUTS["PBKDF2-rounds"])
+    parser.add_argument("--scrypt-N", type=int, metavar="N",
+                        help="scrypt N for the stretch (default: %d)"
+                        % vectors.DEFAULT_INPUTS["scrypt-N"])
+    opts = parser.parse_args(args)
+
+    if opts.list:
+        for name in vectors.ORDER:
+            title, deps, _ = vectors.STAGES[name]
+            print_("%-16s %-36s needs: %s" % (name, title,
+                                              " ".join(deps) or "-"))
+        return
+
+    for name in opts.sections:
+        if name not in vectors.STAGES:
+            parser.error("unknown section %r (try --list)" % name)
+    if opts.random is not None and opts.format == "text":
+        parser.error("--random needs --format=jsonl or --format=binary")
+    params = {}
+    if opts.pbkdf2_rounds is not None:
+        params["PBKDF2-rounds"] = opts.pbkdf2_rounds
+    if opts.scrypt_N is not None:
+        params["scrypt-N"] = opts.scrypt_N
+
+    wanted = set(opts.sections or vectors.ORDER)
+    if opts.format != "text":
+        # the machine-readable sets are replayed by conformance.py, which
+        # needs the earlier sections' values too
+        wanted = set(vectors.closure(wanted))
+    if opts.format == "text":
+        if opts.output:
+            sys.stdout = open(opts.output, "w")
+        write_section = printsection
+    else:
+        if opts.output:
+            f = open(opts.output, "wb")
+        else:
+            f = getattr(sys.stdout, "buffer", sys.stdout)
+        writer = vectorio.WRITERS[opts.format](f)
+        write_section = writer.write_section
+    if opts.random is not None:
+        seed = opts.seed
+        if seed is None:
+            seed = binascii.hexlify(os.urandom(16)).decode("ascii")
+            print_("seed:", seed, file=sys.stderr)
+        jobs = [(seed, index, params, opts.sections)
+                for index in range(opts.random)]
+        import multiprocessing
+        pool = multiprocessing.Pool(opts.jobs or multiprocessing.cpu_count())
+        # imap keeps the sets in order while later ones are being computed
+        for index, sections in pool.imap(vectors.random_set, jobs,
+                                         chunksize=8):
+            for section in sections:
+                writer.write_section(section, set=index)
+        pool.close()
+        pool.join()
+        writer.close()
+        return
+
+    def emit(section):
+        if section.name in wanted:
+            write_section(section)
+    import kdfd
+    kdf = kdfd.auto_connect()
+    vectors.Vectors(params, emit=emit, kdf=kdf).run(opts.sections)
+    if opts.format != "text":
+        writer.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# this should work with both python2.7 and python3.3
+
+# Check an implementation against vector files written by
+# "picl-crypto.py --format=jsonl|binary" (see conformance.py):
+#
+#   python picl-verify.py vectors.bin
+#   python picl-verify.py --adapter myimpl:Adapter --jobs 8 fuzz-*.bin
+#
+# Every set is replayed step by step; for each set that does not conform,
+# the first diverging intermediate is reported. Sets are checked in
+# parallel, and the time spent in each primitive of the adapter is
+# reported at the end. Sets only count as conforming once their file's
+# trailing SHA-256 has been checked; a corrupt or truncated file makes the
+# exit status nonzero.
+
+import argparse, multiprocessing, sys
+from six import print_
+import conformance, vectorio
+
+def sets(paths, errors):
+    # a file's trailer is checked once its last set has been read; what is
+    # wrong with it goes into errors[path] rather than up through the pool
+    for path in paths:
+        try:
+            for set, sections in conformance.group_sets(vectorio.read(path)):
+                yield (path, set), sections
+        except (ValueError, IOError, OSError) as e:
+            errors[path] = str(e)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="check an implementation "
+                                     "against PiCL vector files")
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    parser.add_argument("--adapter", metavar="MODULE:CLASS",
+                        help="implementation to check (default: the "
+                        "reference implementation in this repository)")
+    parser.add_argument("--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="processes to use (default: one per CPU)")
+    parser.add_argument("--max-failures", type=int, default=20, metavar="N",
+                        help="stop reporting after N failures (default: 20)")
+    opts = parser.parse_args(args)
+
+    errors = {}
+    jobs = sets(opts.files, errors)
+    pool = multiprocessing.Pool(opts.jobs, conformance._init_worker,
+                                (opts.adapter,))
+    checked = failed = 0
+    passed = {} # path -> sets that conform
+    skipped = {} # section name -> sets in which it could not be checked
+    timings = {}
+    for (path, set), failure, notChecked, t in pool.imap_unordered(
+            conformance.check_job, jobs, chunksize=4):
+        checked += 1
+        for name in notChecked:
+            skipped[name] = skipped.get(name, 0) + 1
+        for name, (calls, seconds) in t.items():
+            total = timings.setdefault(name, [0, 0.0])
+            total[0] += calls
+            total[1] += seconds
+        if failure:
+            failed += 1
+            if failed <= opts.max_failures:
+                print_("%s set %d: %s" % (path, set, failure))
+        else:
+            passed[path] = passed.get(path, 0) + 1
+    pool.close()
+    pool.join()
+
+    for path in opts.files:
+        if path in errors:
+            print_("%s: %s (%d sets in it not counted as conforming)"
+                   % (path, errors[path], passed.pop(path, 0)))
+    for name, count in sorted(skipped.items()):
+        print_("%s: skipped in %d sets, which lack the sections it needs"
+               % (name, count))
+    print_()
+    print_("%d sets checked, %d conform, %d diverge"
+           % (checked, sum(passed.values()), failed))
+    print_()
+    print_("%-16s %10s %12s %12s" % ("primitive", "calls", "total (s)",
+                                      "mean (us)"))
+    for name, (calls, seconds) in sorted(timings.items()):
+        print_("%-16s %10d %12.3f %12.1f" % (name, calls, seconds,
+                                             1e6*seconds/calls))
+    return 1 if failed or errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,460 @@
+# this should work with both python2.7 and python3.3
+
+# A small in-memory stand-in for the PiCL auth server, enough for
+# demo-client.py (including its loadtest mode) to run end to end without
+# the real one:
+#
+#   python reference-server.py [--port 9000]
+#
+# It implements:
+#
+#   GET  __heartbeat__
+#   POST account/create       {email, verifier, salt, params}
+#   POST session/auth/start   {email} -> {srpToken, srp, stretch}
+#   POST session/auth/finish  {srpToken, A, M} -> {bundle}
+#        bundle of keyFetchToken+sessionToken, keyed by srpK with
+#        "session/auth" (the protocol demo-client speaks today)
+#   POST auth/start, auth/finish
+#        the same, but the bundle is an authToken keyed with "auth/finish"
+#   POST session/create       (Hawk, authToken) -> {bundle}
+#   GET  account/keys         (Hawk, keyFetchToken) -> {bundle}
+#   GET  recovery_email/status (Hawk, sessionToken) -> {email, verified}
+#   POST session/destroy      (Hawk, sessionToken)
+#   POST account/destroy      (Hawk, authToken)
+#   POST password/change      (Hawk, authToken) -> {bundle}
+#        bundle of keyFetchToken+accountResetToken, keyed by the
+#        authToken's requestKey
+#   POST account/reset        (Hawk, accountResetToken) {bundle, salt,
+#                             params}: bundle is wrapKB+verifier XORed
+#                             with the token's keystream (no MAC, the
+#                             request is signed). Revokes every token of
+#                             the account.
+#   GET  __stats__            hit/miss counters of the key cache,
+#                             per-primitive timings with --instrument, and
+#                             SRP pool figures with --srp-procs
+#
+# Hawk requests must sign the body's hash, and each nonce is accepted only
+# once. Tokens are kept by tokenID. The Hawk key for each token is derived
+# with the same HKDF call the client uses, and kept in a KeyCache so that
+# repeated requests with one token skip the HKDF; revoking a token drops
+# its cache entry. Everything is lost when the server exits.
+
+import argparse, binascii, json, os, sys, threading
+import six
+from six.moves import BaseHTTPServer, socketserver
+import mysrp
+import entropy
+import hawkauth
+import instrument
+from keycache import KeyCache
+from hawkauth import tokenKeys
+from hkdf import HKDF
+from bytexor import xor
+from bundle import BundleKeys, KW
+
+def makeRandom():
+    return entropy.random_bytes(32)
+
+def unhex(s):
+    try:
+        return binascii.unhexlify(s)
+    except (TypeError, ValueError, binascii.Error):
+        raise BadRequest("bad hex value")
+
+class BadRequest(Exception):
+    code = 400
+
+class AccountExists(BadRequest):
+    errno = 101
+
+class Unauthorized(Exception):
+    code = 401
+
+class NotFound(Exception):
+    code = 404
+
+class Unavailable(Exception):
+    code = 503
+
+class Store:
+    """Accounts by email, and tokens and pending SRP logins by ID."""
+    def __init__(self, keycache=None):
+        self.lock = threading.Lock()
+        self.accounts = {}
+        self.logins = {}
+        self.tokens = {}
+        self.accountTokens = {} # email -> set of tokenIDs
+        self.keycache = keycache or KeyCache()
+
+    def create_account(self, emailUTF8, account):
+        with self.lock:
+            if emailUTF8 in self.accounts:
+                raise AccountExists("account already exists")
+            self.accounts[emailUTF8] = account
+
+    def destroy_account(self, emailUTF8):
+        """Delete the account and revoke all its tokens."""
+        with self.lock:
+            self.accounts.pop(emailUTF8, None)
+            tokenIDs = self.accountTokens.pop(emailUTF8, ())
+            for tokenID in tokenIDs:
+                self.tokens.pop(tokenID, None)
+        for tokenID in tokenIDs:
+            self.keycache.invalidate(tokenID)
+
+    def reset_account(self, emailUTF8, changes):
+        """Replace the account's verifier, salts and wrapKB with those in
+        changes, and revoke all its tokens."""
+        with self.lock:
+            account = self.accounts.get(emailUTF8)
+            if account is None:
+                raise NotFound("unknown account")
+            self.accounts[emailUTF8] = dict(account, **changes)
+            tokenIDs = self.accountTokens.pop(emailUTF8, ())
+            for tokenID in tokenIDs:
+                self.tokens.pop(tokenID, None)
+        for tokenID in tokenIDs:
+            self.keycache.invalidate(tokenID)
+
+    def account(self, emailUTF8):
+        with self.lock:
+            account = self.accounts.get(emailUTF8)
+        if account is None:
+            raise NotFound("unknown account")
+        return account
+
+    def start_login(self, emailUTF8, srpServer):
+        srpToken = binascii.hexlify(makeRandom()).decode("ascii")
+        with self.lock:
+            self.logins[srpToken] = (emailUTF8, srpServer)
+        return srpToken
+
+    def finish_login(self, srpToken):
+        with self.lock:
+            login = self.logins.pop(srpToken, None)
+        if login is None:
+            raise Unauthorized("unknown srpToken")
+        return login
+
+    def add_token(self, kind, token, emailUTF8):
+        tokenID = tokenKeys(kind, token)[0]
+        with self.lock:
+            self.tokens[tokenID] = (kind, token, emailUTF8)
+            self.accountTokens.setdefault(emailUTF8, set()).add(tokenID)
+        return token
+
+    def token(self, tokenID, kind):
+        with self.lock:
+            t = self.tokens.get(tokenID)
+        if t is None or t[0] != kind:
+            return None
+        return t
+
+    def hawk_key(self, tokenID, kind):
+        """Return the Hawk key for a live token of the given kind, or
+        None."""
+        t = self.token(tokenID, kind)
+        if t is None:
+            return None
+        return self.keycache.get(tokenID, lambda: hawkauth.hawk_key(
+            tokenKeys(kind, t[1])[1]))
+
+    def remove_token(self, tokenID):
+        with self.lock:
+            t = self.tokens.pop(tokenID, None)
+            if t is not None:
+                self.accountTokens.get(t[2], set()).discard(tokenID)
+        self.keycache.invalidate(tokenID)
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    # the headers and the body go out as separate writes; with Nagle on,
+    # the second waits for the client's delayed ACK, about 40ms on every
+    # request of a kept-alive connection after the first
+    disable_nagle_algorithm = True
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+    def do_GET(self):
+        self.dispatch("GET", None)
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length") or 0)
+        self.dispatch("POST", self.rfile.read(length))
+
+    def dispatch(self, method, payload):
+        api = self.path.lstrip("/").split("?")[0]
+        f = ROUTES.get((method, api))
+        try:
+            if f is None:
+                raise NotFound("no such endpoint")
+            body = None
+            if payload is not None:
+                try:
+                    body = json.loads(payload.decode("utf-8") or "{}")
+                except ValueError:
+                    raise BadRequest("body is not JSON")
+            response = f(self, body, payload)
+            status = 200
+        except (BadRequest, Unauthorized, NotFound, Unavailable) as e:
+            status = e.code
+            response = {"code": e.code, "message": str(e)}
+            if hasattr(e, "errno"):
+                response["errno"] = e.errno
+        except (KeyError, TypeError) as e:
+            status = 400
+            response = {"code": 400, "message": "bad request: %r" % (e,)}
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def hawk(self, kind, payload=None):
+        """Verify the request's Hawk header against a token of the given
+        kind. Returns (tokenID, token, emailUTF8)."""
+        header = self.headers.get("authorization")
+        if not header:
+            raise Unauthorized("missing Hawk header")
+        host, _, port = self.headers.get("host", "").partition(":")
+        store = self.server.store
+        try:
+            id = hawkauth.verify(header, self.command, self.path, host,
+                                 port or 80,
+                                 lambda id: store.hawk_key(unhex(id), kind),
+                                 payload, self.headers.get("content-type",
+                                                           ""),
+                                 seen_nonce=self.server.nonces.seen)
+        except hawkauth.HawkError as e:
+            raise Unauthorized(str(e))
+        t = store.token(unhex(id), kind)
+        if t is None: # revoked while we were checking it
+            raise Unauthorized("unknown Hawk id")
+        return (unhex(id),) + t[1:]
+
+ROUTES = {}
+def route(method, api):
+    def _register(f):
+        ROUTES[(method, api)] = f
+        return f
+    return _register
+
+@route("GET", "__heartbeat__")
+def heartbeat(h, body, payload):
+    return {}
+
+@route("GET", "__stats__")
+def stats(h, body, payload):
+    stats = {"keycache": h.server.store.keycache.stats()}
+    if instrument.enabled():
+        stats["instrument"] = instrument.snapshot()
+    if h.server.srp is not None:
+        stats["srp"] = h.server.srp.stats()
+    return stats
+
+@route("POST", "account/create")
+def account_create(h, body, payload):
+    emailUTF8 = body["email"].encode("utf-8")
+    stretch = body["params"]["stretch"]
+    account = {"verifier": unhex(body["verifier"]),
+               "srpSalt": unhex(body["salt"]),
+               "mainKDFSalt": unhex(stretch["salt"]),
+               "rounds": stretch["rounds"],
+               "kA": makeRandom(),
+               "wrapKB": makeRandom(),
+               }
+    h.server.store.create_account(emailUTF8, account)
+    return {}
+
+@route("POST", "session/auth/start")
+@route("POST", "auth/start")
+def auth_start(h, body, payload):
+    emailUTF8 = body["email"].encode("utf-8")
+    account = h.server.store.account(emailUTF8)
+    if h.server.srp is None:
+        srpServer = mysrp.Server(account["verifier"])
+        B = srpServer.one()
+    else:
+        # srpServer is an srpexec.State
+        srpServer = srpCall(h.server.srp.server_one, account["verifier"])
+        B = srpServer.B_bytes
+    srpToken = h.server.store.start_login(emailUTF8, srpServer)
+    def hexstr(value):
+        return binascii.hexlify(value).decode("ascii")
+    return {"srpToken": srpToken,
+            "srp": {"N_bits": 2048, "alg": "sha256",
+                    "s": hexstr(account["srpSalt"]), "B": hexstr(B)},
+            "stretch": {"salt": hexstr(account["mainKDFSalt"]),
+                        "rounds": account["rounds"]},
+            }
+
+def srpCall(f, *args):
+    # run an srpexec call and wait for it, turning its refusals into 503s
+    import srpexec
+    try:
+        return f(*args).result()
+    except (srpexec.Overloaded, srpexec.DeadlineExceeded) as e:
+        raise Unavailable(str(e))
+
+def finish_login(h, body):
+    emailUTF8, srpServer = h.server.store.finish_login(body["srpToken"])
+    A, M = unhex(body["A"]), unhex(body["M"])
+    try:
+        if h.server.srp is None:
+            srpServer.two(A, M)
+            return emailUTF8, srpServer.get_key()
+        K, M2 = srpCall(h.server.srp.server_two, srpServer, A, M)
+        return emailUTF8, K
+    except ValueError as e:
+        raise Unauthorized(str(e))
+
+def newSession(store, emailUTF8):
+    keyFetchToken = store.add_token("keyFetchToken", makeRandom(), emailUTF8)
+    sessionToken = store.add_token("sessionToken", makeRandom(), emailUTF8)
+    return keyFetchToken + sessionToken
+
+@route("POST", "session/auth/finish")
+def session_auth_finish(h, body, payload):
+    emailUTF8, K = finish_login(h, body)
+    plaintext = newSession(h.server.store, emailUTF8)
+    keys = BundleKeys(K, "session/auth", len(plaintext))
+    return {"bundle": binascii.hexlify(keys.seal(plaintext)).decode("ascii")}
+
+@route("POST", "auth/finish")
+def auth_finish(h, body, payload):
+    emailUTF8, K = finish_login(h, body)
+    authToken = h.server.store.add_token("authToken", makeRandom(), emailUTF8)
+    keys = BundleKeys(K, "auth/finish", len(authToken))
+    return {"bundle": binascii.hexlify(keys.seal(authToken)).decode("ascii")}
+
+def requestKey(authToken):
+    return HKDF(SKM=authToken, XTS=None, CTXinfo=KW("authToken"),
+                dkLen=3*32)[2*32:]
+
+@route("POST", "session/create")
+def session_create(h, body, payload):
+    tokenID, authToken, emailUTF8 = h.hawk("authToken", payload)
+    h.server.store.remove_token(tokenID)
+    plaintext = newSession(h.server.store, emailUTF8)
+    keys = BundleKeys(requestKey(authToken), "session/create", len(plaintext))
+    return {"bundle": binascii.hexlify(keys.seal(plaintext)).decode("ascii")}
+
+@route("GET", "account/keys")
+def account_keys(h, body, payload):
+    tokenID, keyFetchToken, emailUTF8 = h.hawk("keyFetchToken")
+    h.server.store.remove_token(tokenID)
+    account = h.server.store.account(emailUTF8)
+    plaintext = account["kA"] + account["wrapKB"]
+    keys = BundleKeys(keyFetchToken, "account/keys", len(plaintext))
+    return {"bundle": binascii.hexlify(keys.seal(plaintext)).decode("ascii")}
+
+@route("GET", "recovery_email/status")
+def recovery_email_status(h, body, payload):
+    tokenID, sessionToken, emailUTF8 = h.hawk("sessionToken")
+    return {"email": emailUTF8.decode("utf-8"), "verified": True}
+
+@route("POST", "session/destroy")
+def session_destroy(h, body, payload):
+    tokenID, sessionToken, emailUTF8 = h.hawk("sessionToken", payload)
+    h.server.store.remove_token(tokenID)
+    return {}
+
+@route("POST", "account/destroy")
+def account_destroy(h, body, payload):
+    tokenID, authToken, emailUTF8 = h.hawk("authToken", payload)
+    h.server.store.destroy_account(emailUTF8)
+    return {}
+
+@route("POST", "password/change")
+def password_change(h, body, payload):
+    tokenID, authToken, emailUTF8 = h.hawk("authToken", payload)
+    store = h.server.store
+    store.remove_token(tokenID)
+    plaintext = (store.add_token("keyFetchToken", makeRandom(), emailUTF8) +
+                 store.add_token("accountResetToken", makeRandom(), emailUTF8))
+    keys = BundleKeys(requestKey(authToken), "password/change",
+                      len(plaintext))
+    return {"bundle": binascii.hexlify(keys.seal(plaintext)).decode("ascii")}
+
+@route("POST", "account/reset")
+def account_reset(h, body, payload):
+    tokenID, accountResetToken, emailUTF8 = h.hawk("accountResetToken",
+                                                   payload)
+    ciphertext = unhex(body["bundle"])
+    if len(ciphertext) != 32 + 2048//8:
+        raise BadRequest("bundle has the wrong length")
+    with BundleKeys(accountResetToken, "account/reset",
+                    len(ciphertext)) as keys:
+        plaintext = xor(ciphertext, keys.xorKey)
+    stretch = body["params"]["stretch"]
+    h.server.store.reset_account(emailUTF8,
+                                 {"wrapKB": plaintext[:32],
+                                  "verifier": plaintext[32:],
+                                  "srpSalt": unhex(body["salt"]),
+                                  "mainKDFSalt": unhex(stretch["salt"]),
+                                  "rounds": stretch["rounds"]})
+    return {}
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, store=None, srp=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.store = store or Store()
+        self.srp = srp # an srpexec.SRPExecutor, or None to compute inline
+        self.nonces = hawkauth.NonceCache()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an in-memory PiCL "
+                                     "auth server for demo-client.py.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--key-cache-size", type=int, default=10000,
+                        help="tokens whose derived keys are cached")
+    parser.add_argument("--key-cache-ttl", type=float, default=300,
+                        help="seconds a cached key is kept")
+    parser.add_argument("--seed",
+                        help="make tokens, salts and SRP ephemerals "
+                        "deterministic (for reproducible single-client "
+                        "benchmarks; never in production)")
+    parser.add_argument("--instrument", action="store_true",
+                        help="time HKDF and the SRP steps, and report them "
+                        "in __stats__")
+    parser.add_argument("--srp-procs", type=int, default=0,
+                        help="do the SRP math in this many worker "
+                        "processes (python3 only; default: in the request "
+                        "thread)")
+    parser.add_argument("--srp-max-pending", type=int,
+                        help="SRP calls queued before logins get 503 "
+                        "(default: 4 per process)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="log every request")
+    args = parser.parse_args()
+    if args.instrument:
+        instrument.enable()
+    if args.seed is not None:
+        entropy.set_source(entropy.DRBG(args.seed))
+    Handler.quiet = not args.verbose
+    store = Store(KeyCache(args.key_cache_size, args.key_cache_ttl))
+    srp = None
+    if args.srp_procs:
+        import srpexec
+        srp = srpexec.SRPExecutor(args.srp_procs, args.srp_max_pending,
+                                  wait=1.0)
+    server = Server((args.host, args.port), store, srp)
+    six.print_("listening on http://%s:%d/" % (args.host, args.port),
+               file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
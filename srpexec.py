@@ -0,0 +1,280 @@
+# this needs python3.5 or later
+#
+# The server's half of SRP (mysrp.Server.one and .two) is a couple of
+# 2048-bit modular exponentiations: milliseconds of pure CPU with the GIL
+# held, during which no other request in the process gets anywhere.
+# SRPExecutor runs them in a pool of worker processes instead:
+#
+#   srp = SRPExecutor(procs=4)
+#   state = srp.server_one(verifier).result()       # B is state.B_bytes
+#   K, M2 = srp.server_two(state, A_bytes, M1_bytes).result()
+#
+# or, from asyncio code, with AsyncSRPExecutor:
+#
+#   state = await srp.server_one(verifier)
+#   K, M2 = await srp.server_two(state, A_bytes, M1_bytes)
+#
+# The handshake state between the two calls is a small State tuple (the
+# verifier, the 32-byte secret b and B) that the caller keeps, so any
+# worker can do the second half. b is drawn in the calling process, from
+# entropy.random_bytes().
+#
+# Backpressure: at most max_pending calls are queued or running. Beyond
+# that a call waits up to 'wait' seconds for room and then raises
+# Overloaded, which a server should turn into a 503. Every call also has
+# a deadline (timeout seconds from submission); one that is still queued
+# when its deadline passes fails with DeadlineExceeded instead of being
+# computed for a client that has given up. stats() reports throughput,
+# queueing and worker utilization.
+
+import asyncio, collections, concurrent.futures, os, threading, time
+import mysrp
+import entropy
+
+class Overloaded(Exception):
+    pass
+
+class DeadlineExceeded(Exception):
+    pass
+
+State = collections.namedtuple("State", ["verifier", "b", "B_bytes"])
+
+# the worker side: each returns (result, seconds spent computing)
+
+def _warm(i):
+    time.sleep(0.05) # so that every worker gets one
+    return os.getpid()
+
+def _check(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded("deadline passed while queued")
+    return time.time()
+
+def _one(verifier, b, deadline):
+    start = _check(deadline)
+    B_bytes = mysrp.Server(verifier).one(mysrp.bytes_to_long(b))
+    return B_bytes, time.time() - start
+
+def _two(state, A_bytes, M1_bytes, deadline):
+    start = _check(deadline)
+    s = mysrp.Server(state.verifier)
+    s.b = mysrp.bytes_to_long(state.b)
+    s.B_bytes = state.B_bytes
+    try:
+        M2 = s.two(A_bytes, M1_bytes)
+    except ValueError as e:
+        # return rather than raise, so a bad M1 does not count as a failure
+        return e, time.time() - start
+    return (s.get_key(), M2), time.time() - start
+
+class SRPExecutor:
+    def __init__(self, procs=None, max_pending=None, timeout=5.0, wait=0):
+        self.procs = procs or os.cpu_count() or 1
+        self.max_pending = max_pending or 4*self.procs
+        self.timeout = timeout
+        self.wait = wait
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.procs)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.submitted = self.completed = self.rejected = 0
+        self.expired = self.failed = self.in_flight = self.peak = 0
+        self.busy = self.queued = 0.0 # seconds, summed over calls
+        # start every worker now rather than on the first logins
+        list(self._pool.map(_warm, range(self.procs)))
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        raise Overloaded("%d SRP calls pending" % self.max_pending)
+
+    def _submit(self, f, args, convert, timeout):
+        if self.wait:
+            acquired = self._slots.acquire(timeout=self.wait)
+        else:
+            acquired = self._slots.acquire(False)
+        if not acquired:
+            self._reject()
+        return self._start(f, args, convert, timeout, self._slots.release)
+
+    def _start(self, f, args, convert, timeout, release):
+        # the caller holds a slot, which release() gives back
+        submitted = time.time()
+        if timeout is None:
+            timeout = self.timeout
+        deadline = submitted + timeout if timeout else None
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        outer = concurrent.futures.Future()
+        def done(inner):
+            release()
+            elapsed = time.time() - submitted
+            with self._lock:
+                self.in_flight -= 1
+                error = inner.exception()
+                if error is None:
+                    result, busy = inner.result()
+                    self.completed += 1
+                    self.busy += busy
+                    self.queued += elapsed - busy
+                elif isinstance(error, DeadlineExceeded):
+                    self.expired += 1
+                else:
+                    self.failed += 1
+            if error is not None:
+                outer.set_exception(error)
+            elif isinstance(result, Exception):
+                outer.set_exception(result)
+            else:
+                outer.set_result(convert(result))
+        try:
+            self._pool.submit(f, *(args + (deadline,))).add_done_callback(done)
+        except Exception:
+            release()
+            with self._lock:
+                self.in_flight -= 1
+                self.failed += 1
+            raise
+        return outer
+
+    def server_one(self, verifier, timeout=None):
+        """Start a login: returns a Future of the State, whose B_bytes goes
+        to the client."""
+        b = entropy.random_bytes(32)
+        return self._submit(_one, (verifier, b),
+                            lambda B_bytes: State(verifier, b, B_bytes),
+                            timeout)
+
+    def server_two(self, state, A_bytes, M1_bytes, timeout=None):
+        """Finish it: returns a Future of (K, M2). The future raises
+        ValueError, as mysrp.Server.two does, if the client's A or M1 is
+        no good."""
+        return self._submit(_two, (state, A_bytes, M1_bytes), lambda r: r,
+                            timeout)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.time() - self._started
+            return {"procs": self.procs, "max_pending": self.max_pending,
+                    "in_flight": self.in_flight, "peak": self.peak,
+                    "submitted": self.submitted,
+                    "completed": self.completed,
+                    "rejected": self.rejected, "expired": self.expired,
+                    "failed": self.failed,
+                    "mean_compute": self.busy / max(self.completed, 1),
+                    "mean_queued": self.queued / max(self.completed, 1),
+                    "utilization": self.busy / (self.procs * elapsed)}
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait)
+
+class AsyncSRPExecutor(SRPExecutor):
+    """The same, with coroutines for asyncio servers. Overloaded is raised
+    by the await, not by creating the coroutine. Waiting for room happens
+    on an asyncio.Semaphore, so it does not hold up the event loop; use
+    one AsyncSRPExecutor per loop."""
+    _room = None
+
+    async def _submit(self, f, args, convert, timeout):
+        loop = asyncio.get_event_loop()
+        if self._room is None:
+            self._room = asyncio.Semaphore(self.max_pending)
+        if not self.wait:
+            if self._room.locked():
+                self._reject()
+            await self._room.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self._room.acquire(), self.wait)
+            except asyncio.TimeoutError:
+                self._reject()
+        # the pool calls back from its own thread
+        release = lambda: loop.call_soon_threadsafe(self._room.release)
+        return await asyncio.wrap_future(
+            self._start(f, args, convert, timeout, release))
+
+    async def server_one(self, verifier, timeout=None):
+        return await SRPExecutor.server_one(self, verifier, timeout)
+
+    async def server_two(self, state, A_bytes, M1_bytes, timeout=None):
+        return await SRPExecutor.server_two(self, state, A_bytes, M1_bytes,
+                                            timeout)
+
+
+# "python3 srpexec.py" runs many handshakes at once from asyncio, first
+# computing the server side inline and then through AsyncSRPExecutor,
+# while a ticker measures how late the event loop gets to run it.
+
+def _demo(logins=200, concurrency=50, procs=None):
+    emailUTF8, srpPW = b"demo@example.org", b"\x01"*32
+    salt = b"\x02"*32
+    verifier = mysrp.create_verifier(emailUTF8, srpPW, salt)[0]
+    # the client side is the same for every login, and not what is being
+    # measured: precompute it for a fixed b
+    b = b"\x03"*32
+    B_bytes = mysrp.Server(verifier).one(mysrp.bytes_to_long(b))
+    client = mysrp.Client()
+    A_bytes = client.one()
+    M1_bytes = client.two(B_bytes, salt, emailUTF8, srpPW)
+    fixed = State(verifier, b, B_bytes)
+
+    async def inline():
+        mysrp.Server(verifier).one()
+        s = mysrp.Server(verifier)
+        s.b, s.B_bytes = mysrp.bytes_to_long(b), B_bytes
+        return s.two(A_bytes, M1_bytes)
+
+    async def pooled(srp):
+        await srp.server_one(verifier)
+        return (await srp.server_two(fixed, A_bytes, M1_bytes))[1]
+
+    async def run(login):
+        lags, latencies = [], []
+        running = True
+        async def ticker():
+            while running:
+                start = time.time()
+                await asyncio.sleep(0.005)
+                lags.append(time.time() - start - 0.005)
+        tick = asyncio.ensure_future(ticker())
+        sem = asyncio.Semaphore(concurrency)
+        async def one():
+            async with sem:
+                start = time.time()
+                await login()
+                latencies.append(time.time() - start)
+        start = time.time()
+        await asyncio.gather(*[one() for i in range(logins)])
+        elapsed = time.time() - start
+        running = False
+        await tick
+        return elapsed, sorted(latencies), sorted(lags)
+
+    def report(name, result):
+        elapsed, latencies, lags = result
+        p = lambda values, q: 1e3*values[min(len(values)-1,
+                                             int(len(values)*q))]
+        print("%-8s %6.1f logins/s  login p50 %6.1f ms p99 %6.1f ms  "
+              "loop lag p50 %6.1f ms max %6.1f ms"
+              % (name, logins/elapsed, p(latencies, .5), p(latencies, .99),
+                 p(lags, .5), 1e3*lags[-1]))
+
+    loop = asyncio.new_event_loop()
+    report("inline", loop.run_until_complete(run(inline)))
+    srp = AsyncSRPExecutor(procs, max_pending=concurrency)
+    report("pooled", loop.run_until_complete(run(lambda: pooled(srp))))
+    print(srp.stats())
+    srp.shutdown()
+    loop.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="compare SRP server math "
+                                     "inline and in a process pool")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--procs", type=int)
+    args = parser.parse_args()
+    _demo(args.logins, args.concurrency, args.procs)
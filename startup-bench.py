@@ -0,0 +1,164 @@
+# this should work with both python2.7 and python3.3
+
+# Measure how long the command-line tools take to start: the wall clock of
+# a few cold runs of each command, and which imports that time goes to
+# (like python3 -X importtime, but this works on python2 as well).
+#
+#   python startup-bench.py [--runs N] [--json FILE] [--baseline FILE]
+#
+# --json saves the results; --baseline compares against results saved
+# earlier and exits 1 if any command got more than --tolerance slower.
+
+# Only what --trace-imports needs is imported up here, so that anything
+# the measured script imports shows up in its breakdown.
+import os, sys, time
+
+# name -> argv. Each one exits right after parsing its arguments, so what
+# gets measured is the startup cost rather than the crypto.
+COMMANDS = [
+    ("python", ["-c", "pass"]), # the interpreter alone, for reference
+    ("picl-crypto --list", ["picl-crypto.py", "--list"]),
+    ("picl-crypto --help", ["picl-crypto.py", "--help"]),
+    ("demo-client loadtest --help", ["demo-client.py", "loadtest", "--help"]),
+    ("demo-client provision --help", ["demo-client.py", "provision",
+                                      "--help"]),
+    ("picl-verify --help", ["picl-verify.py", "--help"]),
+    ("reference-server --help", ["reference-server.py", "--help"]),
+    ("kdfd --help", ["kdfd.py", "--help"]),
+    ]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def traceImports(outfile, argv):
+    """Run a script with __import__ hooked, and write a JSON list of
+    [module, inclusive seconds, self seconds] for every import that loaded
+    something new to outfile."""
+    import runpy
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
+    records = []
+    stack = [] # seconds spent in nested imports, one entry per level
+    real = builtins.__import__
+    def hook(name, *args, **kwargs):
+        n = len(sys.modules)
+        stack.append(0.0)
+        start = time.time()
+        module = None
+        try:
+            module = real(name, *args, **kwargs)
+            return module
+        finally:
+            elapsed = time.time() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if len(sys.modules) > n:
+                # relative imports only give us part of the name
+                if "." not in name and module is not None:
+                    name = module.__name__
+                records.append((name, elapsed, elapsed - nested))
+    builtins.__import__ = hook
+    sys.argv = argv
+    sys.path.insert(0, os.path.dirname(os.path.abspath(argv[0])))
+    start = time.time()
+    try:
+        runpy.run_path(argv[0], run_name="__main__")
+    except SystemExit:
+        pass
+    finally:
+        builtins.__import__ = real
+        total = time.time() - start
+        import json
+        with open(outfile, "w") as f:
+            json.dump({"total": total, "imports": records}, f)
+
+def wallClock(argv, runs):
+    import subprocess
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for i in range(runs):
+            start = time.time()
+            subprocess.call([sys.executable] + argv, cwd=HERE,
+                            stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return sorted(times)
+
+def importBreakdown(argv):
+    import json, subprocess, tempfile
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        with open(os.devnull, "w") as devnull:
+            subprocess.call([sys.executable, os.path.abspath(__file__),
+                             "--trace-imports", path] + argv, cwd=HERE,
+                            stdout=devnull, stderr=devnull)
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        os.unlink(path)
+
+def main():
+    if sys.argv[1:2] == ["--trace-imports"]:
+        return traceImports(sys.argv[2], sys.argv[3:])
+    import argparse, json
+    from six import print_
+    parser = argparse.ArgumentParser(description="measure the cold start "
+                                     "of each command-line tool")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="runs of each command (default: 10)")
+    parser.add_argument("--top", type=int, default=6,
+                        help="slowest imports to show per command")
+    parser.add_argument("--json", metavar="FILE", help="save the results")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with results saved by --json")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline "
+                        "(default: 0.2, i.e. 20%%)")
+    parser.add_argument("commands", nargs="*", metavar="COMMAND",
+                        help="commands to measure (default: all)")
+    opts = parser.parse_args()
+
+    results = {}
+    for name, argv in COMMANDS:
+        if opts.commands and name not in opts.commands:
+            continue
+        times = wallClock(argv, opts.runs)
+        trace = {"imports": []}
+        if not argv[0].startswith("-"):
+            trace = importBreakdown(argv)
+        results[name] = {"median_ms": 1e3*times[len(times)//2],
+                         "min_ms": 1e3*times[0],
+                         "imports": trace["imports"]}
+        print_("%-32s median %6.1f ms  min %6.1f ms"
+               % (name, 1e3*times[len(times)//2], 1e3*times[0]))
+        slowest = sorted(trace["imports"], key=lambda r: -r[2])
+        for (module, inclusive, own) in slowest[:opts.top]:
+            print_("    %-28s self %6.1f ms  cumulative %6.1f ms"
+                   % (module, 1e3*own, 1e3*inclusive))
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump({"python": sys.version.split()[0],
+                       "commands": results}, f, indent=1, sort_keys=True)
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)["commands"]
+        print_()
+        regressed = False
+        for name in sorted(results):
+            if name not in baseline:
+                continue
+            old, new = baseline[name]["median_ms"], results[name]["median_ms"]
+            flag = ""
+            if new > old * (1 + opts.tolerance):
+                flag = "  REGRESSION"
+                regressed = True
+            print_("%-32s %6.1f -> %6.1f ms (%+.0f%%)%s"
+                   % (name, old, new, 100.0*(new-old)/old, flag))
+        if regressed:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
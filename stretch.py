@@ -0,0 +1,94 @@
+# this should work with both python2.7 and python3.3
+
+# The client-side password stretch and main-KDF from the spec:
+#
+#   K1 = PBKDF2-SHA256(password, KWE("first-PBKDF", email), 20000 rounds)
+#   K2 = scrypt(K1, KW("scrypt"), N=64*1024, r=8, p=1)
+#   stretchedPW = PBKDF2-SHA256(K2+password, KWE("second-PBKDF", email),
+#                               20000 rounds)
+#   (srpPW, unwrapBKey) = HKDF(stretchedPW, mainKDFSalt, KW("mainKDF"))
+#
+# The stretch only depends on the email and password, so callers can start
+# it before (and run it alongside) anything that needs the server.
+
+from hashlib import sha256
+import threading
+import six
+from hkdf import HKDF
+import instrument
+
+# get scrypt-0.6.1 from PyPI, run this with it in your PYTHONPATH
+# https://pypi.python.org/pypi/scrypt/0.6.1
+# It is only imported by the first scrypt_hash() call.
+@instrument.timed("scrypt")
+def scrypt_hash(password, salt, N, r, p, buflen):
+    import scrypt
+    return scrypt.hash(password, salt, N=N, r=r, p=p, buflen=buflen)
+
+# PyPI has four candidates for PBKDF2 functionality. We use "simple-pbkdf2"
+# by Armin Ronacher: https://pypi.python.org/pypi/simple-pbkdf2/1.0 . Note
+# that v1.0 has a bug which causes segfaults when num_iterations is greater
+# than about 88k. Like scrypt, it is only imported when first used (and is
+# python2-only, so a python3 process can still use the rest of this module).
+@instrument.timed("pbkdf2")
+def pbkdf2_bin(data, salt, iterations, keylen, hashfunc):
+    from pbkdf2 import pbkdf2_bin
+    return pbkdf2_bin(data, salt, iterations, keylen=keylen, hashfunc=hashfunc)
+
+# other options:
+# * https://pypi.python.org/pypi/PBKDF/1.0
+#   most mature, but hardwired to use SHA1
+#
+# * https://pypi.python.org/pypi/pbkdf2/1.3
+#   doesn't work without pycrypto, since its hashlib fallback is buggy
+#
+# * https://pypi.python.org/pypi/pbkdf2.py/1.1
+#   also looks good, but ships in multiple files
+
+PBKDF2_ROUNDS = 20*1000
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 64*1024, 8, 1
+
+def KW(name):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name)
+def KWE(name, emailUTF8):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name) + b":" + emailUTF8
+
+@instrument.timed("stretch")
+def stretch(emailUTF8, passwordUTF8, rounds=PBKDF2_ROUNDS, N=SCRYPT_N,
+            r=SCRYPT_R, p=SCRYPT_P):
+    """Return (K1, K2, stretchedPW)."""
+    k1 = pbkdf2_bin(passwordUTF8, KWE("first-PBKDF", emailUTF8),
+                    rounds, keylen=1*32, hashfunc=sha256)
+    k2 = scrypt_hash(k1, KW("scrypt"), N=N, r=r, p=p, buflen=1*32)
+    stretchedPW = pbkdf2_bin(k2+passwordUTF8, KWE("second-PBKDF", emailUTF8),
+                             rounds, keylen=1*32, hashfunc=sha256)
+    return k1, k2, stretchedPW
+
+@instrument.timed("mainKDF")
+def mainKDF(stretchedPW, mainKDFSalt):
+    """Return (srpPW, unwrapBKey)."""
+    x = HKDF(SKM=stretchedPW,
+             XTS=mainKDFSalt,
+             CTXinfo=KW("mainKDF"),
+             dkLen=2*32)
+    return x[:32], x[32:]
+
+class Background(threading.Thread):
+    """Run f(*args) in a daemon thread. result() waits for it and returns
+    its value, or re-raises its exception."""
+    def __init__(self, f, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.f, self.args = f, args
+        self.value = self.error = None
+        self.start()
+    def run(self):
+        try:
+            self.value = self.f(*self.args)
+        except BaseException as e:
+            self.error = e
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
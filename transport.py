@@ -0,0 +1,106 @@
+# this should work with both python2.7 and python3.3
+
+# HTTP transport for talking to an auth server: one requests.Session, so
+# every call reuses a pooled keep-alive connection instead of paying for a
+# new TCP handshake, with timeouts, retry/backoff for idempotent requests,
+# and a record of how long each request took.
+#
+# requests is imported when the first Transport is made, since importing
+# it costs more than everything else a short-lived client does at startup.
+
+import json, threading, time
+import instrument
+
+class HTTPError(Exception):
+    def __init__(self, method, api, response):
+        Exception.__init__(self, "%s %s: %d %r" % (method, api,
+                                                   response.status_code,
+                                                   response.content))
+        self.response = response
+
+class Transport:
+    """requests against baseurl. Connection pools hold up to pool_size
+    connections per host. timeout is (connect, read) in seconds. GETs (and
+    any request that failed to connect) are retried up to 'retries' times
+    with exponential backoff starting at 'backoff' seconds; POSTs that
+    reached the server are never retried. Every request is recorded in
+    self.latencies as (method, api, status, seconds), where status is None
+    if no response arrived at all."""
+    def __init__(self, baseurl, pool_size=10, timeout=(3.05, 30),
+                 retries=3, backoff=0.1, keepalive=True):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+        self.baseurl = baseurl
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Retry's default method list is the idempotent ones. Once the
+        # retries run out, the last 5xx response is returned (and becomes
+        # an HTTPError) rather than raised as a RetryError.
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not keepalive:
+            self.session.headers["connection"] = "close"
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def request(self, method, api, headers=None, body=None, signer=None):
+        """Send a request and return the decoded JSON response. body, if
+        given, is sent as JSON. signer, if given, is a hawkauth.Signer for
+        the request. Raises HTTPError unless the server answers 200."""
+        if body is not None:
+            headers = dict(headers or {})
+            headers["content-type"] = "application/json"
+            body = json.dumps(body)
+        if signer is not None:
+            headers = dict(headers or {})
+            headers["authorization"] = signer.header(
+                method, self.baseurl+api, body,
+                headers.get("content-type", ""))
+        import requests
+        # in a trace, "headers" is how long the response headers took to
+        # arrive (connecting included), the rest of the span is reading
+        # and decoding the body
+        with instrument.span("http %s %s" % (method, api)) as s:
+            start = time.time()
+            try:
+                r = self.session.request(method, self.baseurl+api,
+                                         headers=headers, data=body,
+                                         timeout=self.timeout)
+            except requests.RequestException:
+                self._record(method, api, None, time.time() - start)
+                raise
+            self._record(method, api, r.status_code, time.time() - start)
+            s.attrs["status"] = r.status_code
+            s.attrs["headers"] = r.elapsed.total_seconds()
+            if r.status_code != 200:
+                raise HTTPError(method, api, r)
+            return r.json()
+
+    def _record(self, method, api, status, seconds):
+        with self._lock:
+            self.latencies.append((method, api, status, seconds))
+
+    def get(self, api, headers=None, signer=None):
+        return self.request("GET", api, headers, signer=signer)
+
+    def post(self, api, body={}, headers=None, signer=None):
+        return self.request("POST", api, headers, body, signer)
+
+    def summary(self):
+        """Return {(method, api): (count, total seconds, max seconds)}."""
+        out = {}
+        with self._lock:
+            latencies = list(self.latencies)
+        for (method, api, status, seconds) in latencies:
+            count, total, worst = out.get((method, api), (0, 0.0, 0.0))
+            out[(method, api)] = (count+1, total+seconds, max(worst, seconds))
+        return out
+
+    def close(self):
+        self.session.close()
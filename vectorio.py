@@ -0,0 +1,224 @@
+# this should work with both python2.7 and python3.3
+
+# Machine-readable forms of the test vectors, for other implementations'
+# test harnesses. Both formats are written section by section, as each
+# stage of vectors.Vectors finishes, and end with a SHA-256 over
+# everything before the trailer.
+#
+# JSON Lines ("jsonl"): one object per line.
+#   {"format": "picl-vectors", "version": 1}
+#   {"set": 0, "section": "stretch", "title": "stretch-KDF",
+#    "values": [{"name": "email", "hex": "616e..."},
+#               {"name": "internal x", "dec": "8192..."}, ...]}
+#   ...
+#   {"sections": 14, "sha256": "<hex digest of all previous lines>"}
+#
+# length-prefixed binary ("binary"): the 8-byte MAGIC, then records of
+#   tag (1 byte), payload length (4 bytes, big-endian), payload
+# where tag is
+#   "S": section. set (u32), len(name) (u16), len(title) (u16), name, title
+#   "V": value of the preceding section. kind (1 byte, "h" for bytes, "d"
+#        for an integer), len(name) (u16), name, value. Integers are stored
+#        big-endian with no padding.
+#   "E": end. The SHA-256 of MAGIC and all previous records.
+# read_binary() accepts anything that supports the buffer protocol, so a
+# mmap of the file can be read without copying the values.
+
+import binascii, json, mmap, struct
+from hashlib import sha256
+
+MAGIC = b"PICLVEC\x01"
+_record = struct.Struct(">BI")
+_section = struct.Struct(">IHH")
+_value = struct.Struct(">BH")
+TAG_SECTION, TAG_VALUE, TAG_END = ord("S"), ord("V"), ord("E")
+KIND_HEX, KIND_DEC = ord("h"), ord("d")
+
+def _values(section):
+    # notes are progress messages, not vectors
+    return [(kind, label, value)
+            for (kind, label, value, _) in section.entries
+            if kind in ("hex", "dec")]
+
+def long_to_bytes(n):
+    h = "%x" % n
+    if len(h) % 2:
+        h = "0" + h
+    return binascii.unhexlify(h) if n else b""
+
+def bytes_to_long(b):
+    return int(binascii.hexlify(b), 16) if len(b) else 0
+
+
+class JSONLinesWriter:
+    def __init__(self, f):
+        self.f = f
+        self.hash = sha256()
+        self.count = 0
+        self._line({"format": "picl-vectors", "version": 1})
+
+    def _line(self, obj):
+        line = (json.dumps(obj, sort_keys=True) + "\n").encode("utf-8")
+        self.hash.update(line)
+        self.f.write(line)
+
+    def write_section(self, section, set=0):
+        values = []
+        for (kind, label, value) in _values(section):
+            if kind == "hex":
+                values.append({"name": label,
+                               "hex": binascii.hexlify(value).decode("ascii")})
+            else:
+                values.append({"name": label, "dec": str(value)})
+        self._line({"set": set, "section": section.name,
+                    "title": section.title, "values": values})
+        self.count += 1
+        self.f.flush()
+
+    def close(self):
+        line = json.dumps({"sections": self.count,
+                           "sha256": self.hash.hexdigest()}, sort_keys=True)
+        self.f.write((line + "\n").encode("utf-8"))
+        self.f.flush()
+
+
+class BinaryWriter:
+    def __init__(self, f):
+        self.f = f
+        self.hash = sha256()
+        self._write(MAGIC)
+
+    def _write(self, data):
+        self.hash.update(data)
+        self.f.write(data)
+
+    def _record(self, tag, payload):
+        self._write(_record.pack(tag, len(payload)) + payload)
+
+    def write_section(self, section, set=0):
+        name = section.name.encode("utf-8")
+        title = section.title.encode("utf-8")
+        self._record(TAG_SECTION,
+                     _section.pack(set, len(name), len(title)) + name + title)
+        for (kind, label, value) in _values(section):
+            label = label.encode("utf-8")
+            if kind == "hex":
+                kind, data = KIND_HEX, value
+            else:
+                kind, data = KIND_DEC, long_to_bytes(value)
+            self._record(TAG_VALUE,
+                         _value.pack(kind, len(label)) + label + data)
+        self.f.flush()
+
+    def close(self):
+        digest = self.hash.digest()
+        self.f.write(_record.pack(TAG_END, len(digest)) + digest)
+        self.f.flush()
+
+WRITERS = {"jsonl": JSONLinesWriter, "binary": BinaryWriter}
+
+
+class VectorSection:
+    """One section as read back from a vector file. values is a list of
+    (name, value) pairs, where value is bytes (or a memoryview, from
+    read_binary) or an integer."""
+    def __init__(self, set, name, title):
+        self.set = set
+        self.name = name
+        self.title = title
+        self.values = []
+    def __getitem__(self, name):
+        for (n, value) in self.values:
+            if n == name:
+                return value
+        raise KeyError(name)
+
+def read_jsonl(f):
+    """Yield the VectorSections of a JSON Lines vector file (opened in
+    binary mode), checking the trailing hash once the end is reached."""
+    h = sha256()
+    header = f.readline()
+    h.update(header)
+    if json.loads(header.decode("utf-8")).get("format") != "picl-vectors":
+        raise ValueError("not a picl-vectors file")
+    count = 0
+    for line in f:
+        obj = json.loads(line.decode("utf-8"))
+        if "sha256" in obj:
+            if obj["sha256"] != h.hexdigest() or obj["sections"] != count:
+                raise ValueError("vector file is corrupt (hash mismatch)")
+            return
+        h.update(line)
+        count += 1
+        s = VectorSection(obj["set"], obj["section"], obj["title"])
+        for v in obj["values"]:
+            if "hex" in v:
+                s.values.append((v["name"], binascii.unhexlify(v["hex"])))
+            else:
+                s.values.append((v["name"], int(v["dec"])))
+        yield s
+    raise ValueError("vector file is truncated")
+
+def read_binary(buf):
+    """Yield the VectorSections of a binary vector file held in buf (bytes,
+    or e.g. a mmap). Byte values are memoryviews into buf. The trailing
+    hash is checked once the end is reached."""
+    try:
+        view = memoryview(buf)
+    except TypeError:
+        # python2's mmap does not export the new buffer interface
+        view = memoryview(buf[:])
+    if view[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError("not a picl-vectors file")
+    h = sha256()
+    offset = len(MAGIC)
+    s = None
+    try:
+        while offset + _record.size <= len(view):
+            tag, length = _record.unpack_from(view, offset)
+            body = offset + _record.size
+            payload = view[body:body+length]
+            if len(payload) != length:
+                break
+            if tag == TAG_END:
+                h.update(view[:offset])
+                if payload.tobytes() != h.digest():
+                    raise ValueError("vector file is corrupt (hash mismatch)")
+                if s is not None:
+                    yield s
+                return
+            if tag == TAG_SECTION:
+                if s is not None:
+                    yield s
+                set, nlen, tlen = _section.unpack_from(payload)
+                p = _section.size
+                name = payload[p:p+nlen].tobytes().decode("utf-8")
+                title = payload[p+nlen:p+nlen+tlen].tobytes().decode("utf-8")
+                s = VectorSection(set, name, title)
+            elif tag == TAG_VALUE and s is not None:
+                kind, nlen = _value.unpack_from(payload)
+                p = _value.size
+                name = payload[p:p+nlen].tobytes().decode("utf-8")
+                data = payload[p+nlen:]
+                if kind == KIND_DEC:
+                    data = bytes_to_long(data.tobytes())
+                s.values.append((name, data))
+            else:
+                raise ValueError("unknown record tag %d" % tag)
+            offset = body + length
+    except struct.error:
+        raise ValueError("vector file is corrupt")
+    raise ValueError("vector file is truncated")
+
+def read(path):
+    """Yield the VectorSections of the vector file at path, in either
+    format. Binary files are memory-mapped."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(0)
+            for s in read_jsonl(f):
+                yield s
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for s in read_binary(m):
+            yield s
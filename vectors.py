@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+# this should work with both python2.7 and python3.3
+
+# The test-vector computations from the spec, expressed as a graph of named
+# stages. Each stage declares the stages it depends upon and records the
+# values it wants published into a Section. Vectors computes a stage (and
+# its transitive dependencies) only when somebody asks for it, and
+# remembers the result, so regenerating e.g. the /account/keys vectors
+# does not pay for the SRP searches.
+
+import itertools, binascii, sys
+import six
+from six import binary_type, print_, int2byte
+from hkdf import HKDF
+from bytexor import xor
+import bundle
+import mysrp
+import entropy
+import stretch
+from stretch import mainKDF
+
+def thencount(*values):
+    for v in values:
+        yield v
+    for c in itertools.count():
+        yield c
+
+def split(value):
+    assert len(value)%32 == 0
+    return [value[i:i+32] for i in range(0, len(value), 32)]
+def KW(name):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name)
+def KWE(name, emailUTF8):
+    return b"identity.mozilla.com/picl/v1/" + six.b(name) + b":" + emailUTF8
+
+def fakeKey(start):
+    return b"".join([int2byte(c) for c in range(start, start+32)])
+
+def progress(*args):
+    # search progress is not part of the vectors, keep it off stdout
+    print_(*args, file=sys.stderr)
+
+# The inputs of the fixed vector set. mainSalt, srpSalt, b and a are None,
+# which means "search for a value with a leading zero" (see the find*()
+# functions below). Callers can override any of these.
+DEFAULT_INPUTS = {
+    "email": u"andré@example.org".encode("utf-8"),
+    "password": u"pässwörd".encode("utf-8"),
+    "kA": fakeKey(1*32),
+    "wrapkB": fakeKey(2*32),
+    "authToken": fakeKey(3*32),
+    "keyFetchToken": fakeKey(4*32),
+    "sessionToken": fakeKey(5*32),
+    "accountResetToken": fakeKey(6*32),
+    "newSRPv": b"\x11"*(2048//8),
+    "mainSalt": None,
+    "srpSalt": None,
+    "b": None,
+    "a": None,
+    "PBKDF2-rounds": stretch.PBKDF2_ROUNDS,
+    "scrypt-N": stretch.SCRYPT_N,
+    "scrypt-r": stretch.SCRYPT_R,
+    "scrypt-p": stretch.SCRYPT_P,
+    }
+
+# alphabets for random_inputs(), with some multi-byte UTF-8 thrown in
+EMAIL_CHARS = u"abcdefghijklmnopqrstuvwxyz0123456789.+-_\u00e9\u00fc\u00df"
+PASSWORD_CHARS = (u"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+                  u"0123456789 !#$%&*+,-./:;<=>?@[]^_{|}~"
+                  u"\u00e4\u00f6\u00fc\u00e9\u20ac\u6f22\U0001f511")
+
+def random_inputs(seed, index, params=None):
+    """Return inputs for randomized vector set number 'index': random
+    email, password, tokens, salts and SRP ephemerals, with no searching
+    for leading zeros. The same (seed, index) always gives the same
+    inputs, regardless of which process computes them. params can
+    override inputs, e.g. to scale down the stretch for fuzzing."""
+    rng = entropy.DRBG("picl-vectors:%s:%d" % (seed, index))
+    randbytes = rng.random_bytes
+    def randtext(chars, lo, hi):
+        return u"".join(rng.choice(chars)
+                        for i in range(rng.randint(lo, hi)))
+    inputs = {
+        "email": (randtext(EMAIL_CHARS, 1, 24) + u"@" +
+                  randtext(EMAIL_CHARS, 1, 12) + u".org").encode("utf-8"),
+        "password": randtext(PASSWORD_CHARS, 0, 32).encode("utf-8"),
+        "newSRPv": randbytes(2048//8),
+        "mainSalt": randbytes(32),
+        "srpSalt": randbytes(32),
+        "b": rng.randint(1, mysrp.N-1),
+        "a": rng.randint(1, mysrp.N-1),
+        }
+    for name in ("kA", "wrapkB", "authToken", "keyFetchToken",
+                 "sessionToken", "accountResetToken"):
+        inputs[name] = randbytes(32)
+    inputs.update(params or {})
+    return inputs
+
+def random_set(job):
+    """Compute one randomized vector set. job is (seed, index, params,
+    sections), so this can be handed to multiprocessing.Pool.imap.
+    Returns (index, [Section, ..]): the sections asked for and the ones
+    they depend upon, which a conformance check needs as its inputs."""
+    seed, index, params, sections = job
+    v = Vectors(random_inputs(seed, index, params))
+    return index, v.run(sections)
+
+class Section:
+    """The published output of one stage: a header and an ordered list of
+    (kind, label, value, groups_per_line) entries, where kind is "hex",
+    "dec", or "note"."""
+    def __init__(self, name, title):
+        self.name = name
+        self.title = title
+        self.entries = []
+    def hex(self, label, value, groups_per_line=1):
+        assert isinstance(value, binary_type), type(value)
+        self.entries.append(("hex", label, value, groups_per_line))
+    def dec(self, label, n):
+        self.entries.append(("dec", label, n, None))
+    def note(self, message):
+        self.entries.append(("note", None, message, None))
+
+STAGES = {} # name -> (title, deps, function)
+ORDER = [] # names, in the order the spec presents them
+
+def stage(name, title, *deps):
+    def _register(f):
+        STAGES[name] = (title, deps, f)
+        ORDER.append(name)
+        return f
+    return _register
+
+def closure(names):
+    """Return the given stages plus everything they depend upon, in ORDER."""
+    needed = set()
+    def _visit(name):
+        if name not in STAGES:
+            raise KeyError("unknown section %r" % (name,))
+        if name in needed:
+            return
+        needed.add(name)
+        for dep in STAGES[name][1]:
+            _visit(dep)
+    for name in names:
+        _visit(name)
+    return [name for name in ORDER if name in needed]
+
+class Vectors:
+    """Compute stages on demand. Each stage function gets this object and
+    its Section, reads inputs and earlier results with v[name], and returns
+    a dict of results for later stages. Results are memoized, so every
+    stage runs at most once per Vectors instance. When emit= is given, it
+    is called with each Section as soon as its stage finishes. kdf= is
+    what does the stretch: the stretch module, or a kdfd.Client."""
+    def __init__(self, inputs=None, emit=None, kdf=None):
+        self.inputs = dict(DEFAULT_INPUTS)
+        if inputs:
+            self.inputs.update(inputs)
+        self.emit = emit
+        self.kdf = kdf or stretch
+        self.results = {}
+        self.sections = {}
+
+    def __getitem__(self, key):
+        if key in self.results:
+            return self.results[key]
+        return self.inputs[key]
+
+    def compute(self, name):
+        if name in self.sections:
+            return self.sections[name]
+        title, deps, f = STAGES[name]
+        for dep in deps:
+            self.compute(dep)
+        section = Section(name, title)
+        self.results.update(f(self, section) or {})
+        self.sections[name] = section
+        if self.emit:
+            self.emit(section)
+        return section
+
+    def run(self, names=None):
+        """Compute the given stages (default: all of them) and their
+        dependencies, in spec order. Returns the list of Sections."""
+        return [self.compute(name) for name in closure(names or ORDER)]
+
+
+@stage("stretch", "stretch-KDF")
+def stretch_kdf(v, out):
+    emailUTF8, passwordUTF8 = v["email"], v["password"]
+    out.hex("email", emailUTF8)
+    out.hex("password", passwordUTF8)
+    # only published when they differ from the spec, e.g. for fuzzing
+    for name in ("PBKDF2-rounds", "scrypt-N", "scrypt-r", "scrypt-p"):
+        if v[name] != DEFAULT_INPUTS[name]:
+            out.dec(name, v[name])
+    k1, k2, stretchedPW = v.kdf.stretch(emailUTF8, passwordUTF8,
+                                       v["PBKDF2-rounds"], v["scrypt-N"],
+                                       v["scrypt-r"], v["scrypt-p"])
+    out.hex("K1 (scrypt input)", k1)
+    out.hex("K2 (scrypt output)", k2)
+    out.hex("stretchedPW", stretchedPW)
+    return {"stretchedPW": stretchedPW}
+
+def findMainSalt(stretchedPW, out):
+    out.note("looking for mainSalt that yields an srpPW with leading zero")
+    prefix = b"\x00"+b"\xf0"+b"\x00"*14
+    for count in thencount(845):
+        # about 20000 per second
+        if count > 300 and count % 500 == 0:
+            progress(count, "tries")
+        if count > 1000000:
+            raise ValueError("unable to find suitable salt in reasonable time")
+        mainSalt = prefix + binascii.unhexlify("%032x"%count)
+        (srpPW, unwrapBKey) = mainKDF(stretchedPW, mainSalt)
+        if srpPW[0:1] != b"\x00":
+            continue
+        out.note("found salt on count %d" % count)
+        return mainSalt
+
+@stage("main-kdf", "main-KDF", "stretch")
+def main_kdf(v, out):
+    mainSalt = v["mainSalt"]
+    if mainSalt is None:
+        mainSalt = findMainSalt(v["stretchedPW"], out)
+    (srpPW, unwrapBKey) = mainKDF(v["stretchedPW"], mainSalt)
+    out.hex("mainSalt (normally random)", mainSalt)
+    out.hex("srpPW", srpPW)
+    out.hex("unwrapBKey", unwrapBKey)
+    return {"mainSalt": mainSalt, "srpPW": srpPW, "unwrapBKey": unwrapBKey}
+
+# choose a salt that gives us a verifier with a leading zero, to ensure we
+# exercise padding behavior in implementations of this spec. Otherwise
+# padding bugs (dropping a leading zero) would hide in about 255 out of 256
+# test runs.
+def findSalt(emailUTF8, srpPW, out):
+    out.note("looking for srpSalt that yields an srpVerifier with leading zero")
+    makeV = mysrp.create_verifier
+    prefix = b"\x00"+b"\xf1"+b"\x00"*14
+    for count in thencount(377):
+        # about 500 per second
+        if count > 300 and count % 500 == 0:
+            progress(count, "tries")
+        if count > 1000000:
+            raise ValueError("unable to find suitable salt in reasonable time")
+        salt = prefix + binascii.unhexlify("%032x"%count)
+        (srpVerifier, v_num, x_str, x_num, _) = makeV(emailUTF8, srpPW, salt)
+        if srpVerifier[0:1] != b"\x00":
+            continue
+        out.note("found salt on count %d" % count)
+        return salt
+
+@stage("srp-verifier", "SRP Verifier", "main-kdf")
+def srp_verifier(v, out):
+    emailUTF8, srpPW = v["email"], v["srpPW"]
+    srpSalt = v["srpSalt"]
+    if srpSalt is None:
+        srpSalt = findSalt(emailUTF8, srpPW, out)
+    (srpVerifier, v_num, x_str, x_num, _) = mysrp.create_verifier(emailUTF8,
+                                                                  srpPW,
+                                                                  srpSalt)
+    out.dec("internal x", x_num)
+    out.hex("internal x (hex)", x_str)
+    out.dec("v (verifier as number)", v_num)
+    out.dec("k", mysrp.k)
+    out.hex("srpSalt (normally random)", srpSalt)
+    out.hex("srpVerifier", srpVerifier, groups_per_line=2)
+    return {"srpSalt": srpSalt, "srpVerifier": srpVerifier}
+
+def findB(srpVerifier, out):
+    out.note("looking for 'b' that yields srpA with leading zero")
+    prefix = b"\x00"+b"\xf3"+b"\x00"*(256-2-16)
+    s = mysrp.Server(srpVerifier)
+    for count in thencount(15):
+        if count > 300 and count % 500 == 0:
+            progress(count, "tries")
+        if count > 1000000:
+            raise ValueError("unable to find suitable value in reasonable time")
+        b_str = prefix + binascii.unhexlify("%032x"%count)
+        assert len(b_str) == 2048//8, (len(b_str),2048//8)
+        b = mysrp.bytes_to_long(b_str)
+        B = s.one(b)
+        if B[0:1] != b"\x00":
+            continue
+        out.note("found b on count %d" % count)
+        return b
+
+@stage("srp-b", "SRP B", "srp-verifier")
+def srp_b(v, out):
+    b = v["b"]
+    if b is None:
+        b = findB(v["srpVerifier"], out)
+    B = mysrp.Server(v["srpVerifier"]).one(b)
+    out.dec("private b (normally random)", b)
+    out.hex("private b (hex)", mysrp.long_to_padded_bytes(b),
+            groups_per_line=2)
+    out.hex("transmitted srpB", B, groups_per_line=2)
+    return {"b": b, "B": B}
+
+def findA(B, srpSalt, emailUTF8, srpPW, out):
+    out.note("looking for 'a' that yields srpA with leading zero")
+    # 'a' is in [1..N-1], so 2048 bits, or 256 bytes
+    prefix = b"\x00"+b"\xf2"+b"\x00"*(256-2-16)
+    c = mysrp.Client()
+    num_near_misses = 0
+    # hm.. this reports an awful lot of consecutive "near-misses". But, this
+    # a->A transformation isn't supposed to be strong against related "keys".
+    for count in thencount(54231):
+        # this processes about 50 per second. 2^16 needs about 20 minutes.
+        if count > 300 and count % 500 == 0:
+            progress(count, "tries")
+        if count > 1000000:
+            raise ValueError("unable to find suitable value in reasonable time")
+        a_str = prefix + binascii.unhexlify("%032x"%count)
+        assert len(a_str) == 2048//8, (len(a_str),2048//8)
+        a = mysrp.bytes_to_long(a_str)
+        A = c.one(a)
+        if A[0:1] != b"\x00":
+            continue
+        num_near_misses += 1
+        # also require that the computed S has a leading zero
+        c.two(B, srpSalt, emailUTF8, srpPW)
+        if c._debug_S_bytes[0:1] != b"\x00":
+            progress("found good A, but not good S, on count %d "
+                     "(near misses=%d)" % (count, num_near_misses))
+            continue
+        out.note("found a on count %d" % count)
+        return a
+
+@stage("srp-a", "SRP A", "srp-b")
+def srp_a(v, out):
+    a = v["a"]
+    if a is None:
+        a = findA(v["B"], v["srpSalt"], v["email"], v["srpPW"], out)
+    A = mysrp.Client().one(a)
+    out.dec("private a (normally random)", a)
+    out.hex("private a (hex)", mysrp.long_to_padded_bytes(a),
+            groups_per_line=2)
+    out.hex("transmitted srpA", A, groups_per_line=2)
+    return {"a": a, "A": A}
+
+@stage("srp", "SRP key-agreement", "srp-a")
+def srp(v, out):
+    c = mysrp.Client()
+    s = mysrp.Server(v["srpVerifier"])
+    A = c.one(v["a"])
+    assert A == v["A"]
+    M1 = c.two(v["B"], v["srpSalt"], v["email"], v["srpPW"])
+    B = s.one(v["b"])
+    assert B == v["B"]
+    s.two(A, M1)
+    assert c.get_key() == s.get_key()
+    out.hex("u", c._debug_u_bytes, groups_per_line=2)
+    out.hex("S", c._debug_S_bytes, groups_per_line=2)
+    out.hex("M1", M1)
+    srpK = c.get_key()
+    out.hex("srpK", srpK)
+    return {"M1": M1, "srpK": srpK}
+
+def publish_bundle(out, keys, plaintext):
+    response = keys.seal(plaintext)
+    out.hex("ciphertext", response[:-bundle.MAC_LENGTH])
+    out.hex("MAC", response[-bundle.MAC_LENGTH:])
+    out.hex("response", response)
+
+@stage("auth", "/auth", "srp")
+def auth(v, out):
+    srpK, authToken = v["srpK"], v["authToken"]
+    plaintext = authToken
+    keys = bundle.BundleKeys(srpK, "auth/finish", len(plaintext))
+    out.hex("srpK", srpK)
+    out.hex("respHMACkey", keys.hmacKey.tobytes())
+    out.hex("respXORkey", keys.xorKey.tobytes())
+
+    out.hex("authToken", authToken)
+    out.hex("plaintext", plaintext)
+    publish_bundle(out, keys, plaintext)
+
+@stage("authtoken", "authtoken")
+def authtoken(v, out):
+    authToken = v["authToken"]
+    x = HKDF(SKM=authToken,
+             dkLen=3*32,
+             XTS=None,
+             CTXinfo=KW("authToken"))
+    authTokenID = x[0:32]
+    authreqHMACkey = x[32:64]
+    requestKey = x[64:96]
+    out.hex("authToken", authToken)
+    out.hex("tokenID (authToken)", authTokenID)
+    out.hex("reqHMACkey", authreqHMACkey)
+    out.hex("requestKey", requestKey)
+    return {"authTokenID": authTokenID, "authreqHMACkey": authreqHMACkey,
+            "requestKey": requestKey}
+
+@stage("session", "/session", "authtoken")
+def session(v, out):
+    requestKey = v["requestKey"]
+    keyFetchToken, sessionToken = v["keyFetchToken"], v["sessionToken"]
+    plaintext = keyFetchToken+sessionToken
+    keys = bundle.BundleKeys(requestKey, "session/create", len(plaintext))
+    out.hex("requestKey", requestKey)
+    out.hex("respHMACkey", keys.hmacKey.tobytes())
+    out.hex("respXORkey", keys.xorKey.tobytes())
+
+    out.hex("keyFetchToken", keyFetchToken)
+    out.hex("sessionToken", sessionToken)
+    out.hex("plaintext", plaintext)
+    publish_bundle(out, keys, plaintext)
+
+@stage("keys", "/account/keys", "main-kdf")
+def keys(v, out):
+    keyFetchToken, kA, wrapkB = v["keyFetchToken"], v["kA"], v["wrapkB"]
+    unwrapBKey = v["unwrapBKey"]
+    plaintext = kA+wrapkB
+    keys = bundle.BundleKeys(keyFetchToken, "account/keys", len(plaintext))
+    tokenID, reqHMACkey = keys.split()
+    out.hex("keyFetchToken", keyFetchToken)
+    out.hex("tokenID (keyFetchToken)", tokenID)
+    out.hex("reqHMACkey", reqHMACkey)
+    out.hex("respHMACkey", keys.hmacKey.tobytes())
+    out.hex("respXORkey", keys.xorKey.tobytes())
+
+    out.hex("kA", kA)
+    out.hex("wrapkB", wrapkB)
+    out.hex("plaintext", plaintext)
+    publish_bundle(out, keys, plaintext)
+
+    out.hex("wrapkB", wrapkB)
+    out.hex("unwrapBKey", unwrapBKey)
+    kB = xor(wrapkB, unwrapBKey)
+    out.hex("kB", kB)
+
+@stage("use-session", "use session (certificate/sign, etc)")
+def use_session(v, out):
+    sessionToken = v["sessionToken"]
+    tokenID,reqHMACkey = split(HKDF(SKM=sessionToken,
+                                    XTS=None,
+                                    dkLen=2*32,
+                                    CTXinfo=KW("session")))
+    out.hex("sessionToken", sessionToken)
+    out.hex("tokenID (sessionToken)", tokenID)
+    out.hex("reqHMACkey", reqHMACkey)
+
+@stage("password-change", "/password/change", "authtoken")
+def password_change(v, out):
+    requestKey = v["requestKey"]
+    keyFetchToken = v["keyFetchToken"]
+    accountResetToken = v["accountResetToken"]
+    plaintext = keyFetchToken+accountResetToken
+    keys = bundle.BundleKeys(requestKey, "password/change", len(plaintext))
+    out.hex("requestKey", requestKey)
+    out.hex("respHMACkey", keys.hmacKey.tobytes())
+    out.hex("respXORkey", keys.xorKey.tobytes())
+
+    out.hex("keyFetchToken", keyFetchToken)
+    out.hex("accountResetToken", accountResetToken)
+    out.hex("plaintext", plaintext)
+    publish_bundle(out, keys, plaintext)
+
+@stage("reset", "/account/reset")
+def reset(v, out):
+    accountResetToken = v["accountResetToken"]
+    wrapkB, newSRPv = v["wrapkB"], v["newSRPv"]
+    plaintext = wrapkB+newSRPv
+    # a request rather than a response: there is no MAC, the key after
+    # tokenID is the reqHMACkey used to sign the request
+    keys = bundle.BundleKeys(accountResetToken, "account/reset",
+                             len(plaintext))
+    (tokenID,) = keys.split()
+    reqHMACkey = keys.hmacKey.tobytes()
+    reqXORkey = keys.xorKey.tobytes()
+    out.hex("accountResetToken", accountResetToken)
+    out.hex("tokenID (accountResetToken)", tokenID)
+    out.hex("reqHMACkey", reqHMACkey)
+    out.hex("reqXORkey", reqXORkey, groups_per_line=2)
+    out.hex("wrapkB", wrapkB)
+    out.hex("newSRPv", newSRPv)
+    out.hex("plaintext", plaintext, groups_per_line=2)
+    ciphertext = xor(plaintext, reqXORkey)
+    out.hex("ciphertext", ciphertext, groups_per_line=2)
+
+@stage("destroy", "/account/destroy", "authtoken")
+def destroy(v, out):
+    out.hex("authToken", v["authToken"])
+    out.hex("tokenID (authToken)", v["authTokenID"])
+    out.hex("reqHMACkey", v["authreqHMACkey"])
@@ -0,0 +1,421 @@
+# this should work with both python2.7 and python3.3
+
+# An on-disk store of what the server needs for session/auth/start: each
+# account's srpSalt, mainKDFSalt, SRP verifier and stretch parameters,
+# found by the SHA256 of the email. The file is memory-mapped, so opening
+# it costs nothing however many accounts it holds, and a lookup reads
+# straight out of the mapping:
+#
+#   [header: 4096 bytes]
+#   [index: 'slots' uint64s]     record number + 1, 0 = empty,
+#                                2**64-1 = deleted
+#   [records: 'capacity' fixed-size records, appended in order]
+#
+# The index is an open-addressing hash table (linear probing, at most half
+# full) keyed by the first 8 bytes of the email hash. Records are never
+# changed once written: put() appends a new record and then swaps the
+# account's index slot over to it, with a single aligned 8-byte write. The
+# writes go in the order record, header count, slot, so a crash at any
+# point leaves each account with either its old record or its new one.
+# With durable=True each step is msync()ed before the next one, which
+# extends that to the OS crashing too.
+#
+# When the records run out, the live ones are copied to a new file with
+# twice the capacity, which is then renamed over the old one. A million
+# accounts take 384 MB of records plus 16 MB of index.
+#
+# One process may write at a time; readers in other threads need no lock.
+# A reader holds on to the mapping it started with: when the file is
+# replaced, the old mapping is not closed but left for the garbage
+# collector, so a lookup that is under way (and any Record it returned)
+# carries on reading the old file, which is a snapshot from just before
+# the growth.
+
+import os, mmap, struct, threading
+from hashlib import sha256
+import six
+
+MAGIC = b"PICLVS1\x00"
+HEADER_SIZE = 4096
+RECORD_SIZE = 384
+DEFAULT_CAPACITY = 1024
+
+# magic, record size, dirty flag, capacity, slots, records written, live
+_header = struct.Struct(">8sII4Q")
+_COUNT_OFFSET = 24
+_slot = struct.Struct(">Q")
+EMPTY, DELETED = 0, 2**64-1
+
+# email hash, srpSalt length and srpSalt (up to 32 bytes), mainKDFSalt,
+# verifier, PBKDF2 rounds, scrypt N; the rest is zero
+_record = struct.Struct(">32sB32s32s256sII")
+assert _record.size <= RECORD_SIZE
+_SALT_OFFSET, _MAINSALT_OFFSET, _VERIFIER_OFFSET = 33, 65, 97
+_PARAMS_OFFSET = 353
+
+if six.PY3:
+    def _view(obj, offset, size):
+        return memoryview(obj)[offset:offset+size]
+else:
+    # python2's mmap only has the old buffer interface
+    def _view(obj, offset, size):
+        return buffer(obj, offset, size)
+
+def emailHash(emailUTF8):
+    return sha256(emailUTF8).digest()
+
+class StoreError(ValueError):
+    pass
+
+class Record:
+    """One account, read in place from the mapping: srpSalt, mainKDFSalt
+    and verifier are read-only buffers into the file (copy them with
+    bytes(bytearray(..)) to keep them), valid until the store is closed.
+    After the store grows they still show the record as it was."""
+    __slots__ = ("_mm", "_offset")
+    def __init__(self, mm, offset):
+        self._mm, self._offset = mm, offset
+
+    @property
+    def emailHash(self):
+        return self._mm[self._offset:self._offset+32]
+    @property
+    def srpSalt(self):
+        length = struct.unpack_from("B", self._mm, self._offset+32)[0]
+        return _view(self._mm, self._offset+_SALT_OFFSET, length)
+    @property
+    def mainKDFSalt(self):
+        return _view(self._mm, self._offset+_MAINSALT_OFFSET, 32)
+    @property
+    def verifier(self):
+        return _view(self._mm, self._offset+_VERIFIER_OFFSET, 256)
+    @property
+    def rounds(self):
+        return struct.unpack_from(">I", self._mm,
+                                  self._offset+_PARAMS_OFFSET)[0]
+    @property
+    def scryptN(self):
+        return struct.unpack_from(">I", self._mm,
+                                  self._offset+_PARAMS_OFFSET+4)[0]
+
+    def account(self):
+        """The same, copied into a dict of bytes."""
+        b = lambda v: bytes(bytearray(v))
+        return {"srpSalt": b(self.srpSalt),
+                "mainKDFSalt": b(self.mainKDFSalt),
+                "verifier": b(self.verifier),
+                "rounds": self.rounds, "scryptN": self.scryptN}
+
+def _pack(emailUTF8, srpSalt, mainKDFSalt, verifier, rounds, scryptN):
+    if len(srpSalt) > 32:
+        raise StoreError("srpSalt is longer than 32 bytes")
+    if len(mainKDFSalt) != 32:
+        raise StoreError("mainKDFSalt must be 32 bytes")
+    if len(verifier) != 256:
+        raise StoreError("verifier must be 256 bytes")
+    return _record.pack(emailHash(emailUTF8), len(srpSalt), srpSalt,
+                        mainKDFSalt, verifier, rounds, scryptN).ljust(
+                            RECORD_SIZE, b"\x00")
+
+def _slotsFor(capacity):
+    slots = 512
+    while slots < 2*capacity:
+        slots *= 2
+    return slots
+
+def _layout(capacity, slots):
+    recordsStart = HEADER_SIZE + 8*slots
+    return recordsStart, recordsStart + RECORD_SIZE*capacity
+
+class _Map:
+    # everything a reader needs, swapped in as one object when the file
+    # is replaced
+    def __init__(self, f, mm, capacity, slots):
+        self.f, self.mm = f, mm
+        self.capacity, self.slots = capacity, slots
+        self.recordsStart = _layout(capacity, slots)[0]
+
+class VerifierStore:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, durable=False):
+        """Open the store at path, creating it with room for 'capacity'
+        records if it does not exist."""
+        self.path = path
+        self.durable = durable
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            self._create(path, capacity)
+        self._map = self._open(path)
+        header = _header.unpack_from(self._map.mm, 0)
+        dirty, self._count, self._live = header[2], header[5], header[6]
+        if dirty:
+            # not closed cleanly: the live count may be behind
+            self._live = self._recount()
+
+    def _create(self, path, capacity):
+        slots = _slotsFor(capacity)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_header.pack(MAGIC, RECORD_SIZE, 0, capacity, slots,
+                                 0, 0))
+            f.truncate(_layout(capacity, slots)[1])
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    def _open(self, path):
+        f = open(path, "r+b")
+        mm = mmap.mmap(f.fileno(), 0)
+        (magic, recordSize, dirty, capacity, slots,
+         count, live) = _header.unpack_from(mm, 0)
+        if magic != MAGIC or recordSize != RECORD_SIZE:
+            raise StoreError("%s is not a verifier store" % path)
+        if len(mm) < _layout(capacity, slots)[1] or count > capacity:
+            raise StoreError("%s is truncated" % path)
+        return _Map(f, mm, capacity, slots)
+
+    def _writeHeader(self, dirty):
+        m = self._map
+        m.mm[:_header.size] = _header.pack(MAGIC, RECORD_SIZE, int(dirty),
+                                           m.capacity, m.slots, self._count,
+                                           self._live)
+
+    def _sync(self):
+        if self.durable:
+            self._map.mm.flush()
+
+    def _recount(self):
+        m = self._map
+        return len([1 for i in range(m.slots)
+                    if _slot.unpack_from(m.mm, HEADER_SIZE+8*i)[0]
+                    not in (EMPTY, DELETED)])
+
+    def _probe(self, m, h):
+        """Return (slot index holding h, or None; first reusable slot)."""
+        mask = m.slots - 1
+        i = _slot.unpack(h[:8])[0] & mask
+        free = None
+        while True:
+            value = _slot.unpack_from(m.mm, HEADER_SIZE+8*i)[0]
+            if value == EMPTY:
+                return None, (i if free is None else free)
+            if value == DELETED:
+                if free is None:
+                    free = i
+            else:
+                offset = m.recordsStart + RECORD_SIZE*(value-1)
+                if m.mm[offset:offset+32] == h:
+                    return i, i
+            i = (i + 1) & mask
+
+    def get(self, emailUTF8):
+        """Return the account's Record, or None."""
+        m = self._map
+        i, _ = self._probe(m, emailHash(emailUTF8))
+        if i is None:
+            return None
+        value = _slot.unpack_from(m.mm, HEADER_SIZE+8*i)[0]
+        return Record(m.mm, m.recordsStart + RECORD_SIZE*(value-1))
+
+    def __contains__(self, emailUTF8):
+        return self.get(emailUTF8) is not None
+
+    def __len__(self):
+        return self._live
+
+    def put(self, emailUTF8, srpSalt, mainKDFSalt, verifier, rounds=20000,
+            scryptN=64*1024):
+        """Add the account, or replace its record."""
+        self.put_many([(emailUTF8, srpSalt, mainKDFSalt, verifier, rounds,
+                        scryptN)])
+
+    def put_many(self, accounts):
+        """Add or replace many accounts, given as tuples of put()'s
+        arguments, with one sync per step for the whole batch. Much faster
+        than put() for bulk loading, and just as safe: a crash part-way
+        through leaves some prefix of the batch stored."""
+        records = [(emailHash(a[0]), _pack(*a)) for a in accounts]
+        with self._lock:
+            while records:
+                room = self._map.capacity - self._count
+                if room == 0:
+                    self._rebuild(2*self._map.capacity)
+                    continue
+                batch, records = records[:room], records[room:]
+                self._append(batch)
+
+    def _append(self, batch):
+        m = self._map
+        self._writeHeader(dirty=True)
+        # 1: the records, past the end of the committed ones
+        first = self._count
+        offset = m.recordsStart + RECORD_SIZE*first
+        m.mm[offset:offset+RECORD_SIZE*len(batch)] = b"".join(
+            r for (h, r) in batch)
+        self._sync()
+        # 2: commit them, so they are never overwritten
+        self._count += len(batch)
+        m.mm[_COUNT_OFFSET:_COUNT_OFFSET+8] = _slot.pack(self._count)
+        self._sync()
+        # 3: point the index at them
+        for n, (h, r) in enumerate(batch):
+            i, free = self._probe(m, h)
+            if i is None:
+                i = free
+                self._live += 1
+            m.mm[HEADER_SIZE+8*i:HEADER_SIZE+8*i+8] = _slot.pack(first+n+1)
+        self._sync()
+
+    def delete(self, emailUTF8):
+        """Remove the account. Returns whether there was one."""
+        with self._lock:
+            m = self._map
+            i, _ = self._probe(m, emailHash(emailUTF8))
+            if i is None:
+                return False
+            self._writeHeader(dirty=True)
+            m.mm[HEADER_SIZE+8*i:HEADER_SIZE+8*i+8] = _slot.pack(DELETED)
+            self._live -= 1
+            self._sync()
+            return True
+
+    def compact(self):
+        """Drop the records that were replaced or deleted."""
+        with self._lock:
+            self._rebuild(max(2*self._live, DEFAULT_CAPACITY))
+
+    def _rebuild(self, capacity):
+        # write the live records to a new file, and rename it over this one
+        old = self._map
+        slots = _slotsFor(capacity)
+        recordsStart, size = _layout(capacity, slots)
+        tmp = self.path + ".tmp"
+        live = 0
+        with open(tmp, "w+b") as f:
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), 0)
+            new = _Map(None, mm, capacity, slots)
+            for i in range(old.slots):
+                value = _slot.unpack_from(old.mm, HEADER_SIZE+8*i)[0]
+                if value in (EMPTY, DELETED):
+                    continue
+                src = old.recordsStart + RECORD_SIZE*(value-1)
+                record = old.mm[src:src+RECORD_SIZE]
+                dst = recordsStart + RECORD_SIZE*live
+                mm[dst:dst+RECORD_SIZE] = record
+                live += 1
+                _, free = self._probe(new, record[:32])
+                mm[HEADER_SIZE+8*free:HEADER_SIZE+8*free+8] = _slot.pack(live)
+            mm[:_header.size] = _header.pack(MAGIC, RECORD_SIZE, 0, capacity,
+                                             slots, live, live)
+            mm.flush()
+            mm.close()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        self._map = self._open(self.path)
+        self._count = self._live = live
+        # not old.mm: readers may still be using it (the mapping holds its
+        # own file descriptor, and goes when the last of them is done)
+        old.f.close()
+
+    def _close(self, m):
+        try:
+            m.mm.close()
+        except BufferError: # a Record's buffer is still around
+            pass
+        m.f.close()
+
+    def sync(self):
+        """Write everything to disk and mark the file as cleanly closed."""
+        with self._lock:
+            self._writeHeader(dirty=False)
+            self._map.mm.flush()
+
+    def close(self):
+        self.sync()
+        self._close(self._map)
+
+    def stats(self):
+        m = self._map
+        return {"live": self._live, "records": self._count,
+                "capacity": m.capacity, "slots": m.slots,
+                "bytes": _layout(m.capacity, m.slots)[1]}
+
+
+def test():
+    import shutil, tempfile, time
+    import mysrp
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, "verifiers")
+        s = VerifierStore(path, capacity=10)
+        def account(i):
+            emailUTF8 = ("user%d@example.org" % i).encode("ascii")
+            srpSalt = sha256(b"salt" + emailUTF8).digest()[:4+i%29]
+            v = mysrp.create_verifier(emailUTF8, b"pw", srpSalt)[0]
+            return (emailUTF8, srpSalt, sha256(emailUTF8).digest(), v,
+                    1000+i, 1024)
+        accounts = [account(i) for i in range(25)]
+        s.put_many(accounts[:20]) # grows twice
+        for a in accounts[20:]:
+            s.put(*a)
+        assert len(s) == 25, len(s)
+        r = s.get(accounts[7][0])
+        assert r.account() == {"srpSalt": accounts[7][1],
+                               "mainKDFSalt": accounts[7][2],
+                               "verifier": accounts[7][3],
+                               "rounds": 1007, "scryptN": 1024}
+        assert s.get(b"nobody@example.org") is None
+        s.put(accounts[3][0], b"new", accounts[3][2], accounts[3][3], 5)
+        assert s.get(accounts[3][0]).account()["srpSalt"] == b"new"
+        assert s.delete(accounts[4][0]) and not s.delete(accounts[4][0])
+        assert accounts[4][0] not in s and len(s) == 24
+        s.close()
+        s = VerifierStore(path)
+        assert len(s) == 24
+        assert s.get(accounts[3][0]).rounds == 5
+        assert s.get(accounts[24][0]).account()["verifier"] == accounts[24][3]
+        s.compact()
+        assert len(s) == 24 and s.stats()["records"] == 24
+        assert s.get(accounts[12][0]).rounds == 1012
+
+        # lookups from other threads while the store grows under them
+        errors, stop = [], threading.Event()
+        def reader():
+            try:
+                while not stop.is_set():
+                    for a in accounts[:3]:
+                        assert s.get(a[0]).account()["verifier"] == a[3]
+            except Exception as e:
+                errors.append(e)
+        readers = [threading.Thread(target=reader) for i in range(4)]
+        for t in readers:
+            t.start()
+        capacity = s.stats()["capacity"]
+        for i in range(3000):
+            s.put(str(i).encode("ascii"), b"salt", b"m"*32, b"v"*256)
+        stop.set()
+        for t in readers:
+            t.join()
+        assert not errors, errors
+        assert s.stats()["capacity"] >= 4*capacity # grew twice
+        s.close()
+
+        n = 20000
+        start = time.time()
+        s = VerifierStore(os.path.join(d, "bulk"), capacity=n)
+        s.put_many((str(i).encode("ascii"), b"salt", b"m"*32, b"v"*256,
+                    20000, 65536)
+                   for i in range(n))
+        loaded = time.time()
+        for i in range(n):
+            s.get(str(i).encode("ascii"))
+        done = time.time()
+        print("bulk load %d: %.2fs, lookups: %.1f us each"
+              % (n, loaded-start, 1e6*(done-loaded)/n))
+        s.close()
+    finally:
+        shutil.rmtree(d)
+    print("test passed")
+
+if __name__ == '__main__':
+    test()